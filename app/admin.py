@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
-from app.models import Conversation, ConversationMessage
+from app.models import Attachment, Conversation, ConversationMessage
 User = get_user_model()
 
 
@@ -11,3 +11,4 @@ class UserAdmin(admin.ModelAdmin):
 
 admin.site.register(Conversation)
 admin.site.register(ConversationMessage)
+admin.site.register(Attachment)
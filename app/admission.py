@@ -0,0 +1,131 @@
+import time
+from django.conf import settings
+from app.caches import TTLCache
+
+# Close code of sockets that can't keep up with their events
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+class TokenBucket:
+    """
+    Allows `rate` actions per second on average, and bursts of up to
+    `burst` actions.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Spend a token if one is left.
+
+        Returns:
+        - allowed: False if the bucket is empty.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by user or conversation, read from settings on
+    every call.
+    - A bucket is forgotten once it would be full again, so memory only
+      grows with the keys that were active recently.
+    - Without a rate in settings, everything is allowed.
+    """
+    def __init__(self, rate_setting, burst_setting, maxsize=100000):
+        self.rate_setting = rate_setting
+        self.burst_setting = burst_setting
+        self.buckets = TTLCache(maxsize=maxsize, ttl=3600)
+
+    def allow(self, key):
+        rate = getattr(settings, self.rate_setting)
+        if not rate:
+            return True
+        burst = getattr(settings, self.burst_setting) or rate
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+        allowed = bucket.take()
+        self.buckets.set(key, bucket, ttl=burst / rate)
+        return allowed
+
+    def clear(self):
+        self.buckets.clear()
+
+
+class ConnectionLimiter:
+    """
+    Counts the open sockets of this process, per user and in total, against
+    CHAT_MAX_CONNECTIONS_PER_USER and CHAT_MAX_CONNECTIONS_PER_WORKER.
+    """
+    def __init__(self):
+        self.users = {}
+        self.total = 0
+
+    def acquire(self, user_id):
+        """
+        Admit a socket unless it would go over a limit.
+
+        Returns:
+        - reason: None if admitted, otherwise 'user' or 'worker'.
+        """
+        user_id = str(user_id)
+        per_worker = settings.CHAT_MAX_CONNECTIONS_PER_WORKER
+        per_user = settings.CHAT_MAX_CONNECTIONS_PER_USER
+        if per_worker is not None and self.total >= per_worker:
+            return 'worker'
+        if per_user is not None and self.users.get(user_id, 0) >= per_user:
+            return 'user'
+
+        self.users[user_id] = self.users.get(user_id, 0) + 1
+        self.total += 1
+        return None
+
+    def release(self, user_id):
+        user_id = str(user_id)
+        count = self.users.get(user_id, 0)
+        if not count:
+            return
+        if count == 1:
+            del self.users[user_id]
+        else:
+            self.users[user_id] = count - 1
+        self.total -= 1
+
+    def clear(self):
+        self.users.clear()
+        self.total = 0
+
+
+connections = ConnectionLimiter()
+
+user_message_limiter = RateLimiter('CHAT_USER_MESSAGE_RATE',
+                                   'CHAT_USER_MESSAGE_BURST')
+conversation_message_limiter = RateLimiter('CHAT_CONVERSATION_MESSAGE_RATE',
+                                           'CHAT_CONVERSATION_MESSAGE_BURST')
+
+
+def allow_message(user_id, group):
+    """
+    Spend a message token of the user, then one of the conversation.
+
+    Returns:
+    - scope: None if the message is allowed, otherwise the exhausted
+             limit, 'user' or 'conversation'.
+    """
+    if not user_message_limiter.allow(str(user_id)):
+        return 'user'
+    if not conversation_message_limiter.allow(group):
+        return 'conversation'
+    return None
@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    Bounded in-process cache with per-entry expiry.
+    - Least recently used entries are evicted once `maxsize` is reached.
+    - Safe to share between the event loop and the thread pool.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is _missing:
+                return default
+
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value for `ttl` seconds, defaults to the cache TTL.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _missing)
+        if entry is _missing or entry[1] <= time.monotonic():
+            return default
+        return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
@@ -1,52 +1,146 @@
+import time
 from urllib.parse import parse_qs
-from channels.auth import AuthMiddlewareStack
 from django.contrib.auth.models import AnonymousUser
-from django.db import close_old_connections
 from jwt import decode as jwt_decode
-from jwt import InvalidSignatureError, ExpiredSignatureError, DecodeError
+from jwt import InvalidTokenError, ExpiredSignatureError
 from django.conf import settings
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.models import TokenUser
+from app.caches import TTLCache
+from app.metrics import get_metrics, timed_database_call
 User = get_user_model()
 
+# Claims of verified tokens, keyed by the raw token.
+token_cache = TTLCache(maxsize=settings.CHAT_JWT_CACHE_SIZE,
+                       ttl=settings.CHAT_JWT_CACHE_TTL)
+
+# Users loaded from the database, keyed by user id.
+user_cache = TTLCache(maxsize=settings.CHAT_JWT_CACHE_SIZE,
+                      ttl=settings.CHAT_JWT_USER_CACHE_TTL)
+
+# Time of the last logout of each user. Tokens issued before it are
+# refused until they would have expired anyway.
+revoked_users = TTLCache(
+    maxsize=settings.CHAT_JWT_CACHE_SIZE,
+    ttl=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+)
+
+
+def verify_token(token):
+    """
+    Return the claims of a valid token, decoding it only on a cache miss.
+    - Raises InvalidTokenError if the token is invalid, expired or was
+      issued before the user logged out.
+    """
+    claims = token_cache.get(token)
+
+    if claims is None:
+        claims = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        token_cache.set(token, claims,
+                        ttl=claims.get('exp', float('inf')) - time.time())
+    elif claims.get('exp', float('inf')) <= time.time():
+        raise ExpiredSignatureError("Signature has expired")
+
+    # `iat` is in whole seconds, tokens issued in the second of the logout
+    # are refused as they may have been issued before it
+    revoked_at = revoked_users.get(str(claims['user_id']))
+    if revoked_at is not None and claims.get('iat', 0) <= revoked_at:
+        raise InvalidTokenError("Token has been revoked")
+
+    return claims
+
+
+def invalidate_user(user_id, revoke=False):
+    """
+    Drop the cached user, and refuse their older tokens if `revoke`.
+    """
+    user_id = str(user_id)
+    user_cache.pop(user_id)
+    if revoke:
+        revoked_users.set(user_id, time.time())
+
+
+def get_user(user_id):
+    """Return the user based on user id, or an AnonymousUser."""
+    try:
+        return User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        return AnonymousUser()
+
+
+async def aget_user(user_id):
+    """Async variant of get_user."""
+    try:
+        return await User.objects.aget(id=user_id)
+    except User.DoesNotExist:
+        return AnonymousUser()
+
+
+get_user_async = timed_database_call('db_user', get_user, aget_user)
+
 
 class JWTAuthMiddleware:
     """
     Custom JWT Auth Middleware for WebSocket Authentication
+    - Verified tokens and users are cached, so reconnecting clients don't
+      hit the database.
+    - With CHAT_JWT_STATELESS_USER, the user is built from the token claims
+      without any database query.
     """
     def __init__(self, app):
         self.app = app
 
     async def __call__(self, scope, receive, send):
-        close_old_connections()
+        metrics = get_metrics()
+        with metrics.timer('chat_stage_seconds', stage='handshake'):
+            await self.authenticate(scope)
+
+        metrics.increment('chat_handshakes_total',
+                          result=('authenticated'
+                                  if scope['user'].is_authenticated
+                                  else 'anonymous'))
+        return await self.app(scope, receive, send)
+
+    async def authenticate(self, scope):
+        """
+        Put the user of the token in the scope, or an AnonymousUser.
+        """
         try:
             # Decode the query string and get token parameter from it.
             token = parse_qs(scope["query_string"]
                              .decode("utf8")).get('token', None)[0]
 
-            # Decode the token to get the user id from it.
-            data = jwt_decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+            # Verify the token to get the user id from it.
+            data = verify_token(token)
 
-            # Get the user from database based on user id and
-            # add it to the scope.
-            scope['user'] = await self.get_user(data['user_id'])
-        except (TypeError, KeyError, InvalidSignatureError,
-                ExpiredSignatureError, DecodeError):
+            # Get the user based on user id and add it to the scope.
+            scope['user'] = await self.get_scope_user(data)
+        except (TypeError, KeyError, InvalidTokenError):
             # Set the user to Anonymous if token is not valid or expired.
             scope['user'] = AnonymousUser()
-        return await self.app(scope, receive, send)
 
-    @database_sync_to_async
-    def get_user(self, user_id):
+    async def get_scope_user(self, data):
+        """
+        Return the user of the token claims.
+        """
+        if settings.CHAT_JWT_STATELESS_USER:
+            return TokenUser(data)
+
+        user_id = str(data['user_id'])
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await self.get_user(user_id)
+            if user.is_authenticated:
+                user_cache.set(user_id, user)
+        return user
+
+    async def get_user(self, user_id):
         """Return the user based on user id."""
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return AnonymousUser()
+        return await get_user_async(user_id)
 
 
 def JWTAuthMiddlewareStack(app):
     """
-    This function wrap channels authentication stack with JWTAuthMiddleware.
+    This function wrap the app with JWTAuthMiddleware.
     """
-    return JWTAuthMiddleware(AuthMiddlewareStack(app))
+    return JWTAuthMiddleware(app)
@@ -0,0 +1,3 @@
+from app.channel_layers.sharded import ShardedChannelLayer
+
+__all__ = ['ShardedChannelLayer']
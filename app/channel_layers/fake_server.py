@@ -0,0 +1,215 @@
+import asyncio
+import fnmatch
+import time
+from collections import deque
+from app.channel_layers.resp import RespError, read_reply
+
+
+class FakeRespServer:
+    """
+    In-process server speaking the Redis protocol, for tests and local
+    development without an external service.
+    - Supports the commands used by ShardedChannelLayer only.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.data = {}
+        self.expires = {}
+        self._server = None
+        self._waiters = set()
+        self._clients = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle,
+                                                  self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        for task in self._clients:
+            task.cancel()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+        await self._server.wait_closed()
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}"
+
+    # Protocol
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            await self._serve(reader, writer)
+        except asyncio.CancelledError:
+            # The server is stopping
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    async def _serve(self, reader, writer):
+        while True:
+            try:
+                command = await read_reply(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+
+            name, *args = [part.decode('utf8') for part in command]
+            handler = getattr(self, f"cmd_{name.lower()}", None)
+            try:
+                if handler is None:
+                    raise RespError(f"ERR unknown command '{name}'")
+                reply = handler(*args)
+                if asyncio.iscoroutine(reply):
+                    reply = await reply
+            except RespError as e:
+                reply = e
+
+            writer.write(self._encode(reply))
+            await writer.drain()
+
+    def _encode(self, reply):
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, RespError):
+            return b'-%s\r\n' % str(reply).encode('utf8')
+        if isinstance(reply, bool):
+            return b'+OK\r\n'
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, str):
+            reply = reply.encode('utf8')
+        if isinstance(reply, bytes):
+            return b'$%d\r\n%s\r\n' % (len(reply), reply)
+        return (b'*%d\r\n' % len(reply)
+                + b''.join(self._encode(item) for item in reply))
+
+    # Keyspace
+
+    def _get(self, key, kind):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise RespError("WRONGTYPE Operation against a key holding "
+                            "the wrong kind of value")
+        return value
+
+    def _notify(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def cmd_ping(self):
+        return 'PONG'
+
+    def cmd_flushall(self):
+        self.data.clear()
+        self.expires.clear()
+        return True
+
+    def cmd_keys(self, pattern):
+        return [key for key in list(self.data)
+                if fnmatch.fnmatchcase(key, pattern)
+                and self._get(key, object) is not None]
+
+    def cmd_del(self, *keys):
+        deleted = 0
+        for key in keys:
+            self.expires.pop(key, None)
+            if self.data.pop(key, None) is not None:
+                deleted += 1
+        return deleted
+
+    def cmd_expire(self, key, seconds):
+        if self._get(key, object) is None:
+            return 0
+        self.expires[key] = time.time() + int(seconds)
+        return 1
+
+    # Lists
+
+    def cmd_rpush(self, key, *values):
+        items = self._get(key, deque)
+        if items is None:
+            items = self.data[key] = deque()
+            self.expires.pop(key, None)
+        items.extend(values)
+        self._notify()
+        return len(items)
+
+    def cmd_llen(self, key):
+        items = self._get(key, deque)
+        return len(items) if items else 0
+
+    def cmd_lpop(self, key):
+        items = self._get(key, deque)
+        if not items:
+            return None
+        value = items.popleft()
+        if not items:
+            self.cmd_del(key)
+        return value
+
+    async def cmd_blpop(self, *args):
+        *keys, timeout = args
+        deadline = time.monotonic() + float(timeout)
+
+        while True:
+            for key in keys:
+                value = self.cmd_lpop(key)
+                if value is not None:
+                    return [key, value]
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters.discard(waiter)
+
+    # Sorted sets
+
+    def cmd_zadd(self, key, *args):
+        members = self._get(key, dict)
+        if members is None:
+            members = self.data[key] = {}
+            self.expires.pop(key, None)
+
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            added += member not in members
+            members[member] = float(score)
+        return added
+
+    def cmd_zrem(self, key, *names):
+        members = self._get(key, dict) or {}
+        removed = sum(members.pop(name, None) is not None for name in names)
+        if not members:
+            self.cmd_del(key)
+        return removed
+
+    def cmd_zrange(self, key, start, stop):
+        members = self._get(key, dict) or {}
+        ordered = sorted(members, key=lambda name: (members[name], name))
+        stop = int(stop)
+        return ordered[int(start):None if stop == -1 else stop + 1]
+
+    def cmd_zremrangebyscore(self, key, minimum, maximum):
+        members = self._get(key, dict) or {}
+        expired = [name for name, score in members.items()
+                   if float(minimum) <= score <= float(maximum)]
+        return self.cmd_zrem(key, *expired) if expired else 0
@@ -0,0 +1,40 @@
+import bisect
+import hashlib
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to nodes.
+    - Each node is placed `replicas` times on the ring, so adding or
+      removing a node only moves about 1/N of the keys.
+    """
+    def __init__(self, nodes, replicas=64):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node.")
+
+        self.nodes = list(nodes)
+        self._ring = sorted(
+            (self._hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(self.nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(
+            hashlib.md5(key.encode('utf8')).digest()[:8], 'big'
+        )
+
+    def get_index(self, key):
+        """
+        Return the index of the node owning the key.
+        """
+        position = bisect.bisect(self._points, self._hash(key))
+        return self._ring[position % len(self._ring)][1]
+
+    def get_node(self, key):
+        """
+        Return the node owning the key.
+        """
+        return self.nodes[self.get_index(key)]
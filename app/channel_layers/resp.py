@@ -0,0 +1,100 @@
+import asyncio
+
+
+class RespError(Exception):
+    """
+    Error reply sent by the server.
+    """
+
+
+def encode_command(*args):
+    """
+    Encode a command as a RESP array of bulk strings.
+    """
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf8')
+        elif not isinstance(arg, bytes):
+            arg = str(arg).encode('utf8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+async def read_reply(reader):
+    """
+    Read a single RESP reply.
+    - Error replies are returned as RespError instances, so a pipeline
+      can read every reply before raising.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server.")
+
+    prefix, rest = line[:1], line[1:-2]
+
+    if prefix == b'+':
+        return rest.decode('utf8')
+    if prefix == b'-':
+        return RespError(rest.decode('utf8'))
+    if prefix == b':':
+        return int(rest)
+    if prefix == b'$':
+        length = int(rest)
+        if length == -1:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if prefix == b'*':
+        length = int(rest)
+        if length == -1:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+
+    raise RespError(f"Unknown reply type {prefix!r}")
+
+
+class RespConnection:
+    """
+    Minimal asyncio client for servers speaking the Redis protocol.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def execute(self, *args):
+        """
+        Run one command and return its reply.
+        """
+        (reply, ) = await self.pipeline([args])
+        return reply
+
+    async def pipeline(self, commands):
+        """
+        Send several commands in one write and read all replies.
+        - Raises the first error reply, if any.
+        """
+        self.writer.write(b''.join(encode_command(*args)
+                                   for args in commands))
+        await self.writer.drain()
+
+        replies = [await read_reply(self.reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    @property
+    def closed(self):
+        return self.writer.is_closing()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
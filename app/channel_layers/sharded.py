@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+import weakref
+from urllib.parse import urlparse
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from app.channel_layers.hashring import HashRing
+from app.channel_layers.resp import RespConnection
+
+logger = logging.getLogger(__name__)
+
+
+def parse_host(host):
+    """
+    Return (hostname, port) from "redis://host:port", "host:port" or a
+    (host, port) tuple.
+    """
+    if isinstance(host, (tuple, list)):
+        return host[0], int(host[1])
+
+    url = urlparse(host if '://' in host else f"redis://{host}")
+    return url.hostname or 'localhost', url.port or 6379
+
+
+class ConnectionPool:
+    """
+    Connections to one shard, bound to one event loop.
+    """
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.size = size
+        self._idle = []
+
+    async def acquire(self):
+        while self._idle:
+            connection = self._idle.pop()
+            if not connection.closed:
+                return connection
+        return await RespConnection.open(self.host, self.port)
+
+    def release(self, connection, discard=False):
+        """
+        Return a connection to the pool.
+        - Connections in an unknown state (e.g. a cancelled command) must
+          be discarded.
+        """
+        if discard or connection.closed or len(self._idle) >= self.size:
+            connection.writer.close()
+        else:
+            self._idle.append(connection)
+
+    async def pipeline(self, commands):
+        connection = await self.acquire()
+        try:
+            replies = await connection.pipeline(commands)
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+        return replies
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().writer.close()
+
+
+class _LoopState:
+    """
+    Connections and receive buffers of the layer in one event loop.
+    """
+    def __init__(self, layer):
+        self.pools = [ConnectionPool(host, port, layer.pool_size)
+                      for host, port in layer.hosts]
+        self.receive_buffers = {}
+        self.receive_tasks = {}
+
+
+class ShardedChannelLayer(BaseChannelLayer):
+    """
+    Channel layer sharded over several servers speaking the Redis protocol.
+
+    - Groups are placed on a shard by consistent hashing of the group name,
+      and channels by hashing their non-local name, so `chat_<id>` groups
+      spread over the nodes.
+    - group_send reads the members once, then pipelines the pushes to each
+      destination shard in a single round-trip per shard.
+    - Process-specific channels (`specific.<client>!<id>`) share one list
+      per process, read by a single receive loop and demultiplexed into
+      local buffers, so open sockets don't each hold a server connection.
+    """
+    extensions = ['groups', 'flush']
+
+    def __init__(self, hosts=None, prefix='asgi', expiry=60,
+                 group_expiry=86400, capacity=100, channel_capacity=None,
+                 pool_size=10, replicas=64, receive_timeout=5):
+        super().__init__(expiry=expiry, capacity=capacity,
+                         channel_capacity=channel_capacity)
+        self.hosts = [parse_host(host) for host in hosts or ['localhost']]
+        self.ring = HashRing([f"{host}:{port}" for host, port in self.hosts],
+                             replicas=replicas)
+        self.prefix = prefix
+        self.group_expiry = group_expiry
+        self.channel_capacity = self.compile_capacities(
+            channel_capacity or {}
+        )
+        self.pool_size = pool_size
+        self.receive_timeout = receive_timeout
+        self.client_prefix = uuid.uuid4().hex
+        self._states = weakref.WeakKeyDictionary()
+
+    # Helpers
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState(self)
+        return state
+
+    def _pool(self, name):
+        return self._state().pools[self.ring.get_index(name)]
+
+    def _channel_key(self, name):
+        return f"{self.prefix}:channel:{name}"
+
+    def _group_key(self, group):
+        return f"{self.prefix}:group:{group}"
+
+    def _serialize(self, channel, message):
+        return json.dumps({
+            'channel': channel,
+            'message': message,
+            'expires': time.time() + self.expiry,
+        })
+
+    def _deserialize(self, data):
+        """
+        Return (channel, message), message is None if it has expired.
+        """
+        payload = json.loads(data)
+        if payload['expires'] < time.time():
+            return payload['channel'], None
+        return payload['channel'], payload['message']
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific'):
+        return f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.valid_channel_name(channel)
+
+        name = self.non_local_name(channel)
+        key = self._channel_key(name)
+        pool = self._pool(name)
+
+        (length, ) = await pool.pipeline([('LLEN', key)])
+        if length >= self.get_capacity(channel):
+            raise ChannelFull()
+
+        await pool.pipeline([
+            ('RPUSH', key, self._serialize(channel, message)),
+            ('EXPIRE', key, self.expiry),
+        ])
+
+    async def receive(self, channel):
+        self.valid_channel_name(channel)
+
+        if '!' not in channel:
+            return await self._receive_single(channel)
+
+        state = self._state()
+        name = self.non_local_name(channel)
+        queue = state.receive_buffers.setdefault(channel, asyncio.Queue())
+
+        task = state.receive_tasks.get(name)
+        if task is None or task.done():
+            state.receive_tasks[name] = asyncio.ensure_future(
+                self._receive_loop(state, name)
+            )
+
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            # The consumer is gone, stop buffering for its channel
+            if queue.empty():
+                state.receive_buffers.pop(channel, None)
+            raise
+
+    async def _receive_single(self, channel):
+        pool = self._pool(channel)
+        key = self._channel_key(channel)
+
+        connection = await pool.acquire()
+        try:
+            while True:
+                reply = await connection.execute('BLPOP', key,
+                                                 self.receive_timeout)
+                if reply is None:
+                    continue
+                _, message = self._deserialize(reply[1])
+                if message is not None:
+                    break
+        except BaseException:
+            pool.release(connection, discard=True)
+            raise
+
+        pool.release(connection)
+        return message
+
+    async def _receive_loop(self, state, name):
+        """
+        Read the shared list of a process and route messages to buffers.
+        """
+        pool = state.pools[self.ring.get_index(name)]
+        key = self._channel_key(name)
+
+        while True:
+            try:
+                connection = await pool.acquire()
+            except OSError:
+                logger.exception("Could not connect to %s:%s",
+                                 pool.host, pool.port)
+                await asyncio.sleep(1)
+                continue
+
+            try:
+                while True:
+                    reply = await connection.execute('BLPOP', key,
+                                                     self.receive_timeout)
+                    if reply is None:
+                        continue
+
+                    channel, message = self._deserialize(reply[1])
+                    queue = state.receive_buffers.get(channel)
+                    if message is not None and queue is not None:
+                        queue.put_nowait(message)
+            except (ConnectionError, OSError):
+                logger.exception("Lost connection to %s:%s",
+                                 pool.host, pool.port)
+                await asyncio.sleep(1)
+            finally:
+                pool.release(connection, discard=True)
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.valid_group_name(group)
+        self.valid_channel_name(channel)
+
+        key = self._group_key(group)
+        await self._pool(group).pipeline([
+            ('ZADD', key, time.time(), channel),
+            ('EXPIRE', key, self.group_expiry),
+        ])
+
+    async def group_discard(self, group, channel):
+        self.valid_group_name(group)
+        self.valid_channel_name(channel)
+
+        await self._pool(group).pipeline([
+            ('ZREM', self._group_key(group), channel),
+        ])
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.valid_group_name(group)
+
+        key = self._group_key(group)
+        _, members = await self._pool(group).pipeline([
+            ('ZREMRANGEBYSCORE', key, 0, time.time() - self.group_expiry),
+            ('ZRANGE', key, 0, -1),
+        ])
+
+        # Bucket the pushes by destination shard
+        state = self._state()
+        pushes = {}
+        for member in members:
+            channel = member.decode('utf8')
+            name = self.non_local_name(channel)
+            pushes.setdefault(self.ring.get_index(name), []).append(
+                (channel, self._channel_key(name))
+            )
+
+        await asyncio.gather(*(
+            self._fan_out(state.pools[index], shard_pushes, message)
+            for index, shard_pushes in pushes.items()
+        ))
+
+    async def _fan_out(self, pool, pushes, message):
+        """
+        Push a group message to the channels of one shard.
+        - Full channels are skipped, group sends never raise ChannelFull.
+        """
+        keys = sorted({key for _, key in pushes})
+        lengths = dict(zip(
+            keys, await pool.pipeline([('LLEN', key) for key in keys])
+        ))
+
+        commands = []
+        for channel, key in pushes:
+            if lengths[key] >= self.get_capacity(channel):
+                continue
+            lengths[key] += 1
+            commands.append(('RPUSH', key, self._serialize(channel, message)))
+
+        if commands:
+            commands += [('EXPIRE', key, self.expiry) for key in keys]
+            await pool.pipeline(commands)
+
+    # Flush extension
+
+    async def flush(self):
+        """
+        Delete every key of this layer and reset local state.
+        """
+        state = self._state()
+        for pool in state.pools:
+            (keys, ) = await pool.pipeline([('KEYS', f"{self.prefix}:*")])
+            if keys:
+                await pool.pipeline([('DEL', *keys)])
+        await self.close()
+
+    async def close(self):
+        """
+        Stop the receive loops and close the connections of this loop.
+        """
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is None:
+            return
+
+        for task in state.receive_tasks.values():
+            task.cancel()
+        await asyncio.gather(*state.receive_tasks.values(),
+                             return_exceptions=True)
+        for pool in state.pools:
+            pool.close()
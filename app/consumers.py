@@ -1,115 +1,641 @@
+import asyncio
 import json
+import logging
+import time
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
+from django.conf import settings
+from app.admission import (SLOW_CONSUMER_CLOSE_CODE, allow_message,
+                           connections)
+from app.draining import drainer
+from app.fanout import get_group_registry
+from app.membership import conversation_members, user_conversations
+from app.metrics import get_metrics, timed_database_call
 from app.models import Conversation, ConversationMessage
-User = get_user_model()
+from app.presence import ensure_presence_sweeper, presence, send_presence
+from app.protocol.codecs import CODECS, build_event, encode_event
+from app.protocol.framing import FrameCoalescer
+from app.protocol.negotiation import negotiate
+from app.receipts import ReceiptCoalescer
+from app.replay import replay_buffers
+from app.services.attachment_services import (afind_user_attachment,
+                                              find_user_attachment)
+from app.services.chat_services import (
+    MAX_SEQ, acreate_message, aget_conversation_member_ids,
+    aget_messages_after, aget_user_conversation_ids, aupdate_read_state,
+    conversation_group_name, create_message, get_conversation_member_ids,
+    get_messages_after, get_user_conversation_ids, update_read_state,
+)
+from app.services.message_writer import get_message_writer
+
+logger = logging.getLogger(__name__)
+
+# Database calls of the consumer, through the thread pool or the async
+# ORM depending on CHAT_ASYNC_ORM
+create_message_async = timed_database_call('db_save', create_message,
+                                           acreate_message)
+update_read_state_async = timed_database_call('db_receipts',
+                                              update_read_state,
+                                              aupdate_read_state)
+get_messages_after_async = timed_database_call('db_replay',
+                                               get_messages_after,
+                                               aget_messages_after)
+get_member_ids_async = timed_database_call('db_load',
+                                           get_conversation_member_ids,
+                                           aget_conversation_member_ids)
+get_conversation_ids_async = timed_database_call('db_authorize',
+                                                 get_user_conversation_ids,
+                                                 aget_user_conversation_ids)
+find_attachment_async = timed_database_call('db_attachment',
+                                            find_user_attachment,
+                                            afind_user_attachment)
+
+# Group events only sent to clients that negotiated an option
+OPTIONAL_EVENTS = {
+    'chat.presence': 'presence',
+    'chat.typing': 'presence',
+    'chat.receipt': 'receipts',
+}
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['conversation_id']
-        self.room_group_name = f"chat_{self.room_name}"
+        self.room_group_name = conversation_group_name(self.room_name)
         self.user = self.scope['user']
+        self.metrics = get_metrics()
+        self.accepted = False
+        self.admitted = False
+        self.slow = False
+
+        # Per-connection conversation state, loaded once on connect and
+        # reused by every message received on this socket.
+        self.conversation_id = None
+        self.member_ids = frozenset()
+
+        # Wire options the client negotiated
+        self.protocol = negotiate(self.scope)
+        self.codec = CODECS[self.protocol['format']]
+        self.coalescer = None
+
+        # Group events delivered by same-process senders
+        self.local_queue = asyncio.Queue()
+        self.local_task = None
+        self.group_registry = get_group_registry()
+
+        # Last typing indicator sent, for rate limiting
+        self.typing_sent_at = float('-inf')
+
+        # Read and delivered acks, saved in batches
+        self.receipts = None
+
+        # Latest message replayed on connect, live copies are skipped
+        self.replayed_seq = 0
+        self.watching = False
+        self.watching_members = False
 
         # If user is not authenticated, close the connection
         if not self.user.is_authenticated:
             await self.close()
+            return
+
+        # Refuse new sockets while the process drains, clients reconnect
+        # to another worker
+        if drainer.draining:
+            self.metrics.increment('chat_connections_rejected_total',
+                                   reason='draining')
+            await self.close()
+            return
+
+        # Refuse conversations the user isn't a member of, checked
+        # against their cached conversation ids
+        if not await self.authorize():
+            self.metrics.increment('chat_connections_rejected_total',
+                                   reason='membership')
+            await self.close()
+            return
+
+        # Refuse sockets over the per-user and per-worker caps
+        reason = connections.acquire(self.user.id)
+        if reason is not None:
+            self.metrics.increment('chat_connections_rejected_total',
+                                   reason=reason)
+            await self.close()
+            return
+        self.admitted = True
 
         # Validate and Check if authenticated user is trying to access-
-        # other users conversation
+        # other users conversation. The members are shared with the other
+        # sockets of the conversation in this process.
+        conversation_members.watch(self.room_name)
+        self.watching_members = True
         try:
-            await self.validate_user_conversation(self.room_name)
+            await self.load_conversation_state()
         except Exception:
             await self.close()
+            return
 
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
+        # Join room group. Local events wait in the queue until the
+        # missed messages are replayed.
+        await self.group_registry.group_add(self.room_group_name, self)
+        replay_buffers.watch(self.room_group_name)
+        self.watching = True
+
+        if self.protocol['batch']:
+            self.coalescer = FrameCoalescer(
+                self.send_encoded_frame,
+                window=settings.CHAT_BATCH_WINDOW_MS / 1000,
+                max_messages=settings.CHAT_BATCH_MAX_MESSAGES,
+                join=self.codec.join,
+            )
+
+        self.receipts = ReceiptCoalescer(
+            self.save_receipts,
+            interval=settings.CHAT_ACK_FLUSH_INTERVAL_MS / 1000,
         )
 
-        await self.accept()
+        await self.accept(subprotocol=self.protocol['subprotocol'])
+        self.accepted = True
+        self.metrics.gauge_add('chat_active_connections', 1)
+        drainer.add(self)
+
+        # Tell the user who is online, then announce them
+        if self.protocol['presence']:
+            online = presence.online_in(self.room_group_name)
+            for user_id in sorted(online - {str(self.user.id)}):
+                await self.send_frame(self.codec.encode({
+                    'type': 'presence',
+                    'user_id': user_id,
+                    'status': 'online',
+                }))
+        await self.touch_presence()
+        ensure_presence_sweeper()
+
+        if self.protocol['last_seq'] is not None:
+            await self.replay(self.protocol['last_seq'])
+        self.local_task = asyncio.ensure_future(self.drain_local_queue())
 
     async def disconnect(self, code):
+        if self.accepted and presence.remove(self.channel_name):
+            await send_presence(self.room_group_name, self.user.id,
+                                'offline')
+
+        if self.receipts is not None:
+            try:
+                await self.receipts.close()
+            except Exception:
+                logger.exception("Failed to save receipts")
+
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.group_registry.group_discard(self.room_group_name, self)
+        if self.watching:
+            replay_buffers.unwatch(self.room_group_name)
+        if self.watching_members:
+            conversation_members.unwatch(self.room_name)
+
+        if self.accepted:
+            self.metrics.gauge_add('chat_active_connections', -1)
+            drainer.discard(self)
+
+        if self.admitted:
+            connections.release(self.user.id)
+
+        if self.local_task is not None:
+            self.local_task.cancel()
+
+        if self.coalescer is not None:
+            self.coalescer.close()
+
+    async def dispatch(self, message):
+        """
+        Queue the group events of the channel layer like the ones sent
+        from this process, so slow consumers are found in 'layer' fan-out
+        mode too. WebSocket events are handled right away.
+        """
+        if message['type'].startswith('websocket.'):
+            await super().dispatch(message)
+        else:
+            self.deliver_local(message)
+
+    def deliver_local(self, event):
+        """
+        Queue a group event sent from this process or the channel layer.
+        - Events of options the client didn't negotiate are dropped here,
+          so each presence change of a large group doesn't wake up every
+          socket.
+        - Past CHAT_SLOW_CONSUMER_QUEUE_SIZE waiting events the socket is
+          a slow consumer, see CHAT_SLOW_CONSUMER_POLICY.
+        """
+        option = OPTIONAL_EVENTS.get(event['type'])
+        if option is not None and not self.protocol[option]:
+            return
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data['message']
-        recipient_id = data['recipient_id']
+        limit = settings.CHAT_SLOW_CONSUMER_QUEUE_SIZE
+        if limit is not None and self.local_queue.qsize() >= limit:
+            policy = settings.CHAT_SLOW_CONSUMER_POLICY
+            self.metrics.increment('chat_slow_consumer_events_total',
+                                   policy=policy)
+            if policy == 'close' and not self.slow:
+                self.slow = True
+                self.metrics.increment('chat_slow_consumer_closed_total')
+                asyncio.ensure_future(
+                    self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+                )
+            return
+        self.local_queue.put_nowait(event)
 
+    async def drain_local_queue(self):
+        """
+        Dispatch locally delivered group events in order.
+        """
+        while True:
+            event = await self.local_queue.get()
+            try:
+                await super().dispatch(event)
+            except Exception:
+                logger.exception("Failed to handle %s event", event['type'])
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Text frames are JSON, binary frames are MessagePack
         try:
+            if bytes_data is not None:
+                data = CODECS['msgpack'].decode(bytes_data)
+            else:
+                data = json.loads(text_data)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            self.metrics.increment('chat_errors_total', stage='decode')
+            await self.send(text_data="Error: Invalid frame.")
+            return
+
+        # Every frame keeps the socket online
+        await self.touch_presence()
 
-            recipient_user = await self.get_user(recipient_id)
+        frame_type = data.get('type', 'message')
+        if frame_type == 'heartbeat':
+            return
+        if frame_type == 'typing':
+            await self.send_typing(bool(data.get('typing', True)))
+            return
+        if frame_type == 'ack':
+            await self.receive_ack(data)
+            return
+        if frame_type != 'message':
+            await self.send(text_data="Error: Unknown frame type.")
+            return
 
+        # Files are uploaded over HTTP first and sent by their hash.
+        # Messages without a recipient go to every member, direct
+        # conversations may still name the other member.
+        message = data.get('message', '')
+        attachment_id = data.get('attachment')
+        recipient_id = data.get('recipient_id')
+        # MessagePack frames may carry bytes or numbers, only text is
+        # saved and broadcast
+        if not isinstance(message, str) or not all(
+                value is None or isinstance(value, str)
+                for value in (attachment_id, recipient_id)):
+            self.metrics.increment('chat_errors_total', stage='decode')
+            await self.send(text_data="Error: Invalid message.")
+            return
+
+        # Refuse floods before they reach the database
+        limited = allow_message(self.user.id, self.room_group_name)
+        if limited is not None:
+            self.metrics.increment('chat_rate_limited_total', scope=limited)
+            await self.send(text_data="Error: Rate limit exceeded.")
+            return
+
+        if not message and attachment_id is None:
+            await self.send(text_data="Error: Empty message.")
+            return
+        self.metrics.increment('chat_messages_in_total')
+
+        try:
             # Check if request.user and recipient user is same
-            if recipient_user == self.user:
+            if recipient_id == str(self.user.id):
                 await self.send(text_data="Invalid recipient.")
                 await self.close()
                 return
 
-            # Get conversation
-            conversation = await self.get_conversation(self.user,
-                                                       recipient_user)
-
-            # Save message to DB
-            await self.save_message(conversation, self.user, message)
+            # Check recipient against the cached conversation members
+            if recipient_id is not None and (
+                    recipient_id not in self.member_ids):
+                await self.send(text_data="Error: Recipient is not a member "
+                                          "of this conversation.")
+                return
 
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'recipient_id': recipient_id,
+            attachment = None
+            if attachment_id is not None:
+                attachment = await find_attachment_async(self.user.id,
+                                                         attachment_id)
+                if attachment is None:
+                    await self.send(text_data="Error: Unknown attachment.")
+                    return
+                attachment_id = attachment['sha256']
 
-                }
-            )
+            # Save message to DB, then send it to the room group
+            if settings.CHAT_MESSAGE_PERSISTENCE == 'batched':
+                await self.queue_message(message, attachment)
+                return
+            with self.metrics.timer('chat_stage_seconds', stage='save'):
+                saved = await create_message_async(self.conversation_id,
+                                                   self.user.id, message,
+                                                   attachment_id)
+            await self.publish_message(saved, attachment)
 
         except Exception as e:
+            self.metrics.increment('chat_errors_total', stage='receive')
             await self.send(text_data=f"Error: {e}")
 
     async def chat_message(self, event):
-        message = event['message']
-        recipient_id = event['recipient_id']
+        payload = event['payload']
+        replay_buffers.record(self.room_group_name, payload)
+
+        # Already sent by the replay
+        if payload.get('seq', 0) <= self.replayed_seq:
+            return
+
+        self.metrics.increment('chat_messages_out_total')
+
+        with self.metrics.timer('chat_stage_seconds', stage='send'):
+            await self.send_frame(encode_event(event, self.codec))
+
+    async def replay(self, last_seq):
+        """
+        Send the messages sent after `last_seq`, then a `replayed` frame.
+        - Read from the replay buffer if it holds all of them, from the
+          database otherwise.
+        - At most CHAT_REPLAY_MAX_MESSAGES are sent, `complete` is false
+          if the client missed more, or archived ones.
+        """
+        limit = settings.CHAT_REPLAY_MAX_MESSAGES
+        source = 'memory'
+        payloads = replay_buffers.since(self.room_group_name, last_seq)
+
+        if payloads is None:
+            source = 'db'
+            if settings.CHAT_MESSAGE_PERSISTENCE == 'batched':
+                await get_message_writer().flush()
+            rows = await get_messages_after_async(self.conversation_id,
+                                                  last_seq, limit + 1)
+            payloads = [self.history_payload(row) for row in rows]
 
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'recipient_id': recipient_id,
+        # Archived messages are not replayed, they leave a gap
+        complete = len(payloads) <= limit and (
+            not payloads or payloads[0]['seq'] == last_seq + 1
+        )
+        payloads = payloads[:limit]
+        for payload in payloads:
+            await self.send_frame(self.codec.encode(payload))
+        if payloads:
+            self.replayed_seq = payloads[-1]['seq']
+
+        self.metrics.increment('chat_replays_total', source=source)
+        self.metrics.increment('chat_messages_replayed_total',
+                               len(payloads))
+        await self.send_frame(self.codec.encode({
+            'type': 'replayed',
+            'last_seq': max(self.replayed_seq, last_seq),
+            'complete': complete,
         }))
 
-    @database_sync_to_async
-    def validate_user_conversation(self, pk):
+    def history_payload(self, row):
         """
-        Get the Conversation of the authenticated user.
-        - Throws error if tries to access other user's conversation.
+        Return the `chat_message` payload of a saved message.
+        """
+        sender_id = str(row['sender_id'])
+        payload = {
+            'message': row['text'],
+            'sender_id': sender_id,
+            'recipient_id': self.direct_recipient(sender_id),
+            'seq': row['seq'],
+        }
+        if row.get('attachment_id'):
+            payload['attachment'] = {
+                'sha256': row['attachment_id'],
+                'size': row['attachment__size'],
+                'content_type': row['attachment__content_type'],
+            }
+        return payload
+
+    def direct_recipient(self, sender_id):
+        """
+        Return the other member of a two-member conversation, None for
+        larger groups.
+        """
+        if len(self.member_ids) != 2:
+            return None
+        for member_id in self.member_ids:
+            if member_id != sender_id:
+                return member_id
+        return None
+
+    async def chat_presence(self, event):
+        """
+        Forward presence and typing events, if the client asked for them.
+        """
+        if self.protocol['presence']:
+            await self.send_member_event(event)
+
+    chat_typing = chat_presence
+
+    async def chat_receipt(self, event):
+        """
+        Forward read and delivered cursors, if the client asked for them.
+        """
+        if self.protocol['receipts']:
+            await self.send_member_event(event)
+
+    async def send_member_event(self, event):
+        """
+        Send an event about a member, unless it is about this user.
+        """
+        if event['payload']['user_id'] != str(self.user.id):
+            await self.send_frame(encode_event(event, self.codec))
+
+    async def receive_ack(self, data):
+        """
+        Record the read and delivered cursors of an ack frame.
+        """
+        cursors = {}
+        for name in ('read_seq', 'delivered_seq'):
+            value = data.get(name, 0)
+            if (not isinstance(value, int) or isinstance(value, bool)
+                    or not 0 <= value <= MAX_SEQ):
+                await self.send(text_data="Error: Invalid ack.")
+                return
+            cursors[name] = value
+
+        self.metrics.increment('chat_acks_total')
+        self.receipts.ack(**cursors)
+
+    async def save_receipts(self, read_seq, delivered_seq):
+        """
+        Save the collapsed cursors and tell the other members.
+        - The saved cursors are sent, clamped to the latest message.
+        """
+        cursors = await update_read_state_async(
+            self.conversation_id, self.user.id, read_seq, delivered_seq
+        )
+        if cursors is None:
+            return
+        read_seq, delivered_seq = cursors
+        await self.group_registry.group_send(
+            self.room_group_name,
+            build_event('chat.receipt', {
+                'type': 'receipt',
+                'user_id': str(self.user.id),
+                'read_seq': read_seq,
+                'delivered_seq': delivered_seq,
+            })
+        )
+
+    async def touch_presence(self):
+        """
+        Keep the socket online, announcing the user if they just came
+        online in the conversation.
+        """
+        if presence.touch(self.channel_name, self.user.id,
+                          self.room_group_name):
+            await send_presence(self.room_group_name, self.user.id,
+                                'online')
+
+    async def send_typing(self, typing):
+        """
+        Send a typing indicator to the conversation.
+        - Started typing is sent at most once per CHAT_TYPING_INTERVAL_MS,
+          stopped typing is always sent.
+        """
+        now = time.monotonic()
+        if typing:
+            interval = settings.CHAT_TYPING_INTERVAL_MS / 1000
+            if now - self.typing_sent_at < interval:
+                self.metrics.increment('chat_ephemeral_dropped_total',
+                                       kind='typing')
+                return
+            self.typing_sent_at = now
+        else:
+            self.typing_sent_at = float('-inf')
+
+        await self.group_registry.group_send(
+            self.room_group_name,
+            build_event('chat.typing', {
+                'type': 'typing',
+                'user_id': str(self.user.id),
+                'typing': typing,
+            })
+        )
+
+    async def send_frame(self, frame):
+        """
+        Send a frame encoded with the connection codec, coalesced if the
+        client asked for batched frames.
+        """
+        if self.coalescer is not None:
+            await self.coalescer.push(frame)
+        else:
+            await self.send_encoded_frame(frame)
+
+    async def send_reconnect(self, delay_ms):
+        """
+        Ask the client to reconnect after `delay_ms`, as the process
+        drains. Frames still coalesced are sent first.
+        """
+        if self.coalescer is not None:
+            await self.coalescer.flush()
+        await self.send_encoded_frame(self.codec.encode({
+            'type': 'reconnect',
+            'delay_ms': delay_ms,
+        }))
+
+    async def send_encoded_frame(self, frame):
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def conversation_invalidate(self, event):
+        """
+        Reload the cached conversation state after its membership changed.
+        - Closes the socket if the user is no longer a member.
+        """
+        conversation_members.invalidate(self.room_name, event.get('version'))
+        try:
+            await self.load_conversation_state()
+        except Exception:
+            await self.close()
+
+    async def authorize(self):
+        """
+        Return whether the user is a member of the conversation, without
+        a query once their conversation ids are cached.
         """
-        return (
-            Conversation.objects.filter(id=pk).filter(members=self.user).get()
+        try:
+            conversation_id = str(uuid.UUID(self.room_name))
+        except ValueError:
+            return False
+        return await user_conversations.contains(
+            self.user.id, conversation_id, get_conversation_ids_async
         )
 
-    @database_sync_to_async
-    def get_user(self, pk):
-        return User.objects.get(pk=pk)
+    async def load_conversation_state(self):
+        """
+        Load the conversation members once and keep them on the connection.
+        """
+        self.member_ids = await self.get_conversation_member_ids(
+            self.room_name
+        )
+        self.conversation_id = self.room_name
 
-    @database_sync_to_async
-    def get_conversation(self, sender_user, recipient_user):
+    async def get_conversation_member_ids(self, pk):
         """
-        Get the Conversation of Sender and Recipient
+        Get the member ids of the Conversation of the authenticated user.
+        - Throws error if tries to access other user's conversation.
+        """
+        member_ids = await conversation_members.get(pk, get_member_ids_async)
+        if str(self.user.id) not in member_ids:
+            raise Conversation.DoesNotExist(
+                "Conversation matching query does not exist."
+            )
+        return member_ids
+
+    async def queue_message(self, text, attachment=None):
         """
-        return (
-            Conversation.objects
-            .filter(members=sender_user)
-            .filter(members=recipient_user).get()
+        Hand a message to the write-behind queue. It is numbered when its
+        batch is saved and sent to the room group then.
+        """
+        message = ConversationMessage(
+            conversation_id=self.conversation_id,
+            text=text,
+            sender_id=self.user.id,
+            attachment_id=attachment['sha256'] if attachment else None,
         )
 
-    @database_sync_to_async
-    def save_message(self, conversation, sender_user, message):
-        ConversationMessage.objects.create(conversation=conversation,
-                                           text=message,
-                                           sender=sender_user)
+        async def on_written(message, saved):
+            if saved:
+                await self.publish_message(message, attachment)
+            elif self.accepted:
+                await self.send(text_data="Error: Message not saved.")
+
+        with self.metrics.timer('chat_stage_seconds', stage='save'):
+            await get_message_writer().enqueue(message, on_written)
+
+    async def publish_message(self, message, attachment=None):
+        """
+        Send a saved message to the room group.
+        """
+        payload = {
+            'message': message.text,
+            'sender_id': str(message.sender_id),
+            'recipient_id': self.direct_recipient(str(message.sender_id)),
+            'seq': message.seq,
+        }
+        if attachment is not None:
+            payload['attachment'] = attachment
+        with self.metrics.timer('chat_stage_seconds', stage='group_send'):
+            await self.group_registry.group_send(
+                self.room_group_name,
+                build_event('chat_message', payload)
+            )
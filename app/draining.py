@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import math
+import random
+import signal
+from django.conf import settings
+from app.metrics import get_metrics
+from app.services.message_writer import get_message_writer
+
+logger = logging.getLogger(__name__)
+
+# WebSocket close code of drained sockets: Service Restart
+DRAIN_CLOSE_CODE = 1012
+
+# Signal starting a drain, see install_drain_signal
+DRAIN_SIGNAL = getattr(signal, 'SIGUSR1', None)
+
+# Seconds between two rounds of closes
+DRAIN_TICK = 0.05
+
+
+class Drainer:
+    """
+    Drains the sockets of this process before a redeploy.
+    - New sockets are refused from the start of the drain.
+    - Open sockets get a `reconnect` frame with a random delay, so their
+      clients don't all come back at the same moment.
+    - Queued messages are saved, then sockets are closed at
+      CHAT_DRAIN_CLOSE_RATE per second, for clients that didn't leave.
+    """
+    def __init__(self):
+        self.draining = False
+        self.consumers = set()
+        self._task = None
+
+    def add(self, consumer):
+        self.consumers.add(consumer)
+
+    def discard(self, consumer):
+        self.consumers.discard(consumer)
+
+    def start(self):
+        """
+        Start draining on the running event loop, once.
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.drain())
+        return self._task
+
+    async def drain(self):
+        """
+        Refuse new sockets and close the open ones gradually.
+        """
+        self.draining = True
+        metrics = get_metrics()
+        metrics.gauge_add('chat_draining', 1)
+
+        consumers = list(self.consumers)
+        logger.info("Draining %d sockets", len(consumers))
+
+        jitter = settings.CHAT_DRAIN_RECONNECT_JITTER_MS
+        for consumer in consumers:
+            try:
+                await consumer.send_reconnect(random.randint(0, jitter))
+            except Exception:
+                logger.exception("Failed to send the reconnect frame")
+
+        await self.flush_messages()
+
+        # Close the sockets still open, a few per tick
+        per_tick = max(1, math.ceil(settings.CHAT_DRAIN_CLOSE_RATE
+                                    * DRAIN_TICK))
+        consumers = [consumer for consumer in consumers
+                     if consumer in self.consumers]
+        for start in range(0, len(consumers), per_tick):
+            for consumer in consumers[start:start + per_tick]:
+                if consumer in self.consumers:
+                    await consumer.close(code=DRAIN_CLOSE_CODE)
+                    metrics.increment('chat_drain_closed_total')
+            await asyncio.sleep(DRAIN_TICK)
+
+        await self.flush_messages()
+        logger.info("Drained, %d sockets left", len(self.consumers))
+
+    async def flush_messages(self):
+        if settings.CHAT_MESSAGE_PERSISTENCE == 'batched':
+            await get_message_writer().flush(immediate=True)
+
+    def reset(self):
+        """
+        Accept sockets again, e.g. between tests.
+        """
+        if self._task is not None:
+            self._task.cancel()
+        self.draining = False
+        self.consumers.clear()
+        self._task = None
+
+
+drainer = Drainer()
+
+
+def install_drain_signal(loop):
+    """
+    Start draining on `loop` when the process gets DRAIN_SIGNAL.
+    - The handler runs between bytecodes of the main thread, it only
+      wakes the loop up.
+    """
+    if DRAIN_SIGNAL is None:
+        return
+
+    def handle(signum, frame):
+        loop.call_soon_threadsafe(drainer.start)
+
+    signal.signal(DRAIN_SIGNAL, handle)
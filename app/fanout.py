@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import uuid
+import weakref
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class GroupRegistry:
+    """
+    Process-local registry of the consumers in each group.
+
+    In 'hybrid' mode, consumers of the same process get group events
+    straight through their local queues. The process joins each channel
+    layer group once, with one channel per group, and the layer is only
+    used to reach members connected to other processes. Events relayed
+    back to the process that sent them are dropped.
+    - Every send still goes through the layer and back to the relay
+      channel of the sending process, one layer round trip wasted per
+      send. The relay can't be skipped even with the in-memory layer:
+      it also carries the events sent straight to the layer, e.g. by
+      HTTP views or other event loops.
+    - The layer drops a channel from a group `group_expiry` seconds
+      after it was added. The relay channel is re-added on every local
+      join and every `refresh_interval` seconds.
+
+    In 'layer' mode every consumer joins the channel layer group itself.
+    """
+    def __init__(self, channel_layer, mode, refresh_interval=3600):
+        self.channel_layer = channel_layer
+        self.hybrid = mode == 'hybrid'
+        self.refresh_interval = refresh_interval
+        self.origin = uuid.uuid4().hex
+        self.groups = {}
+        self._channels = {}
+        self._relay_tasks = {}
+        self._refresh_task = None
+
+    async def group_add(self, group, consumer):
+        if not self.hybrid:
+            await self.channel_layer.group_add(group, consumer.channel_name)
+            return
+
+        members = self.groups.setdefault(group, set())
+        members.add(consumer)
+
+        if self.channel_layer is None:
+            return
+
+        if group not in self._channels:
+            channel_name = await self.channel_layer.new_channel()
+            self._channels[group] = channel_name
+            self._relay_tasks[group] = asyncio.ensure_future(
+                self._relay(group, channel_name)
+            )
+
+        # Also renews the membership before the layer expires it
+        await self.channel_layer.group_add(group, self._channels[group])
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+
+    async def group_discard(self, group, consumer):
+        if not self.hybrid:
+            await self.channel_layer.group_discard(group,
+                                                   consumer.channel_name)
+            return
+
+        members = self.groups.get(group, set())
+        members.discard(consumer)
+        if members:
+            return
+
+        # Last local member left, stop listening to the group
+        self.groups.pop(group, None)
+        channel_name = self._channels.pop(group, None)
+        task = self._relay_tasks.pop(group, None)
+        if task is not None:
+            task.cancel()
+        if channel_name is not None:
+            await self.channel_layer.group_discard(group, channel_name)
+
+    async def group_send(self, group, event):
+        if not self.hybrid:
+            await self.channel_layer.group_send(group, event)
+            return
+
+        # Local recipients cache encoded frames on the event, other
+        # processes get it as it was sent.
+        relay = {
+            'type': 'fanout.relay',
+            'origin': self.origin,
+            'event': {
+                key: dict(value) if isinstance(value, dict) else value
+                for key, value in event.items()
+            },
+        }
+
+        self.deliver(group, event)
+
+        if self.channel_layer is not None:
+            await self.channel_layer.group_send(group, relay)
+
+    def deliver(self, group, event):
+        """
+        Hand an event to every local member of the group.
+        """
+        for consumer in list(self.groups.get(group, ())):
+            consumer.deliver_local(event)
+
+    async def refresh(self):
+        """
+        Re-add the relay channels to their channel layer groups.
+        """
+        for group, channel_name in list(self._channels.items()):
+            await self.channel_layer.group_add(group, channel_name)
+
+    async def _refresh(self):
+        while self._channels:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the relay channels")
+
+    async def _relay(self, group, channel_name):
+        """
+        Deliver the events the channel layer sends to the group locally.
+        """
+        while True:
+            message = await self.channel_layer.receive(channel_name)
+
+            if message.get('type') == 'fanout.relay':
+                if message['origin'] == self.origin:
+                    continue
+                message = message['event']
+
+            self.deliver(group, message)
+
+
+_registries = weakref.WeakKeyDictionary()
+
+
+def get_group_registry():
+    """
+    Return the group registry of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    registry = _registries.get(loop)
+    if registry is None:
+        registry = GroupRegistry(get_channel_layer(),
+                                 settings.CHAT_FANOUT_MODE,
+                                 settings.CHAT_FANOUT_REFRESH_INTERVAL)
+        _registries[loop] = registry
+    return registry
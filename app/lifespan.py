@@ -0,0 +1,21 @@
+from app.services.message_writer import close_message_writer
+
+
+class LifespanApp:
+    """
+    ASGI lifespan handler.
+    - Flushes the write-behind message queue on server shutdown.
+    - daphne doesn't send lifespan events, app.server.ChatServer saves
+      the queue from a reactor shutdown trigger instead.
+    """
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                await close_message_writer()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,30 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app.services.archive_services import archive_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than --days into gzip'd JSON lines segments "
+        "under CHAT_ARCHIVE_DIR. Run it periodically, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float,
+                            default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+                            help="Archive messages older than this many "
+                                 "days.")
+        parser.add_argument('--segment-size', type=int,
+                            default=settings.CHAT_ARCHIVE_SEGMENT_SIZE,
+                            help="Messages per segment file.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        stats = archive_messages(cutoff, options['segment_size'])
+        self.stdout.write(
+            f"Archived {stats['messages']} messages of "
+            f"{stats['conversations']} conversations sent before "
+            f"{cutoff.isoformat()}."
+        )
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import threading
+import time
+import tracemalloc
+import uuid
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from app.models import Conversation
+from app.services.message_writer import close_message_writer
+User = get_user_model()
+
+# Reply to a message refused by the rate limits, see app.admission
+RATE_LIMITED = "Error: Rate limit exceeded."
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, round(percent / 100 * len(values)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class QueryCounter:
+    """
+    Counts the queries of every database connection, in every thread.
+    """
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.install(connection)
+        connection_created.connect(self.install)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the WebSocket chat path in-process: opens authenticated "
+        "sockets on the ASGI application, sends messages at a fixed rate "
+        "and reports throughput, delivery latency, queries per message and "
+        "memory per connection as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=200,
+                            help="Number of sockets to open.")
+        parser.add_argument('--conversations', type=int, default=50,
+                            help="Number of conversations the sockets are "
+                                 "spread over.")
+        parser.add_argument('--members', type=int, default=2,
+                            help="Members per conversation. More than two "
+                                 "makes group conversations, messaged "
+                                 "without a recipient.")
+        parser.add_argument('--messages', type=int, default=2000,
+                            help="Total number of messages to send.")
+        parser.add_argument('--rate', type=float, default=500,
+                            help="Messages sent per second.")
+        parser.add_argument('--timeout', type=float, default=30,
+                            help="Seconds to wait for pending deliveries.")
+        parser.add_argument('--origin', default='http://localhost',
+                            help="Origin header sent on the handshake.")
+        parser.add_argument('--output',
+                            help="Write the JSON report to this file "
+                                 "instead of stdout.")
+        parser.add_argument('--orm', choices=('threadpool', 'async'),
+                            help="Run database calls through the thread "
+                                 "pool or the async ORM, defaults to "
+                                 "CHAT_ASYNC_ORM.")
+        parser.add_argument('--keep-data', action='store_true',
+                            help="Don't delete the benchmark users, "
+                                 "conversations and messages.")
+
+    def handle(self, *args, **options):
+        from project.asgi import application
+
+        run_id = uuid.uuid4().hex[:8]
+        users, conversations = self.create_fixtures(run_id, options)
+
+        if options['orm'] is None:
+            options['orm'] = ('async' if settings.CHAT_ASYNC_ORM
+                              else 'threadpool')
+
+        try:
+            with override_settings(CHAT_ASYNC_ORM=options['orm'] == 'async'):
+                results = asyncio.run(
+                    self.run(application, users, conversations, options)
+                )
+        finally:
+            if not options['keep_data']:
+                Conversation.objects.filter(id__in=[
+                    conversation.id for conversation, _ in conversations
+                ]).delete()
+                User.objects.filter(id__in=[user.id for user in users]) \
+                    .delete()
+
+        report = {
+            'run_id': run_id,
+            'timestamp': timezone.now().isoformat(),
+            'config': {
+                key: options[key]
+                for key in ('connections', 'conversations', 'members',
+                            'messages', 'rate', 'orm')
+            },
+            'results': results,
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def create_fixtures(self, run_id, options):
+        """
+        Create the members of each conversation, without password hashing.
+        """
+        size = options['members']
+        users = []
+        for i in range(options['conversations'] * size):
+            user = User(first_name='bench', last_name=str(i),
+                        email=f"chatbench-{run_id}-{i}@example.com",
+                        is_active=True)
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users)
+
+        conversations = []
+        memberships = []
+        for i in range(options['conversations']):
+            members = users[i * size:(i + 1) * size]
+            if size == 2:
+                pair_key = Conversation.make_pair_key(members[0].id,
+                                                      members[1].id)
+                conversation = Conversation(pair_key=pair_key)
+            else:
+                conversation = Conversation(name=f"chatbench {i}")
+            conversations.append((conversation, members))
+            memberships += [
+                Conversation.members.through(conversation=conversation,
+                                             useraccount=member)
+                for member in members
+            ]
+        Conversation.objects.bulk_create([
+            conversation for conversation, _ in conversations
+        ])
+        Conversation.members.through.objects.bulk_create(memberships)
+
+        return users, conversations
+
+    async def run(self, application, users, conversations, options):
+        tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+        headers = [(b'origin', options['origin'].encode('ascii'))]
+
+        # Open the sockets, alternating the members of each conversation
+        sockets = []
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+
+        for i in range(options['connections']):
+            conversation, members = conversations[i % len(conversations)]
+            sender = members[(i // len(conversations)) % len(members)]
+            # Group messages have no recipient
+            recipient = None
+            if len(members) == 2:
+                recipient = members[1] if sender == members[0] else members[0]
+
+            communicator = WebsocketCommunicator(
+                application,
+                f"/ws/chat/{conversation.id}/?token={tokens[sender.id]}",
+                headers=headers
+            )
+            connected, _ = await communicator.connect(options['timeout'])
+            if not connected:
+                raise RuntimeError("Benchmark socket was refused.")
+            sockets.append((communicator, conversation, recipient))
+
+        memory_per_connection = (
+            (tracemalloc.get_traced_memory()[0] - memory_before)
+            / len(sockets)
+        )
+        tracemalloc.stop()
+
+        sockets_per_conversation = {}
+        for _, conversation, _ in sockets:
+            sockets_per_conversation[conversation.id] = (
+                sockets_per_conversation.get(conversation.id, 0) + 1
+            )
+
+        latencies = []
+        errors = []
+        done = asyncio.Event()
+        state = {'expected': 0, 'rate_limited': 0, 'sending': True}
+
+        def check_done():
+            if not state['sending'] and len(latencies) >= state['expected']:
+                done.set()
+
+        async def read(communicator, conversation):
+            while True:
+                frame = await communicator.output_queue.get()
+                if frame['type'] != 'websocket.send':
+                    return
+                if frame.get('text') == RATE_LIMITED:
+                    # Refused, nobody gets the message
+                    state['rate_limited'] += 1
+                    state['expected'] -= sockets_per_conversation[
+                        conversation.id
+                    ]
+                    check_done()
+                    continue
+                try:
+                    sent_at = float(json.loads(frame['text'])['message'])
+                except (KeyError, TypeError, ValueError):
+                    errors.append(frame.get('text'))
+                    continue
+                latencies.append(time.perf_counter() - sent_at)
+                check_done()
+
+        readers = [asyncio.ensure_future(read(communicator, conversation))
+                   for communicator, conversation, _ in sockets]
+
+        # The async ORM keeps the connections of its thread open, reopen
+        # them so their queries are counted too
+        await sync_to_async(connections.close_all)()
+
+        # Send at a fixed rate, round robin over the sockets
+        interval = 1 / options['rate']
+        with QueryCounter() as queries:
+            started = time.perf_counter()
+            for i in range(options['messages']):
+                communicator, conversation, recipient = sockets[
+                    i % len(sockets)
+                ]
+                state['expected'] += sockets_per_conversation[
+                    conversation.id
+                ]
+                frame = {'message': repr(time.perf_counter())}
+                if recipient is not None:
+                    frame['recipient_id'] = str(recipient.id)
+                await communicator.send_json_to(frame)
+
+                delay = started + (i + 1) * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            sent = time.perf_counter()
+
+            state['sending'] = False
+            check_done()
+            try:
+                await asyncio.wait_for(done.wait(), options['timeout'])
+            except asyncio.TimeoutError:
+                pass
+            finished = time.perf_counter()
+
+            # Flush queued writes so they are counted too
+            await close_message_writer()
+
+        for reader in readers:
+            reader.cancel()
+        for communicator, _, _ in sockets:
+            await communicator.disconnect()
+
+        return {
+            'messages_sent': options['messages'],
+            'deliveries_expected': state['expected'],
+            'deliveries': len(latencies),
+            'rate_limited': state['rate_limited'],
+            'errors': len(errors),
+            'send_seconds': round(sent - started, 3),
+            'total_seconds': round(finished - started, 3),
+            'messages_per_second': round(
+                options['messages'] / (finished - started), 1
+            ),
+            'deliveries_per_second': round(
+                len(latencies) / (finished - started), 1
+            ),
+            'latency_ms': {
+                name: (round(percentile(latencies, percent) * 1000, 3)
+                       if latencies else None)
+                for name, percent in (('p50', 50), ('p95', 95), ('p99', 99))
+            },
+            'db_queries': queries.count,
+            'db_queries_per_message': round(
+                queries.count / options['messages'], 2
+            ),
+            'memory_per_connection_bytes': round(memory_per_connection),
+        }
@@ -0,0 +1,38 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from app.draining import DRAIN_SIGNAL
+
+
+class Command(BaseCommand):
+    help = (
+        "Drain the WebSockets of a running chat server before stopping it: "
+        "new sockets are refused, clients are asked to reconnect and the "
+        "open sockets are closed at CHAT_DRAIN_CLOSE_RATE per second."
+    )
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--pid', type=int,
+                            help="Process id of the server to drain.")
+        target.add_argument('--pidfile',
+                            help="File holding the process id of the "
+                                 "server to drain.")
+
+    def handle(self, *args, **options):
+        if DRAIN_SIGNAL is None:
+            raise CommandError("Draining needs SIGUSR1, not available on "
+                               "this platform.")
+
+        pid = options['pid']
+        if pid is None:
+            try:
+                with open(options['pidfile']) as pidfile:
+                    pid = int(pidfile.read().strip())
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read the process id: {e}")
+
+        try:
+            os.kill(pid, DRAIN_SIGNAL)
+        except OSError as e:
+            raise CommandError(f"Can't signal process {pid}: {e}")
+        self.stdout.write(f"Draining process {pid}.")
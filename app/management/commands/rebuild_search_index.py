@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from app.services.search_services import (get_search_backend,
+                                          rebuild_search_index)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the message search index from the messages table, e.g. "
+        "after switching CHAT_SEARCH_BACKEND or restoring a backup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Messages indexed per query.")
+
+    def handle(self, *args, **options):
+        indexed = rebuild_search_index(options['batch_size'])
+        self.stdout.write(
+            f"Indexed {indexed} messages with the "
+            f"{get_search_backend()} backend."
+        )
@@ -0,0 +1,204 @@
+import asyncio
+import time
+from django.conf import settings
+from app.caches import TTLCache
+
+
+class SharedLoads:
+    """
+    Concurrent loads of the same key share one call.
+    """
+    def __init__(self):
+        self._loading = {}
+
+    async def load_once(self, key, load, store):
+        """
+        Return `load(key)`, joining a load of the key already running.
+        - `store(key, value)` keeps the result, unless the key was
+          forgotten while it loaded.
+        """
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.ensure_future(
+                self._load(key, load, store)
+            )
+        return await asyncio.shield(task)
+
+    async def _load(self, key, load, store):
+        task = asyncio.current_task()
+        try:
+            value = await load(key)
+        finally:
+            current = self._loading.get(key) is task
+            if current:
+                del self._loading[key]
+
+        if current:
+            store(key, value)
+        return value
+
+    def forget(self, key):
+        """
+        Start a new load on the next call, the running one is not kept.
+        """
+        self._loading.pop(key, None)
+
+    def clear(self):
+        self._loading.clear()
+
+
+class ConversationMembers:
+    """
+    Member ids of the conversations with sockets in this process.
+    - Every socket of a conversation shares one frozenset, so a group of
+      thousands of members is held once per process, not per socket.
+    - Concurrent loads of a conversation share one query, so a reconnect
+      storm costs a query per conversation.
+    - Entries are only kept while the conversation has sockets here, as
+      those receive its conversation.invalidate events.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._members = {}
+        self._watchers = {}
+        self._loads = SharedLoads()
+        self._versions = {}
+
+    def watch(self, conversation_id):
+        """
+        Keep the members of a conversation cached for a socket.
+        """
+        key = str(conversation_id)
+        self._watchers[key] = self._watchers.get(key, 0) + 1
+
+    def unwatch(self, conversation_id):
+        """
+        Release a socket, dropping the members with the last one.
+        """
+        key = str(conversation_id)
+        watchers = self._watchers.get(key, 0) - 1
+        if watchers > 0:
+            self._watchers[key] = watchers
+            return
+
+        self._watchers.pop(key, None)
+        self._members.pop(key, None)
+        self._versions.pop(key, None)
+
+    async def get(self, conversation_id, load):
+        """
+        Return the member ids of a conversation.
+
+        Params:
+        - conversation_id: The conversation.
+        - load: Coroutine function loading the member ids of a
+                conversation from the database.
+        """
+        key = str(conversation_id)
+        entry = self._members.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+
+        return await self._loads.load_once(key, load, self._store)
+
+    def _store(self, key, members):
+        # Only kept while a socket watches the conversation
+        if key in self._watchers:
+            self._members[key] = (members, time.monotonic() + self.ttl)
+
+    def invalidate(self, conversation_id, version=None):
+        """
+        Drop the members of a conversation after they changed.
+        - Every local socket handles the same invalidation event, only
+          the first of a `version` drops the entry.
+
+        Returns:
+        - invalidated: False if this version was already handled.
+        """
+        key = str(conversation_id)
+        if version is not None:
+            if self._versions.get(key) == version:
+                return False
+            if key in self._watchers:
+                self._versions[key] = version
+
+        self._members.pop(key, None)
+        self._loads.forget(key)
+        return True
+
+    def clear(self):
+        self._members.clear()
+        self._watchers.clear()
+        self._loads.clear()
+        self._versions.clear()
+
+
+class UserConversations:
+    """
+    Conversation ids of each user, to authorize sockets without a query.
+    - Loaded on first use, kept for `ttl` seconds and dropped when the
+      memberships of the user change in this process, see app.signals.
+    - Memberships added by another process aren't seen until then, so a
+      conversation missing from the ids is looked up again, at most once
+      per `refresh_interval` seconds for each user. Unknown conversation
+      ids don't cost a query per connect.
+    """
+    def __init__(self, maxsize, ttl, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._loads = SharedLoads()
+
+    async def contains(self, user_id, conversation_id, load):
+        """
+        Return whether a user is a member of a conversation.
+
+        Params:
+        - user_id: The user.
+        - conversation_id: The conversation id, as a string.
+        - load: Coroutine function loading the conversation ids of a
+                user from the database, as strings.
+        """
+        key = str(user_id)
+        conversation_ids, loaded_at = await self._get(key, load)
+        if conversation_id in conversation_ids:
+            return True
+        if time.monotonic() - loaded_at < self.refresh_interval:
+            return False
+
+        self.invalidate(key)
+        conversation_ids, _ = await self._get(key, load)
+        return conversation_id in conversation_ids
+
+    async def _get(self, key, load):
+        """
+        Return the conversation ids of a user and when they were loaded.
+        """
+        async def load_entry(key):
+            return (await load(key), time.monotonic())
+
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = await self._loads.load_once(key, load_entry,
+                                                self._cache.set)
+        return entry
+
+    def invalidate(self, user_id):
+        """
+        Drop the conversation ids of a user. Safe to call from any thread.
+        """
+        key = str(user_id)
+        self._cache.pop(key)
+        self._loads.forget(key)
+
+    def clear(self):
+        self._cache.clear()
+        self._loads.clear()
+
+
+conversation_members = ConversationMembers(ttl=settings.CHAT_MEMBERSHIP_TTL)
+
+user_conversations = UserConversations(
+    maxsize=settings.CHAT_USER_CONVERSATIONS_CACHE_SIZE,
+    ttl=settings.CHAT_USER_CONVERSATIONS_TTL,
+    refresh_interval=settings.CHAT_USER_CONVERSATIONS_REFRESH_INTERVAL,
+)
@@ -0,0 +1,218 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+# Upper bounds (seconds) of the timing histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class NullMetrics:
+    """
+    Metrics backend that records nothing.
+    - Used when CHAT_METRICS_BACKEND is not set, every call is a no-op.
+    """
+    enabled = False
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+    def gauge_add(self, name, value, **labels):
+        pass
+
+    def observe(self, name, seconds, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return _null_timer
+
+
+class InMemoryMetrics(NullMetrics):
+    """
+    Metrics backend keeping counters, gauges and timing histograms in
+    process memory, rendered in the Prometheus text format.
+    """
+    enabled = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge_add(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        def series(name, labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if not labels:
+                return name
+            text = ','.join(f'{label}="{value}"' for label, value in labels)
+            return f"{name}{{{text}}}"
+
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self.counters),
+                                 ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append(f"{series(name, labels)} {value}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(
+                        self.histograms.items()):
+                    if metric != name:
+                        continue
+                    bucket = f"{name}_bucket"
+                    cumulative = 0
+                    for bound, count in zip(self.buckets,
+                                            histogram['buckets']):
+                        cumulative += count
+                        le = [('le', bound)]
+                        lines.append(f"{series(bucket, labels, le)} "
+                                     f"{cumulative}")
+                    lines.append(f"{series(bucket, labels, [('le', '+Inf')])}"
+                                 f" {histogram['count']}")
+                    lines.append(f"{series(f'{name}_sum', labels)} "
+                                 f"{histogram['sum']}")
+                    lines.append(f"{series(f'{name}_count', labels)} "
+                                 f"{histogram['count']}")
+
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = None
+
+
+def get_metrics():
+    """
+    Return the metrics backend configured by CHAT_METRICS_BACKEND.
+    """
+    global _metrics
+    if _metrics is None:
+        backend = getattr(settings, 'CHAT_METRICS_BACKEND', None)
+        _metrics = import_string(backend)() if backend else NullMetrics()
+    return _metrics
+
+
+def _reset_metrics(setting, **kwargs):
+    global _metrics
+    if setting == 'CHAT_METRICS_BACKEND':
+        _metrics = None
+
+
+setting_changed.connect(_reset_metrics)
+
+
+def timed_database_sync_to_async(stage):
+    """
+    database_sync_to_async that records, when metrics are enabled, how long
+    the call waited for a thread-pool worker and how long it ran.
+    """
+    def decorator(func):
+        call = database_sync_to_async(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            metrics = get_metrics()
+            if not metrics.enabled:
+                return await call(*args, **kwargs)
+
+            queued_at = time.perf_counter()
+
+            def run():
+                metrics.observe('chat_threadpool_wait_seconds',
+                                time.perf_counter() - queued_at,
+                                stage=stage)
+                return func(*args, **kwargs)
+
+            with metrics.timer('chat_stage_seconds', stage=stage):
+                return await database_sync_to_async(run)()
+
+        return wrapper
+    return decorator
+
+
+def timed_database_call(stage, func, afunc):
+    """
+    Return a coroutine function running `afunc` on the event loop with
+    the async ORM when CHAT_ASYNC_ORM is set, and `func` through
+    timed_database_sync_to_async otherwise.
+    - Both take the same arguments and are timed under the same stage.
+    """
+    threaded = timed_database_sync_to_async(stage)(func)
+
+    @functools.wraps(afunc)
+    async def wrapper(*args, **kwargs):
+        if not settings.CHAT_ASYNC_ORM:
+            return await threaded(*args, **kwargs)
+        with get_metrics().timer('chat_stage_seconds', stage=stage):
+            return await afunc(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 17:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_conversation_conversationmessage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversationmessage',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_message_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='pair_key',
+            field=models.CharField(blank=True, editable=False, max_length=73, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='conversationmessage',
+            index=models.Index(fields=['conversation', '-created_at', '-id'], name='app_message_conv_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationmessage',
+            index=models.Index(fields=['sender', '-created_at'], name='app_message_sender_created_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+def backfill_pair_keys(apps, schema_editor):
+    """
+    Set the pair key of existing two-member conversations.
+    - If a pair already has duplicate conversations, only the oldest one
+      gets the key, the others keep working by id.
+    """
+    Conversation = apps.get_model('app', 'Conversation')
+    Membership = Conversation.members.through
+
+    members = {}
+    for conversation_id, user_id in (Membership.objects
+                                     .values_list('conversation_id',
+                                                  'useraccount_id')):
+        members.setdefault(conversation_id, []).append(str(user_id))
+
+    seen = set()
+    for conversation_id in (Conversation.objects
+                            .order_by('created_at')
+                            .values_list('id', flat=True)):
+        user_ids = members.get(conversation_id, [])
+        if len(user_ids) != 2:
+            continue
+
+        pair_key = ':'.join(sorted(user_ids))
+        if pair_key in seen:
+            continue
+        seen.add(pair_key)
+
+        (Conversation.objects
+         .filter(id=conversation_id)
+         .update(pair_key=pair_key))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_conversation_pair_key_message_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_pair_keys, migrations.RunPython.noop),
+    ]
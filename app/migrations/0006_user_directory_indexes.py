@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 17:27
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_backfill_conversation_pair_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='useraccount',
+            index=models.Index(django.db.models.functions.text.Lower('first_name'), django.db.models.functions.text.Lower('last_name'), models.F('id'), name='app_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useraccount',
+            index=models.Index(django.db.models.functions.text.Lower('last_name'), name='app_user_last_name_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2 on 2026-10-18 17:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_user_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_seq', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.conversationmessage'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversationmessage',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='conversationmessage',
+            constraint=models.UniqueConstraint(fields=('conversation', 'seq'), name='app_message_conv_seq_uniq'),
+        ),
+        migrations.AddField(
+            model_name='conversationreadstate',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='app.conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationreadstate',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='conversationreadstate',
+            constraint=models.UniqueConstraint(fields=('conversation', 'user'), name='app_read_state_conv_user_uniq'),
+        ),
+    ]
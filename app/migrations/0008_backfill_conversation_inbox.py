@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+def backfill_inbox(apps, schema_editor):
+    """
+    Number the existing messages of each conversation and set its latest
+    message.
+    - Existing members are marked as having read everything, so the
+      inbox doesn't start with every old message unread.
+    """
+    Conversation = apps.get_model('app', 'Conversation')
+    ConversationMessage = apps.get_model('app', 'ConversationMessage')
+    ConversationReadState = apps.get_model('app', 'ConversationReadState')
+    Membership = Conversation.members.through
+
+    for conversation_id in Conversation.objects.values_list('id', flat=True):
+        messages = list(ConversationMessage.objects
+                        .filter(conversation_id=conversation_id)
+                        .order_by('created_at', 'id')
+                        .only('id'))
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+        ConversationMessage.objects.bulk_update(messages, ['seq'],
+                                                batch_size=500)
+
+        last_seq = len(messages)
+        (Conversation.objects
+         .filter(id=conversation_id)
+         .update(last_seq=last_seq,
+                 last_message_id=messages[-1].id if messages else None))
+
+        ConversationReadState.objects.bulk_create([
+            ConversationReadState(conversation_id=conversation_id,
+                                  user_id=user_id,
+                                  last_read_seq=last_seq)
+            for user_id in (Membership.objects
+                            .filter(conversation_id=conversation_id)
+                            .values_list('useraccount_id', flat=True))
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_conversation_inbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
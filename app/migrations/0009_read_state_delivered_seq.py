@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 17:33
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_delivered_seq(apps, schema_editor):
+    """
+    Messages already read were delivered too.
+    """
+    ConversationReadState = apps.get_model('app', 'ConversationReadState')
+    ConversationReadState.objects.update(last_delivered_seq=F('last_read_seq'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_backfill_conversation_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationreadstate',
+            name='last_delivered_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_delivered_seq,
+                             migrations.RunPython.noop),
+    ]
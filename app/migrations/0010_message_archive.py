@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 17:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_read_state_delivered_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='archive_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('first_seq', models.PositiveBigIntegerField()),
+                ('last_seq', models.PositiveBigIntegerField()),
+                ('oldest_created_at', models.DateTimeField()),
+                ('newest_created_at', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='app.conversation')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='messagearchive',
+            index=models.Index(fields=['conversation', '-newest_created_at'], name='app_archive_conv_newest_idx'),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 4.2 on 2026-10-18 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# SQLite keeps the search index in an FTS5 table, kept in sync with the
+# messages by triggers. The map table points message ids at FTS rowids,
+# as FTS5 tables can't index their other columns.
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE app_message_fts USING fts5(
+        text,
+        message_id UNINDEXED,
+        conversation_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TABLE app_message_fts_map (
+        message_id char(32) NOT NULL PRIMARY KEY,
+        fts_rowid integer NOT NULL
+    )
+    """,
+    """
+    CREATE TRIGGER app_message_fts_insert
+    AFTER INSERT ON app_conversationmessage BEGIN
+        INSERT INTO app_message_fts (text, message_id, conversation_id)
+        VALUES (new.text, new.id, new.conversation_id);
+        INSERT INTO app_message_fts_map (message_id, fts_rowid)
+        VALUES (new.id, last_insert_rowid());
+    END
+    """,
+    """
+    CREATE TRIGGER app_message_fts_delete
+    AFTER DELETE ON app_conversationmessage BEGIN
+        DELETE FROM app_message_fts WHERE rowid = (
+            SELECT fts_rowid FROM app_message_fts_map
+            WHERE message_id = old.id
+        );
+        DELETE FROM app_message_fts_map WHERE message_id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER app_message_fts_update
+    AFTER UPDATE OF text ON app_conversationmessage BEGIN
+        UPDATE app_message_fts SET text = new.text WHERE rowid = (
+            SELECT fts_rowid FROM app_message_fts_map
+            WHERE message_id = new.id
+        );
+    END
+    """,
+    """
+    INSERT INTO app_message_fts (text, message_id, conversation_id)
+    SELECT text, id, conversation_id FROM app_conversationmessage
+    """,
+    """
+    INSERT INTO app_message_fts_map (message_id, fts_rowid)
+    SELECT message_id, rowid FROM app_message_fts
+    """,
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS app_message_fts_update',
+    'DROP TRIGGER IF EXISTS app_message_fts_delete',
+    'DROP TRIGGER IF EXISTS app_message_fts_insert',
+    'DROP TABLE IF EXISTS app_message_fts_map',
+    'DROP TABLE IF EXISTS app_message_fts',
+]
+
+
+def create_fts_index(apps, schema_editor):
+    """
+    Create and fill the FTS5 index on SQLite databases. Other databases
+    use the MessageSearchTerm table, see app.services.search_services.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in SQLITE_CREATE:
+        schema_editor.execute(sql)
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in SQLITE_DROP:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_message_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveIntegerField(default=1)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.conversation')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='app.conversationmessage')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='messagesearchterm',
+            index=models.Index(fields=['term', 'conversation'], name='app_search_term_conv_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='messagesearchterm',
+            constraint=models.UniqueConstraint(fields=('message', 'term'), name='app_search_message_term_uniq'),
+        ),
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
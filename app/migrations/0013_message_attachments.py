@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-18 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_group_conversations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('sha256', models.CharField(editable=False, max_length=64, primary_key=True, serialize=False)),
+                ('size', models.PositiveBigIntegerField()),
+                ('content_type', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversations', models.ManyToManyField(related_name='attachments', to='app.conversation')),
+                ('uploaders', models.ManyToManyField(related_name='attachments', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversationmessage',
+            name='attachment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='app.attachment'),
+        ),
+    ]
@@ -4,6 +4,9 @@ from django.contrib.auth.models import (BaseUserManager,
                                         AbstractBaseUser,
                                         PermissionsMixin)
 from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.utils.text import Truncator
 
 
@@ -54,6 +57,16 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
+    class Meta:
+        indexes = [
+            # User directory by name, also serves first name prefix search
+            models.Index(Lower('first_name'), Lower('last_name'), F('id'),
+                         name='app_user_name_idx'),
+            # Last name prefix search
+            models.Index(Lower('last_name'),
+                         name='app_user_last_name_idx'),
+        ]
+
     def __str__(self):
         return str(self.email)
 
@@ -62,28 +75,90 @@ class Conversation(models.Model):
     """
     Model representing a Conversation between Users.
     - Many to Many Relationship with User Model.
+    - Direct conversations have a pair_key, group conversations don't.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     members = models.ManyToManyField(settings.AUTH_USER_MODEL,
                                      related_name='conversations')
+    # Group conversations only
+    name = models.CharField(max_length=100, blank=True, default='')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                   related_name='+',
+                                   null=True, blank=True,
+                                   on_delete=models.SET_NULL)
+    # Sorted ids of the two members of a direct conversation, so it can be
+    # found with a single indexed lookup. The unique constraint also stops
+    # concurrent requests from creating the same conversation twice.
+    pair_key = models.CharField(max_length=73, unique=True, null=True,
+                                blank=True, editable=False)
+    # Kept up to date as messages are saved, so the inbox reads them
+    # without looking at the messages table.
+    # - last_seq: sequence number of the latest message.
+    # - last_message: the latest message, for previews.
+    last_seq = models.PositiveBigIntegerField(default=0, editable=False)
+    # Sequence number of the latest message moved to the archive, 0 if
+    # the conversation has no archived messages.
+    archive_seq = models.PositiveBigIntegerField(default=0, editable=False)
+    last_message = models.ForeignKey('ConversationMessage',
+                                     related_name='+',
+                                     null=True, blank=True,
+                                     editable=False,
+                                     on_delete=models.SET_NULL)
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ('-modified_at', )
 
+    @staticmethod
+    def make_pair_key(first_user_id, second_user_id):
+        """
+        Return the pair key of a direct conversation between two users.
+        """
+        return ':'.join(sorted([str(first_user_id), str(second_user_id)]))
+
+    @property
+    def is_group(self):
+        return self.pair_key is None
+
     def __str__(self):
+        if self.is_group:
+            return f"Group {self.name or self.id}"
         return (
             f"Conversation between "
             f"{' & '.join(self.members.all().values_list('email', flat=True))}"
         )
 
 
+class Attachment(models.Model):
+    """
+    Model representing an uploaded file, stored once per content.
+    - The file is kept under CHAT_ATTACHMENT_DIR, named by the SHA-256
+      of its content, see app.services.attachment_services.
+    - Many to Many Relationship with the User model, for the users who
+      uploaded it, and the Conversation model, for the conversations
+      with a message referencing it. Both can download it.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True,
+                              editable=False)
+    size = models.PositiveBigIntegerField()
+    content_type = models.CharField(max_length=100)
+    uploaders = models.ManyToManyField(settings.AUTH_USER_MODEL,
+                                       related_name='attachments')
+    conversations = models.ManyToManyField(Conversation,
+                                           related_name='attachments')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.content_type}, {self.size} bytes)"
+
+
 class ConversationMessage(models.Model):
     """
     Model representing a message within a conversation.
     - Foreign key relationship with Conversation model.
     - Foreign key relationship with User model.
+    - Optional foreign key relationship with Attachment model, by hash.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     conversation = models.ForeignKey(Conversation,
@@ -93,10 +168,31 @@ class ConversationMessage(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL,
                                related_name='created_messages',
                                on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the message object is built, so messages persisted later
+    # in a batch keep the time they were received.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Position of the message in its conversation, starting at 1
+    seq = models.PositiveBigIntegerField(null=True, blank=True,
+                                         editable=False)
+    attachment = models.ForeignKey(Attachment,
+                                   related_name='messages',
+                                   null=True, blank=True,
+                                   on_delete=models.PROTECT)
 
     class Meta:
         ordering = ('-created_at', )
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'seq'],
+                                    name='app_message_conv_seq_uniq'),
+        ]
+        indexes = [
+            # Conversation history, newest first
+            models.Index(fields=['conversation', '-created_at', '-id'],
+                         name='app_message_conv_created_idx'),
+            # Messages of a user, newest first
+            models.Index(fields=['sender', '-created_at'],
+                         name='app_message_sender_created_idx'),
+        ]
 
     def __str__(self):
         return (
@@ -104,3 +200,96 @@ class ConversationMessage(models.Model):
             f"{self.conversation.members.exclude(email=self.sender).first()} "
             f" ------ {Truncator(self.text).words(5)}"
         )
+
+
+class ConversationReadState(models.Model):
+    """
+    Model representing how far a member has read a conversation.
+    - Foreign key relationship with Conversation model.
+    - Foreign key relationship with User model.
+    - Created on the first message the member sends or acknowledges.
+    """
+    conversation = models.ForeignKey(Conversation,
+                                     related_name='read_states',
+                                     on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             related_name='read_states',
+                             on_delete=models.CASCADE)
+    # Sequence numbers of the latest messages the member has read, and
+    # has received on one of their devices.
+    last_read_seq = models.PositiveBigIntegerField(default=0)
+    last_delivered_seq = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'],
+                                    name='app_read_state_conv_user_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} read {self.conversation_id} " \
+               f"up to {self.last_read_seq}"
+
+
+class MessageArchive(models.Model):
+    """
+    Model representing a segment of archived messages.
+    - Foreign key relationship with Conversation model.
+    - The messages are kept in a gzip'd JSON lines file under
+      CHAT_ARCHIVE_DIR, oldest first.
+    """
+    conversation = models.ForeignKey(Conversation,
+                                     related_name='archives',
+                                     on_delete=models.CASCADE)
+    # Path of the segment file, relative to CHAT_ARCHIVE_DIR
+    path = models.CharField(max_length=255, unique=True)
+    first_seq = models.PositiveBigIntegerField()
+    last_seq = models.PositiveBigIntegerField()
+    oldest_created_at = models.DateTimeField()
+    newest_created_at = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Segments of a conversation, newest first
+            models.Index(fields=['conversation', '-newest_created_at'],
+                         name='app_archive_conv_newest_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.conversation_id} messages {self.first_seq} " \
+               f"to {self.last_seq}"
+
+
+class MessageSearchTerm(models.Model):
+    """
+    Model representing a term of a message in the search index.
+    - Foreign key relationship with ConversationMessage model.
+    - Only filled by the 'table' search backend, SQLite databases use
+      the app_message_fts FTS5 table instead.
+    """
+    message = models.ForeignKey(ConversationMessage,
+                                related_name='search_terms',
+                                on_delete=models.CASCADE)
+    # Copied from the message, so terms are filtered by conversation
+    # without a join.
+    conversation = models.ForeignKey(Conversation,
+                                     related_name='+',
+                                     on_delete=models.CASCADE)
+    term = models.CharField(max_length=64)
+    # Occurrences of the term in the message, for ranking
+    frequency = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'term'],
+                                    name='app_search_message_term_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['term', 'conversation'],
+                         name='app_search_term_conv_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} in {self.message_id}"
@@ -0,0 +1,158 @@
+import base64
+import binascii
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering values of a row into an opaque cursor string.
+    """
+    values = [value.isoformat() if hasattr(value, 'isoformat')
+              else str(value) for value in values]
+    return (base64.urlsafe_b64encode(json.dumps(values).encode('utf8'))
+            .decode('ascii'))
+
+
+def decode_cursor(cursor, size, parsers=None):
+    """
+    Decode a cursor string into its ordering values.
+    - Raises ValueError if the cursor is malformed.
+
+    Params:
+    - cursor: The cursor string.
+    - size: Number of ordering values.
+    - parsers: Optional callables turning each value into the type of
+               its field, raising ValueError for invalid values, so
+               crafted cursors don't reach the database.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+    if (not isinstance(values, list) or len(values) != size
+            or not all(isinstance(value, str) for value in values)):
+        raise ValueError("Invalid cursor.")
+
+    if parsers is not None:
+        try:
+            values = [parse(value) for parse, value in zip(parsers, values)]
+        except (ValueError, TypeError) as e:
+            raise ValueError("Invalid cursor.") from e
+    return values
+
+
+def parse_cursor_datetime(value):
+    """
+    Parse a datetime cursor value, raising ValueError if it isn't one.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError("Invalid datetime.")
+    return parsed
+
+
+def _row_values(row, fields):
+    if isinstance(row, dict):
+        return [row[field] for field in fields]
+    return [getattr(row, field) for field in fields]
+
+
+def _keyset_filter(fields, values, lookup):
+    """
+    Build `(f1, f2, ...) <lookup> (v1, v2, ...)` as a tuple comparison.
+    """
+    condition = Q()
+    for i, field in enumerate(fields):
+        step = Q(**{f"{field}__{lookup}": values[i]})
+        for previous_field, previous_value in zip(fields[:i], values[:i]):
+            step &= Q(**{previous_field: previous_value})
+        condition |= step
+    return condition
+
+
+def keyset_paginate(queryset, fields, before=None, after=None, limit=50):
+    """
+    Keyset (cursor) pagination over a queryset ordered newest first.
+
+    The cost of a page does not depend on how deep it is, as the cursor
+    is turned into an indexed range filter instead of an OFFSET.
+
+    Params:
+    - queryset: The queryset to paginate.
+    - fields: Ordering fields, descending, ending with a unique field.
+    - before: Cursor; return the rows older than it.
+    - after: Cursor; return the rows newer than it.
+    - limit: Maximum number of rows in the page.
+
+    Returns:
+    - page: Dict with the `results` (newest first), whether there are
+            `has_more` rows in the direction of travel, and the `before`
+            and `after` cursors for the neighbouring pages.
+    """
+    descending = [f"-{field}" for field in fields]
+
+    if after is not None:
+        values = decode_cursor(after, len(fields))
+        rows = list(queryset
+                    .filter(_keyset_filter(fields, values, 'gt'))
+                    .order_by(*fields)[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+    else:
+        if before is not None:
+            values = decode_cursor(before, len(fields))
+            queryset = queryset.filter(_keyset_filter(fields, values, 'lt'))
+        rows = list(queryset.order_by(*descending)[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+    def cursor(row):
+        return encode_cursor(_row_values(row, fields))
+
+    older_exists = has_more if after is None else bool(rows)
+    return {
+        'results': rows,
+        'has_more': has_more,
+        'before': cursor(rows[-1]) if rows and older_exists else None,
+        'after': cursor(rows[0]) if rows else after,
+    }
+
+
+def forward_page(rows, fields, limit):
+    """
+    Build a page from up to `limit + 1` rows in ascending order.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'results': rows,
+        'has_more': has_more,
+        'after': (encode_cursor(_row_values(rows[-1], fields))
+                  if has_more else None),
+    }
+
+
+def forward_paginate(queryset, fields, after=None, limit=50):
+    """
+    Keyset (cursor) pagination over a queryset in ascending order, one
+    page after the other.
+
+    Params:
+    - queryset: The queryset to paginate, rows may be instances or dicts.
+    - fields: Ordering fields, ascending, ending with a unique field.
+    - after: Cursor; return the rows after it.
+    - limit: Maximum number of rows in the page.
+
+    Returns:
+    - page: Dict with the `results`, whether there are `has_more` rows
+            and the `after` cursor of the next page.
+    """
+    if after is not None:
+        values = decode_cursor(after, len(fields))
+        queryset = queryset.filter(_keyset_filter(fields, values, 'gt'))
+
+    rows = list(queryset.order_by(*fields)[:limit + 1])
+    return forward_page(rows, fields, limit)
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from django.conf import settings
+from app.fanout import get_group_registry
+from app.protocol.codecs import build_event
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """
+    In-memory store of the open sockets of this process, per user and
+    conversation group. Nothing is read from or written to the database.
+
+    - A socket stays online while it sends frames or heartbeats, and is
+      expired `ttl` seconds after the last one.
+    - A user is online in a group while they have a live socket on it,
+      and online while they have a live socket anywhere.
+    - Safe to share between the event loop and the thread pool.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._connections = {}
+        self._groups = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, user_id, group):
+        """
+        Register a socket.
+
+        Returns:
+        - first: True if it is the first live socket of the user in the
+          group.
+        """
+        with self._lock:
+            return self._add(key, str(user_id), group)
+
+    def _add(self, key, user_id, group):
+        expires = time.monotonic() + self.ttl
+        if key in self._connections:
+            self._connections[key][2] = expires
+            return False
+
+        self._connections[key] = [user_id, group, expires]
+        members = self._groups.setdefault(group, {})
+        members[user_id] = members.get(user_id, 0) + 1
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        return members[user_id] == 1
+
+    def touch(self, key, user_id, group):
+        """
+        Keep a socket alive, registering it again if it had expired.
+
+        Returns:
+        - first: True if the user came back online in the group.
+        """
+        return self.add(key, user_id, group)
+
+    def remove(self, key):
+        """
+        Unregister a socket.
+
+        Returns:
+        - last: True if it was the last live socket of the user in the
+          group.
+        """
+        with self._lock:
+            return self._remove(key)
+
+    def _remove(self, key):
+        connection = self._connections.pop(key, None)
+        if connection is None:
+            return False
+
+        user_id, group, _ = connection
+        members = self._groups[group]
+        members[user_id] -= 1
+        self._users[user_id] -= 1
+        if not self._users[user_id]:
+            del self._users[user_id]
+        if members[user_id]:
+            return False
+
+        del members[user_id]
+        if not members:
+            del self._groups[group]
+        return True
+
+    def expire(self):
+        """
+        Drop the sockets that stopped sending heartbeats.
+
+        Returns:
+        - offline: (user_id, group) pairs whose last socket expired.
+        """
+        now = time.monotonic()
+        offline = []
+        with self._lock:
+            expired = [(key, connection)
+                       for key, connection in self._connections.items()
+                       if connection[2] <= now]
+            for key, (user_id, group, _) in expired:
+                if self._remove(key):
+                    offline.append((user_id, group))
+        return offline
+
+    def is_online(self, user_id):
+        return str(user_id) in self._users
+
+    def online_in(self, group):
+        """
+        Return the ids of the users online in a group.
+        """
+        with self._lock:
+            return set(self._groups.get(group, ()))
+
+    def clear(self):
+        with self._lock:
+            self._connections.clear()
+            self._groups.clear()
+            self._users.clear()
+
+
+presence = PresenceTracker(ttl=settings.CHAT_PRESENCE_TTL)
+
+
+async def send_presence(group, user_id, status):
+    """
+    Tell the members of a group that a user went online or offline.
+    """
+    await get_group_registry().group_send(group, build_event(
+        'chat.presence',
+        {'type': 'presence', 'user_id': str(user_id), 'status': status},
+    ))
+
+
+async def sweep_presence():
+    """
+    Expire silent sockets and tell their groups the users went offline.
+    A failed send doesn't stop the others.
+    """
+    for user_id, group in presence.expire():
+        try:
+            await send_presence(group, user_id, 'offline')
+        except Exception:
+            logger.exception("Failed to send the presence of user %s",
+                             user_id)
+
+
+async def _sweep():
+    while True:
+        await asyncio.sleep(presence.ttl / 2)
+        try:
+            await sweep_presence()
+        except Exception:
+            logger.exception("Failed to sweep presence")
+
+
+_sweepers = weakref.WeakKeyDictionary()
+
+
+def ensure_presence_sweeper():
+    """
+    Start the task expiring silent sockets on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _sweepers:
+        _sweepers[loop] = asyncio.ensure_future(_sweep())
@@ -0,0 +1,75 @@
+import json
+from app.protocol import msgpack
+
+
+class JSONCodec:
+    """
+    JSON text frames, the default wire format.
+    """
+    name = 'json'
+    binary = False
+
+    def encode(self, value):
+        return json.dumps(value)
+
+    def decode(self, data):
+        return json.loads(data)
+
+    def join(self, frames):
+        """
+        Return one array frame holding already encoded frames.
+        """
+        return '[' + ','.join(frames) + ']'
+
+
+class MessagePackCodec:
+    """
+    MessagePack binary frames, for clients on metered links.
+    """
+    name = 'msgpack'
+    binary = True
+
+    def encode(self, value):
+        return msgpack.packb(value)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
+
+    def join(self, frames):
+        return msgpack.pack_array_header(len(frames)) + b''.join(frames)
+
+
+CODECS = {codec.name: codec for codec in (JSONCodec(), MessagePackCodec())}
+
+
+def build_event(handler, payload):
+    """
+    Return a group event delivering `payload` to clients.
+    - The JSON frame is serialized once here instead of once per
+      recipient.
+    """
+    return {
+        'type': handler,
+        'payload': payload,
+        'frames': {'json': CODECS['json'].encode(payload)},
+    }
+
+
+def encode_event(event, codec):
+    """
+    Return the frame of a group event in the format of a codec.
+    - Each format is encoded once per event and process, the frames are
+      kept on the event for the other recipients.
+
+    Params:
+    - event: Group event with the `payload` sent to clients.
+    - codec: Codec of the receiving connection.
+
+    Returns:
+    - frame: Encoded frame, str or bytes.
+    """
+    frames = event.setdefault('frames', {})
+    frame = frames.get(codec.name)
+    if frame is None:
+        frame = frames[codec.name] = codec.encode(event['payload'])
+    return frame
@@ -0,0 +1,44 @@
+from autobahn.websocket.compress import (PerMessageDeflateOffer,
+                                         PerMessageDeflateOfferAccept)
+from django.conf import settings
+
+
+def accept_permessage_deflate(offers):
+    """
+    Accept the first permessage-deflate offer of a WebSocket handshake.
+    - The server side context takeover and window size follow the
+      CHAT_WS_COMPRESSION_* settings, when the client allows it.
+
+    Params:
+    - offers: Extension offers parsed by autobahn.
+
+    Returns:
+    - accept: Offer accept, or None to not compress the connection.
+    """
+    if not settings.CHAT_WS_COMPRESSION:
+        return None
+
+    for offer in offers:
+        if not isinstance(offer, PerMessageDeflateOffer):
+            continue
+
+        options = {}
+        if (settings.CHAT_WS_COMPRESSION_NO_CONTEXT_TAKEOVER
+                and offer.accept_no_context_takeover):
+            options['no_context_takeover'] = True
+        if (settings.CHAT_WS_COMPRESSION_WINDOW_BITS
+                and offer.accept_max_window_bits):
+            options['window_bits'] = settings.CHAT_WS_COMPRESSION_WINDOW_BITS
+
+        return PerMessageDeflateOfferAccept(offer, **options)
+
+    return None
+
+
+def enable_compression(factory):
+    """
+    Make an autobahn WebSocket server factory negotiate permessage-deflate.
+    """
+    factory.setProtocolOptions(
+        perMessageCompressionAccept=accept_permessage_deflate
+    )
@@ -0,0 +1,69 @@
+import asyncio
+from app.protocol.codecs import CODECS
+
+
+class FrameCoalescer:
+    """
+    Coalesces the outgoing frames of a connection into array frames.
+
+    - The first frame after an idle period is sent right away, in an
+      array of one, and opens a window of `window` seconds.
+    - Frames pushed during the window are buffered and sent together when
+      it ends, or as soon as `max_messages` are buffered.
+    - A window that ends with nothing buffered closes; the connection is
+      idle again.
+    """
+    def __init__(self, send, window, max_messages, join=None):
+        self._send = send
+        self._join = join or CODECS['json'].join
+        self.window = window
+        self.max_messages = max_messages
+        self.buffer = []
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    async def push(self, frame):
+        """
+        Queue one encoded value for delivery.
+        """
+        if self._timer is None:
+            self._timer = asyncio.ensure_future(self._run_window())
+            await self._write([frame])
+            return
+
+        self.buffer.append(frame)
+        if len(self.buffer) >= self.max_messages:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Send the buffered frames now.
+        """
+        if self.buffer:
+            frames, self.buffer = self.buffer, []
+            await self._write(frames)
+
+    def close(self):
+        """
+        Stop the window timer, buffered frames are dropped.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.buffer = []
+
+    async def _write(self, frames):
+        # Keep frames in order when a flush and a push overlap
+        async with self._lock:
+            await self._send(self._join(frames))
+
+    async def _run_window(self):
+        try:
+            while True:
+                await asyncio.sleep(self.window)
+                if not self.buffer:
+                    break
+                await self.flush()
+        finally:
+            if self._timer is asyncio.current_task():
+                self._timer = None
@@ -0,0 +1,200 @@
+import struct
+
+
+class PackError(ValueError):
+    pass
+
+
+def pack_array_header(size):
+    """
+    Return the MessagePack header of an array of `size` items.
+    """
+    if size < 16:
+        return bytes((0x90 | size,))
+    if size < 1 << 16:
+        return b'\xdc' + struct.pack('>H', size)
+    return b'\xdd' + struct.pack('>I', size)
+
+
+def _pack_map_header(size):
+    if size < 16:
+        return bytes((0x80 | size,))
+    if size < 1 << 16:
+        return b'\xde' + struct.pack('>H', size)
+    return b'\xdf' + struct.pack('>I', size)
+
+
+def _pack_int(value):
+    if 0 <= value < 128:
+        return bytes((value,))
+    if -32 <= value < 0:
+        return struct.pack('>b', value)
+    if value >= 0:
+        for code, fmt, limit in ((b'\xcc', '>B', 1 << 8),
+                                 (b'\xcd', '>H', 1 << 16),
+                                 (b'\xce', '>I', 1 << 32),
+                                 (b'\xcf', '>Q', 1 << 64)):
+            if value < limit:
+                return code + struct.pack(fmt, value)
+    else:
+        for code, fmt, limit in ((b'\xd0', '>b', 1 << 7),
+                                 (b'\xd1', '>h', 1 << 15),
+                                 (b'\xd2', '>i', 1 << 31),
+                                 (b'\xd3', '>q', 1 << 63)):
+            if value >= -limit:
+                return code + struct.pack(fmt, value)
+    raise PackError("Integer out of range.")
+
+
+def _pack_str(value):
+    data = value.encode('utf8')
+    size = len(data)
+    if size < 32:
+        return bytes((0xa0 | size,)) + data
+    if size < 1 << 8:
+        return b'\xd9' + struct.pack('>B', size) + data
+    if size < 1 << 16:
+        return b'\xda' + struct.pack('>H', size) + data
+    return b'\xdb' + struct.pack('>I', size) + data
+
+
+def _pack_bin(value):
+    size = len(value)
+    if size < 1 << 8:
+        return b'\xc4' + struct.pack('>B', size) + value
+    if size < 1 << 16:
+        return b'\xc5' + struct.pack('>H', size) + value
+    return b'\xc6' + struct.pack('>I', size) + value
+
+
+def _pack(value, chunks):
+    if value is None:
+        chunks.append(b'\xc0')
+    elif value is True:
+        chunks.append(b'\xc3')
+    elif value is False:
+        chunks.append(b'\xc2')
+    elif isinstance(value, int):
+        chunks.append(_pack_int(value))
+    elif isinstance(value, float):
+        chunks.append(b'\xcb' + struct.pack('>d', value))
+    elif isinstance(value, str):
+        chunks.append(_pack_str(value))
+    elif isinstance(value, (bytes, bytearray)):
+        chunks.append(_pack_bin(bytes(value)))
+    elif isinstance(value, (list, tuple)):
+        chunks.append(pack_array_header(len(value)))
+        for item in value:
+            _pack(item, chunks)
+    elif isinstance(value, dict):
+        chunks.append(_pack_map_header(len(value)))
+        for key, item in value.items():
+            _pack(key, chunks)
+            _pack(item, chunks)
+    else:
+        raise TypeError(f"Can't pack {type(value).__name__} values.")
+
+
+def packb(value):
+    """
+    Encode a value in MessagePack.
+    - Supports None, bool, int, float, str, bytes, lists, tuples and dicts.
+    """
+    chunks = []
+    _pack(value, chunks)
+    return b''.join(chunks)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size):
+        end = self.offset + size
+        if end > len(self.data):
+            raise PackError("Truncated MessagePack data.")
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))[0]
+
+
+# Fixed width values, keyed by type code
+_FIXED = {
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xca: '>f', 0xcb: '>d',
+}
+
+# Length prefixed values: (length format, kind)
+_SIZED = {
+    0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+    0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+    0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'), 0xdf: ('>I', 'map'),
+}
+
+
+def _unpack(reader, depth):
+    if depth > 64:
+        raise PackError("MessagePack data is nested too deeply.")
+
+    code = reader.unpack('>B')
+
+    if code <= 0x7f:
+        return code
+    if code >= 0xe0:
+        return code - 0x100
+    if 0xa0 <= code <= 0xbf:
+        return _read(reader, 'str', code & 0x1f, depth)
+    if 0x90 <= code <= 0x9f:
+        return _read(reader, 'array', code & 0x0f, depth)
+    if 0x80 <= code <= 0x8f:
+        return _read(reader, 'map', code & 0x0f, depth)
+    if code == 0xc0:
+        return None
+    if code in (0xc2, 0xc3):
+        return code == 0xc3
+    if code in _FIXED:
+        return reader.unpack(_FIXED[code])
+    if code in _SIZED:
+        fmt, kind = _SIZED[code]
+        return _read(reader, kind, reader.unpack(fmt), depth)
+
+    raise PackError(f"Unsupported MessagePack type 0x{code:02x}.")
+
+
+def _read(reader, kind, size, depth):
+    if kind == 'str':
+        try:
+            return str(reader.take(size), 'utf8')
+        except UnicodeDecodeError:
+            raise PackError("Invalid UTF-8 string.")
+    if kind == 'bin':
+        return bytes(reader.take(size))
+    if kind == 'array':
+        return [_unpack(reader, depth + 1) for _ in range(size)]
+
+    result = {}
+    for _ in range(size):
+        key = _unpack(reader, depth + 1)
+        if isinstance(key, (list, dict)):
+            raise PackError("Unhashable map key.")
+        result[key] = _unpack(reader, depth + 1)
+    return result
+
+
+def unpackb(data):
+    """
+    Decode one MessagePack value.
+    - Raises PackError if the data is invalid, truncated or has trailing
+      bytes.
+    """
+    reader = _Reader(data)
+    value = _unpack(reader, 0)
+    if reader.offset != len(reader.data):
+        raise PackError("Trailing bytes after MessagePack value.")
+    return value
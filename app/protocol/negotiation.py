@@ -0,0 +1,80 @@
+import re
+from urllib.parse import parse_qs
+from app.protocol.codecs import CODECS
+from app.services.chat_services import MAX_SEQ
+
+# Subprotocol a client offers to receive batched frames
+BATCH_SUBPROTOCOL = 'chat.batch.v1'
+
+# Subprotocols a client offers for MessagePack frames, unbatched or batched
+MSGPACK_SUBPROTOCOL = 'chat.msgpack.v1'
+MSGPACK_BATCH_SUBPROTOCOL = 'chat.msgpack.batch.v1'
+
+# Wire options of each subprotocol
+SUBPROTOCOLS = {
+    BATCH_SUBPROTOCOL: {'batch': True, 'format': 'json'},
+    MSGPACK_SUBPROTOCOL: {'batch': False, 'format': 'msgpack'},
+    MSGPACK_BATCH_SUBPROTOCOL: {'batch': True, 'format': 'msgpack'},
+}
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+# ASCII digits only, str.isdigit also accepts e.g. "²"
+SEQ_RE = re.compile(r'[0-9]+')
+
+
+def get_query_params(scope):
+    """
+    Return the query string parameters of a connection scope.
+    """
+    return parse_qs(scope.get('query_string', b'').decode('utf8'))
+
+
+def negotiate(scope):
+    """
+    Work out the wire options a client asked for at connect time.
+    - The first known subprotocol the client offers wins.
+    - Otherwise `?batch=1` asks for batched frames and `?format=msgpack`
+      for MessagePack frames.
+    - `?presence=1` asks for presence and typing frames, `?receipts=1`
+      for read and delivered receipts.
+    - `?last_seq=` asks for the messages sent after that sequence number,
+      ignored unless it is a number up to MAX_SEQ.
+
+    Returns:
+    - options: Dict with `batch`, the frame `format`, `presence`,
+      `receipts`, `last_seq` (None without a valid one) and the
+      `subprotocol` to accept, if any.
+    """
+    params = get_query_params(scope)
+    subprotocols = scope.get('subprotocols') or []
+
+    def flag(name):
+        return params.get(name, [''])[0].lower() in TRUE_VALUES
+
+    options = {
+        'batch': False,
+        'format': 'json',
+        'presence': flag('presence'),
+        'receipts': flag('receipts'),
+        'last_seq': None,
+        'subprotocol': None,
+    }
+
+    last_seq = params.get('last_seq', [''])[0]
+    if SEQ_RE.fullmatch(last_seq) and int(last_seq) <= MAX_SEQ:
+        options['last_seq'] = int(last_seq)
+
+    for subprotocol in subprotocols:
+        if subprotocol in SUBPROTOCOLS:
+            options.update(SUBPROTOCOLS[subprotocol],
+                           subprotocol=subprotocol)
+            return options
+
+    options['batch'] = flag('batch')
+
+    frame_format = params.get('format', [''])[0].lower()
+    if frame_format in CODECS:
+        options['format'] = frame_format
+
+    return options
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptCoalescer:
+    """
+    Collapses the acks of a connection into read and delivered cursors,
+    saved at most once per `interval` seconds.
+
+    - Acks only move the cursors forward, a read message counts as
+      delivered too.
+    - `flush(read_seq, delivered_seq)` is called with the collapsed
+      cursors once the interval after the first pending ack ends, and
+      on close.
+    """
+    def __init__(self, flush, interval):
+        self._flush = flush
+        self.interval = interval
+        self.read_seq = 0
+        self.delivered_seq = 0
+        self._flushed = (0, 0)
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    @property
+    def pending(self):
+        return (self.read_seq, self.delivered_seq) != self._flushed
+
+    def ack(self, read_seq=0, delivered_seq=0):
+        """
+        Record an ack, scheduling a flush if it moved a cursor.
+        """
+        self.read_seq = max(self.read_seq, read_seq)
+        self.delivered_seq = max(self.delivered_seq, delivered_seq,
+                                 self.read_seq)
+
+        if self.pending and self._timer is None:
+            self._timer = asyncio.ensure_future(self._run_interval())
+
+    async def flush(self):
+        """
+        Save the cursors now, if they moved since the last flush.
+        """
+        async with self._lock:
+            cursors = (self.read_seq, self.delivered_seq)
+            if cursors == self._flushed:
+                return
+            await self._flush(*cursors)
+            self._flushed = cursors
+
+    async def close(self):
+        """
+        Stop the timer and save the pending cursors.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def _run_interval(self):
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            # Kept pending, the next ack tries again
+            logger.exception("Failed to save receipts")
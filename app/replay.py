@@ -0,0 +1,96 @@
+from bisect import bisect_right, insort
+from django.conf import settings
+
+
+class ReplayBuffer:
+    """
+    Bounded buffer of the latest messages of a group, ordered by sequence
+    number, for clients catching up after a reconnect.
+
+    - Messages are only recorded while the group has a socket in this
+      process. The buffer is dropped with the last one, so it never
+      misses a message between its first and last entries.
+    - Messages arriving out of order are put in their place, recording
+      the same message twice is a no-op.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.seqs = []
+        self.payloads = {}
+        self.watchers = 0
+
+    def record(self, seq, payload):
+        """
+        Keep a message payload, dropping the oldest one once full.
+        """
+        if seq in self.payloads:
+            return
+        insort(self.seqs, seq)
+        self.payloads[seq] = payload
+        if len(self.seqs) > self.size:
+            del self.payloads[self.seqs.pop(0)]
+
+    def since(self, last_seq):
+        """
+        Return the payloads of the messages after `last_seq`.
+
+        Returns:
+        - payloads: List ordered by sequence number, or None if the buffer
+                    doesn't hold every message after `last_seq`.
+        """
+        if not self.seqs or self.seqs[0] > last_seq + 1:
+            return None
+
+        start = bisect_right(self.seqs, last_seq)
+        missed = self.seqs[start:]
+        expected = range(last_seq + 1, last_seq + 1 + len(missed))
+        if missed != list(expected):
+            # A message still on its way, the database has it
+            return None
+        return [self.payloads[seq] for seq in missed]
+
+
+class ReplayBuffers:
+    """
+    Replay buffers of the groups with sockets in this process.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._buffers = {}
+
+    def watch(self, group):
+        """
+        Start or keep recording the messages of a group for a socket.
+        """
+        buffer = self._buffers.get(group)
+        if buffer is None:
+            buffer = self._buffers[group] = ReplayBuffer(self.size)
+        buffer.watchers += 1
+
+    def unwatch(self, group):
+        """
+        Stop recording for a socket, dropping the buffer with the last.
+        """
+        buffer = self._buffers.get(group)
+        if buffer is None:
+            return
+        buffer.watchers -= 1
+        if not buffer.watchers:
+            del self._buffers[group]
+
+    def record(self, group, payload):
+        buffer = self._buffers.get(group)
+        if buffer is not None and payload.get('seq') is not None:
+            buffer.record(payload['seq'], payload)
+
+    def since(self, group, last_seq):
+        buffer = self._buffers.get(group)
+        if buffer is None:
+            return None
+        return buffer.since(last_seq)
+
+    def clear(self):
+        self._buffers.clear()
+
+
+replay_buffers = ReplayBuffers(size=settings.CHAT_REPLAY_BUFFER_SIZE)
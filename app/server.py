@@ -0,0 +1,58 @@
+import asyncio
+import os
+from daphne.cli import CommandLineInterface
+from daphne.server import Server
+from twisted.internet.defer import Deferred
+from app.protocol.compression import enable_compression
+
+
+class ChatServer(Server):
+    """
+    daphne server that negotiates permessage-deflate on WebSockets.
+    - daphne builds its WebSocket factory when it starts running, the
+      factory is configured as it is set.
+    - SIGUSR1 drains the sockets of the server, see app.draining.
+    - daphne doesn't send ASGI lifespan events, queued messages are
+      saved by a reactor shutdown trigger instead of app.lifespan.
+    """
+    def run(self):
+        # Imported once the application has set Django up
+        from twisted.internet import reactor
+        from app.draining import install_drain_signal
+
+        install_drain_signal(reactor._asyncioEventloop)
+        reactor.addSystemEventTrigger('before', 'shutdown',
+                                      self.save_queued_messages)
+        super().run()
+
+    def save_queued_messages(self):
+        """
+        Save the messages still queued by the message writer, the reactor
+        waits for the returned Deferred before stopping.
+        """
+        from app.services.message_writer import close_message_writer
+
+        return Deferred.fromFuture(
+            asyncio.ensure_future(close_message_writer())
+        )
+
+    @property
+    def ws_factory(self):
+        return self._ws_factory
+
+    @ws_factory.setter
+    def ws_factory(self, factory):
+        enable_compression(factory)
+        self._ws_factory = factory
+
+
+class ChatCommandLineInterface(CommandLineInterface):
+    """
+    daphne command line running a ChatServer.
+    """
+    server_class = ChatServer
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    ChatCommandLineInterface.entrypoint()
@@ -0,0 +1,277 @@
+import gzip
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Greatest
+from app.caches import TTLCache
+from app.models import (Attachment, Conversation, ConversationMessage,
+                        MessageArchive)
+from app.pagination import decode_cursor, encode_cursor
+User = get_user_model()
+
+# Decoded segments, keyed by path. Segments never change once written.
+segment_cache = TTLCache(maxsize=settings.CHAT_ARCHIVE_CACHE_SIZE, ttl=300)
+
+
+def archive_path(path):
+    """
+    Return the absolute path of a segment file.
+    """
+    return Path(settings.CHAT_ARCHIVE_DIR) / path
+
+
+def write_segment(path, rows):
+    """
+    Write message rows to a gzip'd JSON lines file, replacing it only once
+    it is complete.
+    """
+    target = archive_path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + '.partial')
+
+    with gzip.open(partial, 'wt', encoding='utf8') as f:
+        for row in rows:
+            f.write(json.dumps({
+                'id': str(row['id']),
+                'seq': row['seq'],
+                'text': row['text'],
+                'sender_id': str(row['sender_id']),
+                'attachment_id': row['attachment_id'],
+                'created_at': row['created_at'].isoformat(),
+            }) + '\n')
+    os.replace(partial, target)
+
+
+def read_segment(path):
+    """
+    Return the message rows of a segment, oldest first.
+    """
+    rows = segment_cache.get(path)
+    if rows is None:
+        with gzip.open(archive_path(path), 'rt', encoding='utf8') as f:
+            rows = [json.loads(line) for line in f]
+        for row in rows:
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+        segment_cache.set(path, rows)
+    return rows
+
+
+def archive_conversation(conversation_id, cutoff, segment_size):
+    """
+    Move the messages of a conversation sent before `cutoff` to segment
+    files, `segment_size` messages at a time.
+    - The latest message stays in the table for the inbox preview.
+    - A segment is written before its messages are deleted, and removed
+      again if the delete fails.
+
+    Returns:
+    - archived: Number of messages moved.
+    """
+    archived = 0
+    while True:
+        last_message_id = (Conversation.objects
+                           .filter(id=conversation_id)
+                           .values_list('last_message_id', flat=True)
+                           .first())
+        rows = list(ConversationMessage.objects
+                    .filter(conversation_id=conversation_id,
+                            created_at__lt=cutoff)
+                    .exclude(id=last_message_id)
+                    .order_by('created_at', 'id')
+                    .values('id', 'seq', 'text', 'sender_id',
+                            'attachment_id',
+                            'created_at')[:segment_size])
+        if not rows:
+            return archived
+
+        seqs = [row['seq'] for row in rows]
+        path = (f"{conversation_id}/{min(seqs)}-{max(seqs)}-"
+                f"{uuid.uuid4().hex[:8]}.jsonl.gz")
+        write_segment(path, rows)
+
+        try:
+            with transaction.atomic():
+                MessageArchive.objects.create(
+                    conversation_id=conversation_id,
+                    path=path,
+                    first_seq=min(seqs),
+                    last_seq=max(seqs),
+                    oldest_created_at=rows[0]['created_at'],
+                    newest_created_at=rows[-1]['created_at'],
+                    message_count=len(rows),
+                )
+                ConversationMessage.objects.filter(
+                    id__in=[row['id'] for row in rows]
+                ).delete()
+                Conversation.objects.filter(id=conversation_id).update(
+                    archive_seq=Greatest('archive_seq', Value(max(seqs)))
+                )
+        except Exception:
+            archive_path(path).unlink(missing_ok=True)
+            raise
+
+        archived += len(rows)
+
+
+def archive_messages(cutoff, segment_size):
+    """
+    Archive the messages of every conversation sent before `cutoff`.
+
+    Returns:
+    - stats: Dict with the number of `conversations` and `messages`
+             archived.
+    """
+    conversation_ids = (ConversationMessage.objects
+                        .filter(created_at__lt=cutoff)
+                        .values_list('conversation_id', flat=True)
+                        .distinct())
+
+    stats = {'conversations': 0, 'messages': 0}
+    for conversation_id in list(conversation_ids):
+        archived = archive_conversation(conversation_id, cutoff,
+                                        segment_size)
+        if archived:
+            stats['conversations'] += 1
+            stats['messages'] += archived
+    return stats
+
+
+def _message_key(message):
+    return (message.created_at, str(message.id))
+
+
+def _cursor_key(cursor):
+    created_at, message_id = decode_cursor(cursor, 2)
+    return (datetime.fromisoformat(created_at), str(uuid.UUID(message_id)))
+
+
+def _row_key(row):
+    return (row['created_at'], row['id'])
+
+
+def get_archived_messages(conversation_id, before=None, after=None,
+                          limit=50):
+    """
+    Get archived messages of a conversation, read from its segments.
+
+    Params:
+    - conversation_id: The conversation to read.
+    - before: (created_at, id) key; return messages older than it,
+              newest first.
+    - after: (created_at, id) key; return messages newer than it,
+             oldest first.
+    - limit: Maximum number of messages returned.
+
+    Returns:
+    - messages: Unsaved ConversationMessage objects with their sender
+                and attachment. Messages of deleted users are left out.
+    """
+    segments = MessageArchive.objects.filter(conversation_id=conversation_id)
+    if after is not None:
+        segments = (segments.filter(newest_created_at__gte=after[0])
+                    .order_by('oldest_created_at', 'id'))
+    else:
+        if before is not None:
+            segments = segments.filter(oldest_created_at__lte=before[0])
+        segments = segments.order_by('-newest_created_at', '-id')
+
+    rows = []
+    for path in segments.values_list('path', flat=True):
+        segment = read_segment(path)
+        if after is not None:
+            rows += [row for row in segment if _row_key(row) > after]
+        else:
+            rows += [row for row in segment
+                     if before is None or _row_key(row) < before]
+        if len(rows) >= limit:
+            break
+
+    rows.sort(key=_row_key, reverse=after is None)
+    rows = rows[:limit]
+
+    senders = {
+        str(user.id): user for user in
+        User.objects.filter(id__in={row['sender_id'] for row in rows})
+        .only('id', 'first_name', 'last_name')
+    }
+    # Segments written before attachments have no attachment_id
+    attachments = Attachment.objects.in_bulk(
+        {row['attachment_id'] for row in rows if row.get('attachment_id')}
+    )
+    return [
+        ConversationMessage(id=uuid.UUID(row['id']),
+                            conversation_id=conversation_id,
+                            seq=row['seq'],
+                            text=row['text'],
+                            sender=senders[row['sender_id']],
+                            attachment=attachments.get(
+                                row.get('attachment_id')
+                            ),
+                            created_at=row['created_at'])
+        for row in rows if row['sender_id'] in senders
+    ]
+
+
+def extend_with_archive(page, conversation_id, before=None, after=None,
+                        limit=50):
+    """
+    Continue a page of the message history into the archive.
+    - Scrolling back past the oldest message in the table reads the
+      newest archived ones.
+    - The `after` cursor of an archived message returns the archived
+      and table messages newer than it.
+
+    Params:
+    - page: Page of the table, see app.pagination.keyset_paginate.
+    - conversation_id, before, after, limit: The arguments of the page.
+
+    Returns:
+    - page: The same page, with archived messages where they belong.
+    """
+    def cursor(message):
+        return encode_cursor([message.created_at, message.id])
+
+    if after is not None:
+        archived = get_archived_messages(conversation_id,
+                                         after=_cursor_key(after),
+                                         limit=limit + 1)
+        if not archived:
+            return page
+
+        messages = sorted(archived + page['results'][::-1],
+                          key=_message_key)
+        has_more = len(messages) > limit or page['has_more']
+        messages = messages[:limit][::-1]
+        return {
+            'results': messages,
+            'has_more': has_more,
+            'before': cursor(messages[-1]),
+            'after': cursor(messages[0]),
+        }
+
+    if page['has_more']:
+        return page
+
+    messages = page['results']
+    if messages:
+        key = _message_key(messages[-1])
+    else:
+        key = _cursor_key(before) if before is not None else None
+
+    needed = limit - len(messages)
+    archived = get_archived_messages(conversation_id, before=key,
+                                     limit=needed + 1)
+    has_more = len(archived) > needed
+    messages = messages + archived[:needed]
+    return {
+        'results': messages,
+        'has_more': has_more,
+        'before': cursor(messages[-1]) if messages and has_more else None,
+        'after': cursor(messages[0]) if messages else after,
+    }
@@ -0,0 +1,273 @@
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+from app.models import Attachment
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# ASCII digits, str.isdigit also accepts characters like "²"
+DIGITS_RE = re.compile(r'[0-9]+')
+BYTE_RANGE_RE = re.compile(r'([0-9]*)-([0-9]*)')
+
+# type/subtype of a media type, lowercase (RFC 6838 names)
+MEDIA_TYPE_RE = re.compile(
+    r'^[a-z0-9][a-z0-9!#$&^_.+-]{0,126}/[a-z0-9][a-z0-9!#$&^_.+-]{0,126}$'
+)
+
+# Content types shown in the browser, anything else is downloaded. Types
+# that can run scripts, like image/svg+xml, must not be added.
+INLINE_CONTENT_TYPES = frozenset({
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp',
+    'audio/mpeg', 'audio/ogg', 'audio/wav', 'audio/webm',
+    'video/mp4', 'video/webm', 'video/ogg',
+})
+
+
+class AttachmentTooLarge(ValidationError):
+    pass
+
+
+class EmptyAttachment(ValidationError):
+    pass
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def normalize_content_type(content_type):
+    """
+    Return the media type of a Content-Type header, lowercase and without
+    parameters, e.g. "Image/SVG+xml; charset=utf-8" becomes
+    "image/svg+xml".
+    - Returns None if the header isn't a valid media type.
+    """
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    if not MEDIA_TYPE_RE.match(media_type):
+        return None
+    return media_type
+
+
+def attachment_path(sha256):
+    """
+    Return the absolute path of the file of an attachment.
+    - Files are spread over two levels of directories named by the first
+      hash characters, e.g. ab/cd/abcd....
+    """
+    return (Path(settings.CHAT_ATTACHMENT_DIR)
+            / sha256[:2] / sha256[2:4] / sha256)
+
+
+def store_attachment(stream, user, content_type, max_size=None):
+    """
+    Store an upload read from a stream, once per content.
+    - The upload is written chunk by chunk to a partial file and hashed on
+      the way, it is never held in memory as a whole.
+    - The partial file is moved to its content address, or dropped if a
+      file with the same content is already stored.
+    - Raises AttachmentTooLarge past `max_size` bytes and EmptyAttachment
+      if the stream is empty.
+
+    Params:
+    - stream: File-like object to read the upload from.
+    - user: The user uploading the file.
+    - content_type: Media type given by the client, see
+                    normalize_content_type.
+    - max_size: Maximum size in bytes, CHAT_ATTACHMENT_MAX_SIZE by
+                default.
+
+    Returns:
+    - attachment: The Attachment object.
+    - created: False if the same content was already stored.
+    """
+    if max_size is None:
+        max_size = settings.CHAT_ATTACHMENT_MAX_SIZE
+    chunk_size = settings.CHAT_ATTACHMENT_CHUNK_SIZE
+
+    partial_dir = Path(settings.CHAT_ATTACHMENT_DIR) / 'partial'
+    partial_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=partial_dir, delete=False) as f:
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise AttachmentTooLarge(
+                        f"Attachments are limited to {max_size} bytes."
+                    )
+                digest.update(chunk)
+                f.write(chunk)
+            if size == 0:
+                raise EmptyAttachment("Empty upload.")
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+
+    sha256 = digest.hexdigest()
+    target = attachment_path(sha256)
+    if target.exists():
+        os.unlink(f.name)
+    else:
+        # Readable by a web server serving the files with
+        # CHAT_ATTACHMENT_ACCEL_REDIRECT
+        os.chmod(f.name, 0o644)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(f.name, target)
+
+    attachment, created = Attachment.objects.get_or_create(
+        sha256=sha256,
+        defaults={'size': size, 'content_type': content_type},
+    )
+    attachment.uploaders.add(user)
+    return attachment, created
+
+
+def get_user_attachments(user_id):
+    """
+    Get the attachments a user uploaded or can see in one of their
+    conversations.
+    """
+    return Attachment.objects.filter(
+        Q(uploaders=user_id) | Q(conversations__members=user_id)
+    ).distinct()
+
+
+def get_user_attachment(user, sha256):
+    """
+    Get an attachment the user can download, or raise Http404.
+    """
+    if not SHA256_RE.match(sha256):
+        raise Http404
+    attachment = get_user_attachments(user.id).filter(pk=sha256).first()
+    if attachment is None:
+        raise Http404
+    return attachment
+
+
+def find_user_attachment(user_id, sha256):
+    """
+    Get the metadata of an attachment a user may send in a message.
+
+    Returns:
+    - metadata: See attachment_metadata, None if the user can't see the
+                attachment.
+    """
+    if not isinstance(sha256, str) or not SHA256_RE.match(sha256):
+        return None
+    attachment = get_user_attachments(user_id).filter(pk=sha256).first()
+    if attachment is None:
+        return None
+    return attachment_metadata(attachment)
+
+
+async def afind_user_attachment(user_id, sha256):
+    """
+    Async variant of find_user_attachment.
+    """
+    if not isinstance(sha256, str) or not SHA256_RE.match(sha256):
+        return None
+    attachment = await get_user_attachments(user_id).filter(
+        pk=sha256
+    ).afirst()
+    if attachment is None:
+        return None
+    return attachment_metadata(attachment)
+
+
+def attachment_metadata(attachment):
+    """
+    Return the attachment of a `chat_message` payload.
+    """
+    return {
+        'sha256': attachment.sha256,
+        'size': attachment.size,
+        'content_type': attachment.content_type,
+    }
+
+
+def link_attachments(messages):
+    """
+    Let the members of the conversations of saved messages download their
+    attachments.
+
+    Params:
+    - messages: Saved ConversationMessage objects.
+    """
+    links = {(message.attachment_id, message.conversation_id)
+             for message in messages if message.attachment_id}
+    if not links:
+        return
+
+    Link = Attachment.conversations.through
+    Link.objects.bulk_create([
+        Link(attachment_id=attachment_id, conversation_id=conversation_id)
+        for attachment_id, conversation_id in links
+    ], ignore_conflicts=True)
+
+
+def parse_range(header, size):
+    """
+    Return the first and last byte positions requested by a Range
+    header, or None to send the whole file.
+    - Only single byte ranges are served, multiple ranges and other units
+      are ignored as RFC 9110 allows.
+    - Raises RangeNotSatisfiable if the range is malformed or past the end
+      of the file.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec:
+        return None
+    match = BYTE_RANGE_RE.fullmatch(spec)
+    if match is None or spec == '-':
+        raise RangeNotSatisfiable
+    start, end = match.groups()
+
+    if not start:
+        # Suffix range: the last `end` bytes
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+class FileRange:
+    """
+    Read-only view of `length` bytes of a file from `start`, streamed by
+    FileResponse.
+    """
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
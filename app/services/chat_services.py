@@ -1,4 +1,51 @@
-from app.models import Conversation
+import uuid
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.shortcuts import get_object_or_404
+from app.models import (Conversation, ConversationMessage,
+                        ConversationReadState)
+from app.pagination import keyset_paginate, parse_cursor_datetime
+from app.services.archive_services import extend_with_archive
+from app.services.attachment_services import link_attachments
+from app.services.search_services import index_messages
+User = get_user_model()
+
+# Ordering of the message history, newest first. `id` breaks ties between
+# messages created at the same time.
+MESSAGE_HISTORY_ORDERING = ('created_at', 'id')
+# Parsers of the history cursor values, see app.pagination.decode_cursor
+MESSAGE_HISTORY_CURSOR_PARSERS = (parse_cursor_datetime, uuid.UUID)
+
+# Ordering of the inbox, most recently active first
+INBOX_ORDERING = ('modified_at', 'id')
+INBOX_CURSOR_PARSERS = (parse_cursor_datetime, uuid.UUID)
+# Members listed per conversation in the inbox, large groups only show
+# their first members by name with the member count
+INBOX_MEMBERS_PREVIEW = 5
+
+# Largest sequence number, the limit of the PositiveBigIntegerField
+# columns holding them
+MAX_SEQ = 2 ** 63 - 1
+
+# Cursors returned by update_read_state
+READ_STATE_FIELDS = ('last_read_seq', 'last_delivered_seq')
+
+# Message columns read to replay missed messages
+MESSAGE_REPLAY_FIELDS = ('seq', 'text', 'sender_id', 'attachment_id',
+                         'attachment__size', 'attachment__content_type')
+
+
+def conversation_group_name(conversation_id):
+    """
+    Return the channel layer group name of a conversation.
+    """
+    return f"chat_{conversation_id}"
 
 
 def get_or_create_conversation(auth_user, recipient_user):
@@ -14,14 +61,467 @@ def get_or_create_conversation(auth_user, recipient_user):
     Returns:
     - conversation: The conversation object either retrieved or created.
     """
-    conversation = (Conversation.objects
-                    .filter(members=auth_user)
-                    .filter(members=recipient_user).first())
+    pair_key = Conversation.make_pair_key(auth_user.id, recipient_user.id)
+
+    conversation = Conversation.objects.filter(pair_key=pair_key).first()
+
+    if not conversation:
+        try:
+            with transaction.atomic():
+                conversation = Conversation.objects.create(pair_key=pair_key)
+                conversation.members.add(auth_user, recipient_user)
+        except IntegrityError:
+            # A concurrent request created it in the meantime
+            conversation = Conversation.objects.get(pair_key=pair_key)
+
+    return conversation
+
+
+async def aget_or_create_conversation(auth_user, recipient_user):
+    """
+    Async variant of get_or_create_conversation.
+    - Existing conversations are read with the async ORM, creating one
+      needs a transaction and runs the sync version in a thread.
+    """
+    pair_key = Conversation.make_pair_key(auth_user.id, recipient_user.id)
+
+    conversation = await Conversation.objects.filter(
+        pair_key=pair_key
+    ).afirst()
 
     if not conversation:
-        conversation = Conversation.objects.create()
-        conversation.members.add(auth_user)
-        conversation.members.add(recipient_user)
-        conversation.save()
+        conversation = await sync_to_async(get_or_create_conversation)(
+            auth_user, recipient_user
+        )
 
     return conversation
+
+
+def create_group_conversation(creator, name, member_ids):
+    """
+    Create a group conversation.
+
+    Params:
+    - creator: The user creating the group, its first member.
+    - name: Name of the group.
+    - member_ids: Ids of the other members.
+
+    Returns:
+    - conversation: The created conversation.
+    """
+    with transaction.atomic():
+        conversation = Conversation.objects.create(name=name,
+                                                   created_by=creator)
+        add_conversation_members(conversation, [creator.id, *member_ids])
+    return conversation
+
+
+def add_conversation_members(conversation, member_ids):
+    """
+    Add users to a group conversation.
+    - New members start with every earlier message read, so the group
+      history doesn't show up as unread.
+
+    Params:
+    - conversation: The group conversation.
+    - member_ids: Ids of the users to add, current members are skipped.
+
+    Returns:
+    - added: Ids of the users added.
+    """
+    with transaction.atomic():
+        # Locks the conversation row, concurrent additions can't go past
+        # CHAT_GROUP_MAX_MEMBERS
+        last_seq = (Conversation.objects.select_for_update()
+                    .filter(id=conversation.id)
+                    .values_list('last_seq', flat=True).get())
+
+        current = set(conversation.members.values_list('id', flat=True))
+        added = [member_id for member_id in dict.fromkeys(member_ids)
+                 if member_id not in current]
+        if len(current) + len(added) > settings.CHAT_GROUP_MAX_MEMBERS:
+            raise ValidationError(
+                f"Groups have at most {settings.CHAT_GROUP_MAX_MEMBERS} "
+                f"members."
+            )
+        if not added:
+            return added
+
+        conversation.members.add(*added)
+        ConversationReadState.objects.bulk_create(
+            [
+                ConversationReadState(conversation_id=conversation.id,
+                                      user_id=member_id,
+                                      last_read_seq=last_seq,
+                                      last_delivered_seq=last_seq)
+                for member_id in added
+            ],
+            update_conflicts=True,
+            unique_fields=['conversation', 'user'],
+            update_fields=['last_read_seq', 'last_delivered_seq'],
+            batch_size=500,
+        )
+    return added
+
+
+def remove_conversation_member(conversation, member_id):
+    """
+    Remove a user from a group conversation. Their open sockets are
+    closed once the change is committed.
+    """
+    conversation.members.remove(member_id)
+
+
+def get_conversation_member_ids(conversation_id):
+    """
+    Get the ids of the members of a conversation, as strings.
+    """
+    return frozenset(
+        str(member_id) for member_id in
+        User.objects.filter(conversations__id=conversation_id)
+        .values_list('id', flat=True)
+    )
+
+
+async def aget_conversation_member_ids(conversation_id):
+    """
+    Async variant of get_conversation_member_ids.
+    """
+    return frozenset([
+        str(member_id) async for member_id in
+        User.objects.filter(conversations__id=conversation_id)
+        .values_list('id', flat=True)
+    ])
+
+
+def get_user_conversation_ids(user_id):
+    """
+    Get the ids of the conversations of a user, as strings.
+    """
+    return frozenset(
+        str(conversation_id) for conversation_id in
+        Conversation.members.through.objects.filter(useraccount_id=user_id)
+        .values_list('conversation_id', flat=True)
+    )
+
+
+async def aget_user_conversation_ids(user_id):
+    """
+    Async variant of get_user_conversation_ids.
+    """
+    return frozenset([
+        str(conversation_id) async for conversation_id in
+        Conversation.members.through.objects.filter(useraccount_id=user_id)
+        .values_list('conversation_id', flat=True)
+    ])
+
+
+def get_user_conversation(user, pk):
+    """
+    Get a conversation the user is a member of, or raise Http404.
+    """
+    return get_object_or_404(Conversation.objects.filter(members=user), pk=pk)
+
+
+def get_conversation_messages(conversation_id, before=None, after=None,
+                              limit=50, archive_seq=0):
+    """
+    Get one page of a conversation's message history, newest first.
+    - Conversations with archived messages continue into the archive,
+      see app.services.archive_services.extend_with_archive.
+
+    Params:
+    - conversation_id: The conversation to read.
+    - before: Cursor; return messages older than it.
+    - after: Cursor; return messages newer than it.
+    - limit: Maximum number of messages in the page.
+    - archive_seq: Conversation.archive_seq, 0 skips the archive.
+
+    Returns:
+    - page: See app.pagination.keyset_paginate.
+    """
+    queryset = (ConversationMessage.objects
+                .filter(conversation_id=conversation_id)
+                .select_related('sender', 'attachment')
+                .only('id', 'seq', 'text', 'created_at',
+                      'sender__id', 'sender__first_name',
+                      'sender__last_name', 'attachment__sha256',
+                      'attachment__size', 'attachment__content_type'))
+
+    page = keyset_paginate(queryset, MESSAGE_HISTORY_ORDERING,
+                           before=before, after=after, limit=limit)
+    if not archive_seq:
+        return page
+    return extend_with_archive(page, conversation_id, before=before,
+                               after=after, limit=limit)
+
+
+def create_message(conversation_id, sender_id, text, attachment_id=None):
+    """
+    Save a single message and bump its conversation in one transaction.
+
+    Params:
+    - conversation_id: The conversation the message belongs to.
+    - sender_id: The user who sent the message.
+    - text: The message text.
+    - attachment_id: SHA-256 of the attached file, if any.
+
+    Returns:
+    - message: The created message object.
+    """
+    message = ConversationMessage(conversation_id=conversation_id,
+                                  sender_id=sender_id,
+                                  text=text,
+                                  attachment_id=attachment_id)
+    return create_messages([message])[0]
+
+
+async def acreate_message(conversation_id, sender_id, text,
+                          attachment_id=None):
+    """
+    Async variant of create_message.
+    - Django 4.2 has no async transactions, so the write runs as one sync
+      call in a thread, as the Django docs recommend.
+    """
+    return await sync_to_async(create_message)(conversation_id, sender_id,
+                                                text, attachment_id)
+
+
+def create_messages(messages):
+    """
+    Save a batch of unsaved messages with a single bulk insert.
+    - Each conversation in the batch reserves its sequence numbers and
+      gets its latest message set once.
+    - The read cursor of each sender is moved past their own messages.
+    - The messages are added to the search index.
+    - Their attachments become visible to the conversation members.
+
+    Params:
+    - messages: List of unsaved ConversationMessage objects, in the order
+                they were received.
+
+    Returns:
+    - messages: The created message objects.
+    """
+    if not messages:
+        return messages
+
+    batches = {}
+    for message in messages:
+        batches.setdefault(message.conversation_id, []).append(message)
+
+    read_seqs = {}
+
+    with transaction.atomic():
+        for conversation_id, batch in batches.items():
+            conversations = Conversation.objects.filter(id=conversation_id)
+
+            # Reserve the sequence numbers. The update locks the
+            # conversation row, so concurrent writers queue up here.
+            latest = batch[-1]
+            conversations.update(last_seq=F('last_seq') + len(batch),
+                                 last_message_id=latest.id,
+                                 modified_at=latest.created_at)
+            last_seq = (conversations
+                        .values_list('last_seq', flat=True).get())
+
+            for seq, message in enumerate(
+                    batch, start=last_seq - len(batch) + 1):
+                message.seq = seq
+
+            for message in batch:
+                key = (conversation_id, message.sender_id)
+                read_seqs[key] = max(read_seqs.get(key, 0), message.seq)
+
+        ConversationMessage.objects.bulk_create(messages)
+        index_messages(messages)
+        link_attachments(messages)
+
+        ConversationReadState.objects.bulk_create(
+            [
+                ConversationReadState(conversation_id=conversation_id,
+                                      user_id=user_id,
+                                      last_read_seq=seq,
+                                      last_delivered_seq=seq)
+                for (conversation_id, user_id), seq in read_seqs.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['conversation', 'user'],
+            update_fields=['last_read_seq', 'last_delivered_seq'],
+        )
+
+    return messages
+
+
+def get_messages_after(conversation_id, after_seq, limit):
+    """
+    Get the messages of a conversation sent after a sequence number,
+    oldest first, through the (conversation, seq) unique index.
+
+    Params:
+    - conversation_id: The conversation to read.
+    - after_seq: Sequence number of the latest message the client has.
+    - limit: Maximum number of messages returned.
+
+    Returns:
+    - messages: List of dicts with `seq`, `text`, `sender_id` and the
+                `attachment_id`, `attachment__size` and
+                `attachment__content_type` of the attached file.
+    """
+    return list(ConversationMessage.objects
+                .filter(conversation_id=conversation_id, seq__gt=after_seq)
+                .order_by('seq')
+                .values(*MESSAGE_REPLAY_FIELDS)[:limit])
+
+
+async def aget_messages_after(conversation_id, after_seq, limit):
+    """
+    Async variant of get_messages_after.
+    """
+    return [
+        row async for row in
+        ConversationMessage.objects
+        .filter(conversation_id=conversation_id, seq__gt=after_seq)
+        .order_by('seq')
+        .values(*MESSAGE_REPLAY_FIELDS)[:limit]
+    ]
+
+
+def _read_state_update(conversation_id, user_id, read_seq, delivered_seq):
+    """
+    Return the read states to update and the values moving them forward.
+    """
+    last_seq = Subquery(Conversation.objects
+                        .filter(id=conversation_id)
+                        .values('last_seq')[:1])
+
+    def forward(field, seq):
+        return Greatest(F(field), Least(Value(seq), last_seq))
+
+    read_states = ConversationReadState.objects.filter(
+        conversation_id=conversation_id, user_id=user_id
+    )
+    return read_states, {
+        'last_read_seq': forward('last_read_seq', read_seq),
+        'last_delivered_seq': forward('last_delivered_seq',
+                                      max(read_seq, delivered_seq)),
+    }
+
+
+def update_read_state(conversation_id, user_id, read_seq=0,
+                      delivered_seq=0):
+    """
+    Move the read and delivered cursors of a member forward, in a single
+    update once the member has a read state.
+    - Cursors never move back, nor past the latest message.
+
+    Params:
+    - conversation_id: The conversation that was read.
+    - user_id: The member who read it.
+    - read_seq: Sequence number of the latest message read.
+    - delivered_seq: Sequence number of the latest message received.
+
+    Returns:
+    - cursors: The read and delivered cursors saved, once clamped, None
+               if the conversation doesn't exist.
+    """
+    read_states, values = _read_state_update(conversation_id, user_id,
+                                             read_seq, delivered_seq)
+
+    for attempt in range(2):
+        if read_states.update(**values):
+            # Read back, they may be behind the acked ones or moved
+            # further by another connection of the member
+            return read_states.values_list(*READ_STATE_FIELDS).get()
+
+        # First ack of the member, create their read state and retry
+        if attempt or not Conversation.objects.filter(
+                id=conversation_id).exists():
+            return None
+        ConversationReadState.objects.get_or_create(
+            conversation_id=conversation_id, user_id=user_id
+        )
+
+
+async def aupdate_read_state(conversation_id, user_id, read_seq=0,
+                             delivered_seq=0):
+    """
+    Async variant of update_read_state.
+    """
+    read_states, values = _read_state_update(conversation_id, user_id,
+                                             read_seq, delivered_seq)
+
+    for attempt in range(2):
+        if await read_states.aupdate(**values):
+            return await read_states.values_list(*READ_STATE_FIELDS).aget()
+
+        if attempt or not await Conversation.objects.filter(
+                id=conversation_id).aexists():
+            return None
+        await ConversationReadState.objects.aget_or_create(
+            conversation_id=conversation_id, user_id=user_id
+        )
+
+
+def get_user_inbox(user, before=None, after=None, limit=50):
+    """
+    Get one page of the user's conversations, most recently active first,
+    with their member count and first members, latest message and
+    unread count.
+    - Two queries whatever the number of conversations: the page, and
+      the first INBOX_MEMBERS_PREVIEW members of its conversations.
+
+    Params:
+    - user: The user whose inbox is read.
+    - before: Cursor; return conversations active before it.
+    - after: Cursor; return conversations active after it.
+    - limit: Maximum number of conversations in the page.
+
+    Returns:
+    - page: See app.pagination.keyset_paginate.
+    """
+    last_read_seq = (ConversationReadState.objects
+                     .filter(conversation=OuterRef('pk'), user=user)
+                     .values('last_read_seq')[:1])
+
+    member_count = (Conversation.members.through.objects
+                    .filter(conversation=OuterRef('pk'))
+                    .values('conversation')
+                    .annotate(count=Count('*'))
+                    .values('count'))
+
+    queryset = (user.conversations
+                .select_related('last_message__sender')
+                .annotate(unread_count=(
+                    F('last_seq') - Coalesce(Subquery(last_read_seq), 0)
+                ), member_count=Subquery(member_count))
+                .prefetch_related(Prefetch(
+                    'members',
+                    queryset=(User.objects
+                              .only('id', 'first_name', 'last_name')
+                              .order_by('first_name', 'last_name', 'id')
+                              [:INBOX_MEMBERS_PREVIEW]),
+                    to_attr='member_preview',
+                )))
+
+    return keyset_paginate(queryset, INBOX_ORDERING,
+                           before=before, after=after, limit=limit)
+
+
+def invalidate_conversation_state(conversation_id):
+    """
+    Tell every open socket of a conversation to reload its cached state.
+
+    Params:
+    - conversation_id: The conversation whose membership has changed.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    # Every socket of a process handles the event, the version lets the
+    # first one reload the members shared by all of them.
+    async_to_sync(channel_layer.group_send)(
+        conversation_group_name(conversation_id),
+        {'type': 'conversation.invalidate', 'version': uuid.uuid4().hex}
+    )
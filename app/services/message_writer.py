@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import weakref
+from django.conf import settings
+from app.metrics import get_metrics, timed_database_sync_to_async
+from app.services.chat_services import create_messages
+
+logger = logging.getLogger(__name__)
+
+# Queued by MessageWriter.flush to write the current batch right away
+_FLUSH = object()
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+    - Collects messages from every consumer of the process.
+    - Saves them with one bulk insert when `batch_size` messages are
+      queued or `interval` seconds passed, whichever comes first.
+    - `enqueue` waits while the queue is full (backpressure).
+    - Messages are numbered in the batch transaction, with one update
+      per conversation, so numbers stay gapless and in order across
+      processes. `on_written` callbacks then publish them.
+    - A failed batch is retried `retries` times with a growing delay,
+      then saved message by message, so one bad message doesn't lose
+      the others.
+    """
+    def __init__(self, batch_size, interval, max_size, retries=3,
+                 retry_delay=0.1):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self._task = None
+
+    async def enqueue(self, message, on_written=None):
+        """
+        Queue an unsaved message, waiting for room if the queue is full.
+
+        Params:
+        - message: The unsaved ConversationMessage.
+        - on_written: Coroutine function called with the message and
+                      whether it was saved, once its batch is written.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        await self.queue.put((message, on_written))
+
+    async def flush(self, immediate=False):
+        """
+        Wait until every queued message has been written.
+
+        Params:
+        - immediate: Write the partial batch now instead of waiting for
+                     the interval, e.g. while the process drains.
+        """
+        if self._task is None:
+            return
+        if immediate and not self._task.done():
+            await self.queue.put(_FLUSH)
+        await self.queue.join()
+
+    async def close(self):
+        """
+        Flush the queue and stop the background writer.
+        """
+        await self.flush(immediate=True)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await self.queue.get()
+            if entry is _FLUSH:
+                self.queue.task_done()
+                continue
+            batch = [entry]
+            deadline = loop.time() + self.interval
+
+            # Keep collecting until the batch is full, the time is up or
+            # a flush asks for it
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(),
+                                                     timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _FLUSH:
+                    self.queue.task_done()
+                    break
+                batch.append(entry)
+
+            get_metrics().increment('chat_message_batches_total')
+            try:
+                await self.write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def write_batch(self, batch):
+        """
+        Save a batch of (message, on_written) entries, retrying failed
+        writes.
+        - Messages still failing on their own are logged and counted in
+          chat_messages_dropped_total.
+        """
+        metrics = get_metrics()
+        messages = [message for message, _ in batch]
+        for attempt in range(self.retries + 1):
+            # Numbered again, the failed transaction was rolled back
+            for message in messages:
+                message.seq = None
+            try:
+                await self.write(messages)
+            except Exception:
+                metrics.increment('chat_errors_total', stage='db_batch')
+                logger.exception("Failed to save %d chat messages, "
+                                 "attempt %d", len(batch), attempt + 1)
+            else:
+                await self.notify(batch, True)
+                return
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+        if len(batch) == 1:
+            metrics.increment('chat_messages_dropped_total')
+            logger.error("Dropped chat message %s of conversation %s",
+                         messages[0].id, messages[0].conversation_id)
+            await self.notify(batch, False)
+            return
+        for entry in batch:
+            await self.write_batch([entry])
+
+    async def notify(self, batch, saved):
+        """
+        Call the `on_written` callbacks of a batch, in queue order.
+        """
+        for message, on_written in batch:
+            if on_written is None:
+                continue
+            try:
+                await on_written(message, saved)
+            except Exception:
+                logger.exception("Failed to publish chat message %s",
+                                 message.id)
+
+    @timed_database_sync_to_async('db_batch')
+    def write(self, messages):
+        create_messages(messages)
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_message_writer():
+    """
+    Return the message writer of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = MessageWriter(
+            batch_size=settings.CHAT_MESSAGE_BATCH_SIZE,
+            interval=settings.CHAT_MESSAGE_BATCH_INTERVAL_MS / 1000,
+            max_size=settings.CHAT_MESSAGE_QUEUE_SIZE,
+            retries=settings.CHAT_MESSAGE_WRITE_RETRIES,
+        )
+        _writers[loop] = writer
+    return writer
+
+
+async def close_message_writer():
+    """
+    Flush and stop the message writer of the running event loop.
+    """
+    writer = _writers.pop(asyncio.get_running_loop(), None)
+    if writer is not None:
+        await writer.close()
@@ -0,0 +1,301 @@
+import re
+import unicodedata
+import uuid
+from collections import Counter
+from html import escape
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from app.models import Conversation, ConversationMessage, MessageSearchTerm
+from app.pagination import decode_cursor, encode_cursor
+
+# Created by migration 0011 on SQLite databases
+FTS_TABLE = 'app_message_fts'
+FTS_MAP_TABLE = 'app_message_fts_map'
+
+# Longest indexed term, see MessageSearchTerm.term
+MAX_TERM_LENGTH = 64
+
+# Terms of a search query, extra ones are ignored
+MAX_QUERY_TERMS = 8
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(token):
+    """
+    Case-fold a token and strip its accents, like the unicode61 FTS5
+    tokenizer with remove_diacritics.
+    """
+    decomposed = unicodedata.normalize('NFKD', token.casefold())
+    return ''.join(char for char in decomposed
+                   if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    """
+    Split text into normalized terms, in order of appearance.
+    """
+    return [normalize(token)[:MAX_TERM_LENGTH]
+            for token in TOKEN_RE.findall(text)]
+
+
+def get_search_backend():
+    """
+    Return the search backend in use, 'fts5' or 'table'.
+    """
+    backend = settings.CHAT_SEARCH_BACKEND
+    if backend == 'auto':
+        return 'fts5' if connection.vendor == 'sqlite' else 'table'
+    if backend == 'fts5' and connection.vendor != 'sqlite':
+        raise ImproperlyConfigured(
+            "CHAT_SEARCH_BACKEND 'fts5' needs a SQLite database."
+        )
+    if backend not in ('fts5', 'table'):
+        raise ImproperlyConfigured(
+            f"Unknown CHAT_SEARCH_BACKEND {backend!r}."
+        )
+    return backend
+
+
+def index_messages(messages):
+    """
+    Add saved messages to the search index.
+    - Only the 'table' backend is written here, the FTS5 table is kept
+      up to date by triggers on the messages table.
+
+    Params:
+    - messages: Saved ConversationMessage objects.
+    """
+    if get_search_backend() != 'table':
+        return
+
+    MessageSearchTerm.objects.bulk_create([
+        MessageSearchTerm(message_id=message.id,
+                          conversation_id=message.conversation_id,
+                          term=term,
+                          frequency=frequency)
+        for message in messages
+        for term, frequency in Counter(tokenize(message.text)).items()
+    ], batch_size=1000)
+
+
+def rebuild_search_index(batch_size=1000):
+    """
+    Rebuild the search index of the backend in use from the messages
+    table.
+
+    Returns:
+    - indexed: Number of messages indexed.
+    """
+    if get_search_backend() == 'fts5':
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(f"DELETE FROM {FTS_MAP_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} "
+                f"(text, message_id, conversation_id) "
+                f"SELECT text, id, conversation_id "
+                f"FROM {ConversationMessage._meta.db_table}"
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_MAP_TABLE} (message_id, fts_rowid) "
+                f"SELECT message_id, rowid FROM {FTS_TABLE}"
+            )
+            cursor.execute(f"SELECT count(*) FROM {FTS_MAP_TABLE}")
+            return cursor.fetchone()[0]
+
+    indexed = 0
+    with transaction.atomic():
+        MessageSearchTerm.objects.all().delete()
+
+        batch = []
+        messages = (ConversationMessage.objects
+                    .only('id', 'conversation_id', 'text')
+                    .iterator(chunk_size=batch_size))
+        for message in messages:
+            batch.append(message)
+            if len(batch) == batch_size:
+                index_messages(batch)
+                indexed += len(batch)
+                batch = []
+        index_messages(batch)
+        indexed += len(batch)
+    return indexed
+
+
+def _fts_query(terms):
+    """
+    Build an FTS5 query matching every term, the last one as a prefix.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _fts_search(user, terms, conversation_id, offset, limit):
+    """
+    Get the ids of matching messages from the FTS5 table, best first.
+    """
+    membership = Conversation.members.through._meta
+    conversation_field = membership.get_field('conversation')
+    user_field = membership.get_field('useraccount')
+
+    def db_value(field, value):
+        # UUIDs are stored as hex strings on SQLite
+        return field.target_field.get_db_prep_value(value, connection)
+
+    sql = (
+        f"SELECT message_id FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH %s "
+        f"AND {FTS_TABLE}.conversation_id IN ("
+        f"SELECT {conversation_field.column} FROM {membership.db_table} "
+        f"WHERE {user_field.column} = %s)"
+    )
+    params = [_fts_query(terms), db_value(user_field, user.id)]
+    if conversation_id is not None:
+        sql += f" AND {FTS_TABLE}.conversation_id = %s"
+        params.append(db_value(conversation_field, conversation_id))
+    sql += f" ORDER BY bm25({FTS_TABLE}), rowid DESC LIMIT %s OFFSET %s"
+    params += [limit, offset]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [uuid.UUID(row[0]) for row in cursor.fetchall()]
+
+
+def _table_search(user, terms, conversation_id, offset, limit):
+    """
+    Get the ids of matching messages from the MessageSearchTerm table,
+    with the most occurrences of the terms first.
+    - Each term is looked up through the (term, conversation) index.
+    """
+    conversations = Conversation.objects.filter(members=user)
+    if conversation_id is not None:
+        conversations = conversations.filter(id=conversation_id)
+
+    *exact, prefix = terms
+    messages = ConversationMessage.objects.all()
+    for term in exact:
+        messages = messages.filter(id__in=(
+            MessageSearchTerm.objects
+            .filter(term=term, conversation__in=conversations)
+            .values('message_id')
+        ))
+    messages = messages.filter(id__in=(
+        MessageSearchTerm.objects
+        .filter(term__startswith=prefix, conversation__in=conversations)
+        .values('message_id')
+    ))
+
+    rank = (MessageSearchTerm.objects
+            .filter(Q(term__in=exact) | Q(term__startswith=prefix),
+                    message=OuterRef('pk'))
+            .values('message')
+            .annotate(total=Sum('frequency'))
+            .values('total'))
+    return list(messages
+                .annotate(rank=Coalesce(Subquery(rank), 0))
+                .order_by('-rank', '-created_at', '-id')
+                .values_list('id', flat=True)[offset:offset + limit])
+
+
+def make_snippet(text, terms):
+    """
+    Cut the part of a message around its first match and highlight the
+    matching words with <mark>.
+    - The rest of the text is HTML escaped.
+    - Up to CHAT_SEARCH_SNIPPET_TOKENS words are kept, cuts are marked
+      with an ellipsis.
+    """
+    *exact, prefix = terms
+    exact = set(exact)
+
+    def matches(token):
+        term = normalize(token)
+        return term in exact or term.startswith(prefix)
+
+    tokens = list(TOKEN_RE.finditer(text))
+    if not tokens:
+        return escape(text)
+
+    size = settings.CHAT_SEARCH_SNIPPET_TOKENS
+    first = next((i for i, token in enumerate(tokens)
+                  if matches(token.group())), 0)
+    start = max(0, min(first - size // 4, len(tokens) - size))
+    end = min(len(tokens), start + size)
+
+    parts = ['…'] if start else []
+    position = tokens[start].start() if start else 0
+    for token in tokens[start:end]:
+        parts.append(escape(text[position:token.start()]))
+        word = escape(token.group())
+        parts.append(f'<mark>{word}</mark>' if matches(token.group())
+                     else word)
+        position = token.end()
+    if end < len(tokens):
+        parts.append('…')
+    else:
+        parts.append(escape(text[position:]))
+    return ''.join(parts)
+
+
+def decode_search_cursor(cursor):
+    """
+    Decode a search cursor into its offset.
+    - Raises ValueError if the cursor is malformed.
+    """
+    offset, = decode_cursor(cursor, 1)
+    if not offset.isdigit():
+        raise ValueError("Invalid cursor.")
+    return int(offset)
+
+
+def search_messages(user, search, conversation=None, after=None, limit=20):
+    """
+    Search the messages of the conversations of a user.
+    - Every term of the search has to match, the last one as a prefix
+      so results show up while typing.
+    - Archived messages are not searched.
+
+    Params:
+    - user: The user searching.
+    - search: The search text.
+    - conversation: Optional id of the only conversation to search.
+    - after: Cursor; return results after it.
+    - limit: Maximum number of results in the page.
+
+    Returns:
+    - page: Dict with
+        - results: ConversationMessage objects with their sender, best
+                   match first, each with a `snippet` of HTML.
+        - has_more: Whether there are more results.
+        - after: Cursor of the next page, or None.
+    """
+    terms = list(dict.fromkeys(tokenize(search)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return {'results': [], 'has_more': False, 'after': None}
+
+    offset = decode_search_cursor(after) if after is not None else 0
+    search_backend = (_fts_search if get_search_backend() == 'fts5'
+                      else _table_search)
+    ids = search_backend(user, terms, conversation, offset, limit + 1)
+
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    messages = (ConversationMessage.objects
+                .select_related('sender')
+                .in_bulk(ids))
+
+    results = [messages[message_id] for message_id in ids
+               if message_id in messages]
+    for message in results:
+        message.snippet = make_snippet(message.text, terms)
+
+    return {
+        'results': results,
+        'has_more': has_more,
+        'after': encode_cursor([offset + limit]) if has_more else None,
+    }
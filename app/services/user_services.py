@@ -1,7 +1,24 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.functions import Lower
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from app.pagination import forward_page, forward_paginate
 User = get_user_model()
 
+# Ordering of the user directory, by name. `id` breaks ties between users
+# with the same name.
+USER_DIRECTORY_ORDERING = ('first_name_key', 'last_name_key', 'id')
+# Parsers of the directory cursor values, see app.pagination.decode_cursor
+USER_DIRECTORY_CURSOR_PARSERS = (str, str, uuid.UUID)
+
+# Largest page of the user directory
+USER_DIRECTORY_MAX_LIMIT = 100
+
+USER_DIRECTORY_CACHE_KEY = 'user_directory:first_page'
+
 
 def create_user_account(first_name, last_name, email, password):
     """
@@ -20,3 +37,68 @@ def get_user(pk):
     """
     user = get_object_or_404(User, pk=pk)
     return user
+
+
+def _prefix_filter(field, prefix):
+    """
+    Match values starting with `prefix` with an indexed range.
+    """
+    condition = Q(**{f"{field}__gte": prefix})
+    if ord(prefix[-1]) < 0x10ffff:
+        condition &= Q(**{f"{field}__lt":
+                          prefix[:-1] + chr(ord(prefix[-1]) + 1)})
+    return condition
+
+
+def get_user_directory(user, search=None, after=None, limit=50):
+    """
+    Get one page of the users, excluding the given user, by name.
+
+    Params:
+    - user: The user browsing the directory.
+    - search: Case-insensitive prefix of the first name, last name or
+              email of the users to return.
+    - after: Cursor; return users after it.
+    - limit: Maximum number of users in the page.
+
+    Returns:
+    - page: See app.pagination.forward_paginate, users are dicts.
+    - The first page without search is cached for
+      CHAT_USER_DIRECTORY_CACHE_TTL seconds.
+    """
+    queryset = (User.objects
+                .annotate(first_name_key=Lower('first_name'),
+                          last_name_key=Lower('last_name'))
+                .values('id', 'first_name', 'last_name',
+                        'first_name_key', 'last_name_key'))
+
+    if search or after:
+        if search:
+            search = search.lower()
+            queryset = queryset.filter(
+                _prefix_filter('first_name_key', search)
+                | _prefix_filter('last_name_key', search)
+                | _prefix_filter('email', search)
+            )
+        return forward_paginate(queryset.exclude(id=user.id),
+                                USER_DIRECTORY_ORDERING,
+                                after=after, limit=limit)
+
+    # The cached rows include everyone, so one entry serves every user.
+    # One more row is kept to fill in for the excluded user.
+    rows = cache.get(USER_DIRECTORY_CACHE_KEY)
+    if rows is None:
+        rows = list(queryset.order_by(*USER_DIRECTORY_ORDERING)
+                    [:USER_DIRECTORY_MAX_LIMIT + 2])
+        cache.set(USER_DIRECTORY_CACHE_KEY, rows,
+                  settings.CHAT_USER_DIRECTORY_CACHE_TTL)
+
+    rows = [row for row in rows if row['id'] != user.id]
+    return forward_page(rows[:limit + 1], USER_DIRECTORY_ORDERING, limit)
+
+
+def invalidate_user_directory():
+    """
+    Drop the cached first page of the user directory.
+    """
+    cache.delete(USER_DIRECTORY_CACHE_KEY)
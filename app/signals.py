@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from app.channel_auth_middleware import invalidate_user
+from app.membership import user_conversations
+from app.models import Conversation, MessageArchive
+from app.services.archive_services import archive_path
+from app.services.chat_services import invalidate_conversation_state
+from app.services.user_services import invalidate_user_directory
+User = get_user_model()
+
+# SQLite databases of this process whose journal mode is set
+_journal_mode_set = set()
+
+
+@receiver(m2m_changed, sender=Conversation.members.through)
+def conversation_members_changed(sender, instance, action, reverse,
+                                 pk_set, **kwargs):
+    """
+    Invalidate the cached state of open sockets, and the cached
+    conversation ids of the users, when members change.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        conversation_ids = [instance.pk]
+        if action == 'pre_clear':
+            user_ids = list(instance.members.values_list('id', flat=True))
+        else:
+            user_ids = list(pk_set)
+    elif action == 'pre_clear':
+        # Membership is cleared from the user side, collect the
+        # conversations before they are gone.
+        conversation_ids = list(
+            instance.conversations.values_list('id', flat=True)
+        )
+        user_ids = [instance.pk]
+    else:
+        conversation_ids = pk_set
+        user_ids = [instance.pk]
+
+    for conversation_id in conversation_ids:
+        transaction.on_commit(
+            lambda pk=conversation_id: invalidate_conversation_state(pk)
+        )
+
+    def invalidate_users():
+        for user_id in user_ids:
+            user_conversations.invalidate(user_id)
+
+    transaction.on_commit(invalidate_users)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted(sender, instance, created, **kwargs):
+    """
+    Refuse the cached WebSocket tokens of a user who logged out.
+    """
+    if created and instance.token.user_id is not None:
+        invalidate_user(instance.token.user_id, revoke=True)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """
+    Drop the cached WebSocket user and user directory when a user
+    registers, changes or is deleted.
+    """
+    invalidate_user(instance.pk)
+    invalidate_user_directory()
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    Set CHAT_SQLITE_JOURNAL_MODE on the first connection to a SQLite
+    database, it is stored in the file, and run CHAT_SQLITE_PRAGMAS on
+    every new connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    database = connection.settings_dict['NAME']
+    if database not in _journal_mode_set:
+        connection.connection.execute(
+            f"PRAGMA journal_mode = {settings.CHAT_SQLITE_JOURNAL_MODE}"
+        )
+        _journal_mode_set.add(database)
+
+    for name, value in settings.CHAT_SQLITE_PRAGMAS.items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(request_finished)
+def close_asgi_request_connections(sender, **kwargs):
+    """
+    Close the database connections of a finished ASGI request. It ran in
+    a thread of its own, kept connections would never be reused.
+    """
+    if isinstance(sender, type) and issubclass(sender, ASGIHandler):
+        connections.close_all()
+
+
+@receiver(post_delete, sender=MessageArchive)
+def message_archive_deleted(sender, instance, **kwargs):
+    """
+    Remove the segment file of a deleted archive once it is committed.
+    """
+    transaction.on_commit(
+        lambda: archive_path(instance.path).unlink(missing_ok=True)
+    )
@@ -0,0 +1,144 @@
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from app.admission import (SLOW_CONSUMER_CLOSE_CODE, ConnectionLimiter,
+                           TokenBucket, connections)
+from app.consumers import ChatConsumer
+from app.models import Conversation
+from app.presence import presence
+
+User = get_user_model()
+
+
+class AdmissionTests(SimpleTestCase):
+    def test_token_bucket(self):
+        """
+        Test a bucket allows its burst, then refills at its rate
+        """
+        bucket = TokenBucket(rate=1, burst=2)
+
+        assert bucket.take()
+        assert bucket.take()
+        assert not bucket.take()
+
+        bucket.updated -= 1
+        assert bucket.take()
+        assert not bucket.take()
+
+    @override_settings(CHAT_MAX_CONNECTIONS_PER_USER=2,
+                       CHAT_MAX_CONNECTIONS_PER_WORKER=3)
+    def test_connection_limiter(self):
+        """
+        Test sockets are refused over the per-user and per-worker caps
+        """
+        limiter = ConnectionLimiter()
+
+        assert limiter.acquire(1) is None
+        assert limiter.acquire(1) is None
+        assert limiter.acquire(1) == 'user'
+        assert limiter.acquire(2) is None
+        assert limiter.acquire(3) == 'worker'
+
+        limiter.release(1)
+        assert limiter.acquire(3) is None
+        assert limiter.users == {'1': 1, '2': 1, '3': 1}
+
+
+class AdmissionConsumerTests(TestCase):
+    def setUp(self):
+        presence.clear()
+        connections.clear()
+
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        presence.clear()
+        connections.clear()
+
+    def connect(self, user, query_string=''):
+        communicator = WebsocketCommunicator(
+            self.application,
+            f"/ws/chat/{self.conversation.id}/{query_string}"
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    @override_settings(CHAT_USER_MESSAGE_RATE=0.001,
+                       CHAT_USER_MESSAGE_BURST=1)
+    async def test_rate_limit(self):
+        """
+        Test messages over the user's rate are refused
+        """
+        communicator = self.connect(self.first_user)
+        assert (await communicator.connect())[0]
+
+        for _ in range(2):
+            await communicator.send_json_to({
+                'message': 'Hi', 'recipient_id': str(self.second_user.id),
+            })
+
+        assert (await communicator.receive_json_from())['message'] == 'Hi'
+        assert await communicator.receive_from() == (
+            "Error: Rate limit exceeded."
+        )
+
+        await communicator.disconnect()
+
+    @override_settings(CHAT_MAX_CONNECTIONS_PER_USER=1)
+    async def test_connections_per_user(self):
+        """
+        Test a user's sockets over the cap are refused until one closes
+        """
+        first = self.connect(self.first_user)
+        assert (await first.connect())[0]
+
+        second = self.connect(self.first_user)
+        assert not (await second.connect())[0]
+
+        await first.disconnect()
+        third = self.connect(self.first_user)
+        assert (await third.connect())[0]
+        await third.disconnect()
+
+    @override_settings(CHAT_SLOW_CONSUMER_QUEUE_SIZE=0)
+    async def test_slow_consumer_closed(self):
+        """
+        Test a socket whose events pile up is closed
+        """
+        await self.assert_slow_consumer_closed()
+
+    @override_settings(CHAT_SLOW_CONSUMER_QUEUE_SIZE=0,
+                       CHAT_FANOUT_MODE='layer')
+    async def test_slow_consumer_closed_layer_mode(self):
+        """
+        Test slow consumers are closed when group events come from the
+        channel layer
+        """
+        await self.assert_slow_consumer_closed()
+
+    async def assert_slow_consumer_closed(self):
+        # Its own presence event is the first to pile up
+        communicator = self.connect(self.first_user, '?presence=1')
+        assert (await communicator.connect())[0]
+
+        assert await communicator.receive_output() == {
+            'type': 'websocket.close', 'code': SLOW_CONSUMER_CLOSE_CODE,
+        }
+        await communicator.disconnect()
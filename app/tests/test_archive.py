@@ -0,0 +1,133 @@
+import tempfile
+from io import StringIO
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.models import Conversation, ConversationMessage, MessageArchive
+from app.services.archive_services import (archive_messages, archive_path,
+                                           segment_cache)
+from app.services.chat_services import create_messages
+
+User = get_user_model()
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            CHAT_ARCHIVE_DIR=self.archive_dir.name
+        )
+        self.settings_override.enable()
+        segment_cache.clear()
+
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+        # Messages 0 (oldest) to 5 (newest), a day apart
+        self.now = timezone.now()
+        create_messages([
+            ConversationMessage(
+                conversation=self.conversation,
+                sender=[self.first_user, self.second_user][i % 2],
+                text=f"Message {i}",
+                created_at=self.now - timedelta(days=10 - i)
+            )
+            for i in range(6)
+        ])
+
+        self.url = reverse('conversation_messages',
+                           args=[self.conversation.id])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.archive_dir.cleanup()
+        segment_cache.clear()
+
+    def get_page(self, **params):
+        token = AccessToken.for_user(self.first_user)
+        response = self.client.get(self.url, params,
+                                   HTTP_AUTHORIZATION=f"Bearer {token}")
+        assert response.status_code == 200
+        return response.json()['data']
+
+    def test_archive_old_messages(self):
+        """
+        Test old messages are moved to segments, keeping the latest one
+        in the table
+        """
+        stats = archive_messages(self.now - timedelta(days=7),
+                                 segment_size=2)
+        assert stats == {'conversations': 1, 'messages': 3}
+
+        segments = list(MessageArchive.objects.order_by('first_seq'))
+        assert [(segment.first_seq, segment.last_seq)
+                for segment in segments] == [(1, 2), (3, 3)]
+        assert all(archive_path(segment.path).exists()
+                   for segment in segments)
+
+        self.conversation.refresh_from_db()
+        assert self.conversation.archive_seq == 3
+        assert list(ConversationMessage.objects.order_by('seq')
+                    .values_list('seq', flat=True)) == [4, 5, 6]
+
+        # Everything is old, the latest message stays for the inbox
+        archive_messages(self.now, segment_size=2)
+        assert ConversationMessage.objects.get().seq == 6
+
+    def test_history_spans_archive(self):
+        """
+        Test the history API scrolls from the table into the archive and
+        back with its cursors
+        """
+        call_command('archive_messages', days=7, segment_size=2,
+                     stdout=StringIO())
+
+        texts = []
+        params = {'limit': 3}
+        while True:
+            data = self.get_page(**params)
+            texts += [message['text'] for message in data['results']]
+            if not data['has_more']:
+                break
+            params['before'] = data['before']
+
+        assert texts == [f"Message {i}" for i in range(5, -1, -1)]
+
+        # Newer than archived message 0: archived 1 and 2, then 3
+        archived = self.get_page(limit=2, before=params['before'])
+        oldest = self.get_page(limit=1, before=archived['before'])
+        assert oldest['results'][0]['text'] == "Message 0"
+        data = self.get_page(limit=3, after=oldest['after'])
+        assert [message['text'] for message in data['results']] == [
+            "Message 3", "Message 2", "Message 1",
+        ]
+        assert data['has_more']
+        assert data['results'][1]['sender']['id'] == str(self.first_user.id)
+
+    def test_segment_removed_with_conversation(self):
+        """
+        Test segment files are deleted with their conversation
+        """
+        archive_messages(self.now - timedelta(days=7), segment_size=10)
+        path = archive_path(MessageArchive.objects.get().path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation.delete()
+
+        assert not Path(path).exists()
@@ -0,0 +1,324 @@
+import hashlib
+import io
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import (AsyncRequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import path, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient, force_authenticate
+
+from app.consumers import ChatConsumer
+from app.models import Attachment, Conversation, ConversationMessage
+from app.presence import presence
+from app.replay import replay_buffers
+from app.services.attachment_services import (AttachmentTooLarge,
+                                              RangeNotSatisfiable,
+                                              attachment_path, parse_range,
+                                              store_attachment)
+from app.services.archive_services import archive_messages, segment_cache
+from app.services.chat_services import create_message, create_messages
+from app.views import AttachmentListView
+
+User = get_user_model()
+
+CONTENT = b"\x89PNG not really an image"
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_parse_range(self):
+        """
+        Test single byte ranges are parsed and clamped to the file
+        """
+        assert parse_range(None, 10) is None
+        assert parse_range("bytes=2-5", 10) == (2, 5)
+        assert parse_range("bytes=2-", 10) == (2, 9)
+        assert parse_range("bytes=-3", 10) == (7, 9)
+        assert parse_range("bytes=5-100", 10) == (5, 9)
+
+        # Ignored, the whole file is sent
+        assert parse_range("bytes=0-1,4-5", 10) is None
+        assert parse_range("bytes=5-2", 10) is None
+        assert parse_range("items=0-1", 10) is None
+
+        for header in ("bytes=10-", "bytes=\u00b2-", "bytes=-"):
+            with self.assertRaises(RangeNotSatisfiable):
+                parse_range(header, 10)
+
+
+class AttachmentTests(TestCase):
+    def setUp(self):
+        self.attachment_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            CHAT_ATTACHMENT_DIR=self.attachment_dir.name,
+            CHAT_ATTACHMENT_CHUNK_SIZE=4,
+        )
+        self.settings_override.enable()
+
+        self.users = [
+            User.objects.create_user(
+                first_name=f"user{i}", last_name="doe",
+                email=f"user{i}@gmail.com", password="password321"
+            )
+            for i in range(3)
+        ]
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.users[0], self.users[1])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.attachment_dir.cleanup()
+
+    def upload(self, client, content=CONTENT, content_type='image/png'):
+        return client.post(reverse('attachments'), content,
+                           content_type=content_type)
+
+    def download(self, user, **headers):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(reverse('attachment', args=[SHA256]), **headers)
+
+    def test_upload(self):
+        """
+        Test uploads are stored once under their hash
+        """
+        response = self.upload(self.client)
+        assert response.status_code == 201
+        assert response.json()['data'] == {
+            'sha256': SHA256, 'size': len(CONTENT),
+            'content_type': 'image/png',
+        }
+
+        client = APIClient()
+        client.force_authenticate(self.users[2])
+        assert self.upload(client).status_code == 201
+
+        attachment = Attachment.objects.get()
+        assert set(attachment.uploaders.all()) == {self.users[0],
+                                                   self.users[2]}
+        assert attachment_path(SHA256).read_bytes() == CONTENT
+        files = [p for p in Path(self.attachment_dir.name).rglob('*')
+                 if p.is_file()]
+        assert files == [attachment_path(SHA256)]
+
+    def test_upload_content_type(self):
+        """
+        Test content types are stored without parameters, and only safe
+        media types are shown inline
+        """
+        for content_type, expected, disposition in (
+            ('Image/PNG', 'image/png', 'inline'),
+            ('image/svg+xml; charset=utf-8', 'image/svg+xml', 'attachment'),
+            ('text/html', 'text/html', 'attachment'),
+        ):
+            content = f"<svg>{content_type}</svg>".encode()
+            response = self.upload(self.client, content, content_type)
+            assert response.status_code == 201
+            assert response.json()['data']['content_type'] == expected
+
+            response = self.client.get(reverse(
+                'attachment', args=[hashlib.sha256(content).hexdigest()]
+            ))
+            assert response['Content-Type'] == expected
+            assert response['Content-Disposition'].startswith(disposition)
+
+        response = self.upload(self.client, content_type='not a type')
+        assert response.status_code == 400
+
+    def test_upload_chunked(self):
+        """
+        Test uploads without a Content-Length are read to the end, within
+        the size limit
+        """
+        def upload(content):
+            request = AsyncRequestFactory().post(
+                reverse('attachments'), content, content_type='image/png'
+            )
+            request.META.pop('CONTENT_LENGTH', None)
+            force_authenticate(request, self.users[0])
+            return AttachmentListView.as_view()(request)
+
+        response = upload(CONTENT)
+        assert response.status_code == 201
+        assert response.data['data']['size'] == len(CONTENT)
+        assert attachment_path(SHA256).read_bytes() == CONTENT
+
+        with override_settings(CHAT_ATTACHMENT_MAX_SIZE=8):
+            assert upload(b"x" * 9).status_code == 413
+        assert upload(b"").status_code == 400
+
+        # Content-Length must be ASCII digits
+        response = self.client.post(reverse('attachments'), CONTENT,
+                                    content_type='image/png',
+                                    CONTENT_LENGTH="\u00b2")
+        assert response.status_code == 400
+
+    def test_upload_too_large(self):
+        """
+        Test uploads over the size limit are refused, without leaving a
+        partial file
+        """
+        with override_settings(CHAT_ATTACHMENT_MAX_SIZE=8):
+            assert self.upload(self.client).status_code == 413
+
+        with self.assertRaises(AttachmentTooLarge):
+            store_attachment(io.BytesIO(CONTENT), self.users[0],
+                             'image/png', max_size=8)
+        assert not list((Path(self.attachment_dir.name) / 'partial')
+                        .iterdir())
+        assert not Attachment.objects.exists()
+
+    def test_download(self):
+        """
+        Test the uploader and the members of a conversation it was sent
+        in can download it, with byte ranges
+        """
+        self.upload(self.client)
+        assert self.download(self.users[1]).status_code == 404
+
+        create_message(self.conversation.id, self.users[0].id, "Look",
+                       attachment_id=SHA256)
+
+        response = self.download(self.users[1])
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == CONTENT
+        assert response['Content-Length'] == str(len(CONTENT))
+        assert response['Content-Disposition'].startswith('inline')
+        assert response['ETag'] == f'"{SHA256}"'
+
+        response = self.download(self.users[1], HTTP_RANGE="bytes=1-3")
+        assert response.status_code == 206
+        assert b''.join(response.streaming_content) == CONTENT[1:4]
+        assert response['Content-Range'] == f"bytes 1-3/{len(CONTENT)}"
+
+        for header in ("bytes=100-", "bytes=\u00b2-"):
+            response = self.download(self.users[1], HTTP_RANGE=header)
+            assert response.status_code == 416
+
+        response = self.download(self.users[1],
+                                 HTTP_IF_NONE_MATCH=f'"{SHA256}"')
+        assert response.status_code == 304
+
+        assert self.download(self.users[2]).status_code == 404
+
+    @override_settings(CHAT_ATTACHMENT_ACCEL_REDIRECT='/protected/')
+    def test_download_accel_redirect(self):
+        """
+        Test downloads are handed to the web server when configured
+        """
+        self.upload(self.client)
+        response = self.download(self.users[0])
+        assert response.status_code == 200
+        assert response['X-Accel-Redirect'] == (
+            f"/protected/{SHA256[:2]}/{SHA256[2:4]}/{SHA256}"
+        )
+
+    def test_history(self):
+        """
+        Test the history shows the attachment of a message, also once it
+        is archived
+        """
+        self.upload(self.client)
+        now = timezone.now()
+        create_messages([
+            ConversationMessage(conversation=self.conversation,
+                                sender=self.users[0], text="",
+                                attachment_id=SHA256,
+                                created_at=now - timedelta(days=2)),
+            ConversationMessage(conversation=self.conversation,
+                                sender=self.users[1], text="Nice",
+                                created_at=now),
+        ])
+
+        with tempfile.TemporaryDirectory() as archive_dir, \
+                override_settings(CHAT_ARCHIVE_DIR=archive_dir):
+            segment_cache.clear()
+            stats = archive_messages(now - timedelta(days=1), 10)
+            assert stats['messages'] == 1
+
+            response = self.client.get(reverse('conversation_messages',
+                                               args=[self.conversation.id]))
+            segment_cache.clear()
+
+        newest, oldest = response.json()['data']['results']
+        assert newest['attachment'] is None
+        assert oldest['attachment'] == {
+            'sha256': SHA256, 'size': len(CONTENT),
+            'content_type': 'image/png',
+        }
+
+
+class AttachmentConsumerTests(TestCase):
+    def setUp(self):
+        presence.clear()
+        replay_buffers.clear()
+
+        self.users = [
+            User.objects.create_user(
+                first_name=f"user{i}", last_name="doe",
+                email=f"user{i}@gmail.com", password="password321"
+            )
+            for i in range(2)
+        ]
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(*self.users)
+
+        # Stored without a file, the consumer only reads the metadata
+        self.attachment = Attachment.objects.create(
+            sha256=SHA256, size=len(CONTENT), content_type='image/png'
+        )
+        self.attachment.uploaders.add(self.users[0])
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        presence.clear()
+        replay_buffers.clear()
+
+    async def connect(self, user, query_string=''):
+        communicator = WebsocketCommunicator(
+            self.application,
+            f"/ws/chat/{self.conversation.id}/{query_string}"
+        )
+        communicator.scope['user'] = user
+        assert (await communicator.connect())[0]
+        return communicator
+
+    async def test_send_attachment(self):
+        """
+        Test frames carry the attachment metadata, live and replayed
+        """
+        sender = await self.connect(self.users[0])
+
+        await sender.send_json_to({"attachment": SHA256})
+        payload = await sender.receive_json_from()
+        assert payload['message'] == ""
+        assert payload['attachment'] == {
+            'sha256': SHA256, 'size': len(CONTENT),
+            'content_type': 'image/png',
+        }
+
+        # The recipient can't send it before it was shared with them
+        recipient = await self.connect(self.users[1])
+        await recipient.send_json_to({"attachment": "0" * 64})
+        assert await recipient.receive_from() == "Error: Unknown attachment."
+        await recipient.disconnect()
+
+        replay_buffers.clear()
+        recipient = await self.connect(self.users[1], '?last_seq=0')
+        replayed = await recipient.receive_json_from()
+        assert replayed['attachment'] == payload['attachment']
+
+        await sender.disconnect()
+        await recipient.disconnect()
@@ -0,0 +1,103 @@
+import time
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from app import channel_auth_middleware
+from app.channel_auth_middleware import JWTAuthMiddleware
+
+User = get_user_model()
+
+
+class JWTAuthMiddlewareTests(TestCase):
+    def setUp(self):
+        channel_auth_middleware.token_cache.clear()
+        channel_auth_middleware.user_cache.clear()
+        channel_auth_middleware.revoked_users.clear()
+
+        self.user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.refresh = RefreshToken.for_user(self.user)
+
+        # Issued a little while ago, so a logout now is after it
+        access = self.refresh.access_token
+        access['iat'] = int(time.time()) - 10
+        self.token = str(access)
+
+    async def handshake(self, token):
+        """
+        Run the middleware and return the user it put in the scope.
+        """
+        users = []
+
+        async def app(scope, receive, send):
+            users.append(scope['user'])
+
+        await JWTAuthMiddleware(app)({
+            'type': 'websocket',
+            'query_string': f"token={token}".encode('utf8'),
+        }, None, None)
+        return users[0]
+
+    async def test_user_is_cached(self):
+        """
+        Test reconnecting with the same token doesn't load the user again
+        """
+        with mock.patch.object(JWTAuthMiddleware, 'get_user',
+                               side_effect=JWTAuthMiddleware.get_user,
+                               autospec=True) as get_user:
+            first = await self.handshake(self.token)
+            second = await self.handshake(self.token)
+
+        assert first == second == self.user
+        assert get_user.call_count == 1
+
+    async def test_invalid_token(self):
+        """
+        Test an invalid token gives an anonymous user
+        """
+        user = await self.handshake("not-a-token")
+        assert not user.is_authenticated
+
+    async def test_logout_revokes_cached_token(self):
+        """
+        Test a token issued before logout is refused afterwards
+        """
+        user = await self.handshake(self.token)
+        assert user.is_authenticated
+
+        await database_sync_to_async(self.refresh.blacklist)()
+
+        user = await self.handshake(self.token)
+        assert not user.is_authenticated
+
+    async def test_logout_in_same_second(self):
+        """
+        Test a token issued earlier in the second of the logout is refused
+        """
+        access = self.refresh.access_token
+        access['iat'] = int(time.time())
+        token = str(access)
+
+        channel_auth_middleware.invalidate_user(self.user.id, revoke=True)
+
+        user = await self.handshake(token)
+        assert not user.is_authenticated
+
+    @override_settings(CHAT_JWT_STATELESS_USER=True)
+    async def test_stateless_user(self):
+        """
+        Test the user is built from the token claims without the database
+        """
+        with mock.patch.object(JWTAuthMiddleware, 'get_user') as get_user:
+            user = await self.handshake(self.token)
+
+        assert isinstance(user, TokenUser)
+        assert user.id == str(self.user.id)
+        get_user.assert_not_called()
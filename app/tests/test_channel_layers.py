@@ -0,0 +1,168 @@
+import asyncio
+
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import path
+
+from app.channel_layers import ShardedChannelLayer
+from app.channel_layers.fake_server import FakeRespServer
+from app.channel_layers.hashring import HashRing
+from app.consumers import ChatConsumer
+from app.models import Conversation
+
+User = get_user_model()
+
+
+class HashRingTests(SimpleTestCase):
+    def test_keys_move_only_to_new_node(self):
+        """
+        Test adding a node only moves keys onto the new node
+        """
+        keys = [f"chat_{i}" for i in range(1000)]
+        ring = HashRing(['a', 'b', 'c'])
+        bigger_ring = HashRing(['a', 'b', 'c', 'd'])
+
+        moved = [key for key in keys
+                 if ring.get_node(key) != bigger_ring.get_node(key)]
+
+        assert all(bigger_ring.get_node(key) == 'd' for key in moved)
+        assert 100 < len(moved) < 400
+
+
+class ShardedChannelLayerTests(SimpleTestCase):
+    async def start_servers(self):
+        self.servers = [await FakeRespServer().start() for _ in range(2)]
+        self.layer = ShardedChannelLayer(
+            hosts=[server.url for server in self.servers],
+            capacity=2,
+        )
+
+    async def stop_servers(self):
+        await self.layer.close()
+        for server in self.servers:
+            await server.stop()
+
+    async def run_with_servers(self, test):
+        await self.start_servers()
+        try:
+            await asyncio.wait_for(test(), timeout=5)
+        finally:
+            await self.stop_servers()
+
+    async def test_send_receive(self):
+        """
+        Test sending to process-specific and normal channels
+        """
+        async def test():
+            channel = await self.layer.new_channel()
+            await self.layer.send(channel, {'type': 'test.message', 'n': 1})
+            await self.layer.send('worker', {'type': 'test.message', 'n': 2})
+
+            assert (await self.layer.receive(channel))['n'] == 1
+            assert (await self.layer.receive('worker'))['n'] == 2
+
+        await self.run_with_servers(test)
+
+    async def test_group_send_across_shards(self):
+        """
+        Test group members are reached whichever shard owns the group
+        """
+        async def test():
+            channels = [await self.layer.new_channel() for _ in range(2)]
+            groups = [f"chat_{i}" for i in range(10)]
+
+            # Groups are spread over both servers
+            assert {self.layer.ring.get_index(group)
+                    for group in groups} == {0, 1}
+
+            for group in groups:
+                for channel in channels:
+                    await self.layer.group_add(group, channel)
+                await self.layer.group_send(group, {'type': 'test.message',
+                                                    'group': group})
+                for channel in channels:
+                    message = await self.layer.receive(channel)
+                    assert message['group'] == group
+
+            await self.layer.group_discard(groups[0], channels[0])
+            await self.layer.group_send(groups[0], {'type': 'test.message'})
+            await self.layer.receive(channels[1])
+            assert not self.layer._state().receive_buffers[
+                channels[0]
+            ].qsize()
+
+        await self.run_with_servers(test)
+
+    async def test_capacity(self):
+        """
+        Test sending to a full channel raises ChannelFull
+        """
+        async def test():
+            for _ in range(2):
+                await self.layer.send('worker', {'type': 'test.message'})
+
+            with self.assertRaises(ChannelFull):
+                await self.layer.send('worker', {'type': 'test.message'})
+
+        await self.run_with_servers(test)
+
+
+class ShardedChannelLayerConsumerTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+    async def test_message_reaches_other_member(self):
+        """
+        Test User 2 receives User 1 message through the sharded layer
+        """
+        servers = [await FakeRespServer().start() for _ in range(2)]
+        layers = {
+            'default': {
+                'BACKEND': 'app.channel_layers.ShardedChannelLayer',
+                'CONFIG': {'hosts': [server.url for server in servers]},
+            }
+        }
+
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        with self.settings(CHANNEL_LAYERS=layers):
+            communicators = []
+            for user in (self.first_user, self.second_user):
+                communicator = WebsocketCommunicator(
+                    application, f"/ws/chat/{self.conversation.id}/"
+                )
+                communicator.scope['user'] = user
+                connected, _ = await communicator.connect()
+                assert connected
+                communicators.append(communicator)
+
+            await communicators[0].send_json_to({
+                "message": "Hi Test 1",
+                "recipient_id": str(self.second_user.id)
+            })
+
+            response = await communicators[1].receive_json_from()
+            assert response['message'] == "Hi Test 1"
+
+            for communicator in communicators:
+                await communicator.disconnect()
+            await get_channel_layer().close()
+
+        for server in servers:
+            await server.stop()
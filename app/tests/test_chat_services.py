@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from app.models import Conversation, ConversationReadState
+from app.services.chat_services import (acreate_message,
+                                        aget_conversation_member_ids,
+                                        aget_or_create_conversation,
+                                        aupdate_read_state,
+                                        get_or_create_conversation)
+
+User = get_user_model()
+
+
+class GetOrCreateConversationTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+    def test_same_conversation_for_both_users(self):
+        """
+        Test both users get the same conversation whoever starts it
+        """
+        conversation = get_or_create_conversation(self.first_user,
+                                                  self.second_user)
+        other = get_or_create_conversation(self.second_user,
+                                           self.first_user)
+
+        assert conversation == other
+        assert Conversation.objects.count() == 1
+        assert set(conversation.members.all()) == {self.first_user,
+                                                   self.second_user}
+
+    def test_existing_conversation_single_lookup(self):
+        """
+        Test an existing conversation is found with a single query
+        """
+        get_or_create_conversation(self.first_user, self.second_user)
+
+        with self.assertNumQueries(1):
+            get_or_create_conversation(self.first_user, self.second_user)
+
+    async def test_async_variants(self):
+        """
+        Test the async ORM variants find or create the conversation, save
+        messages and move read cursors like the sync ones
+        """
+        conversation = await aget_or_create_conversation(self.first_user,
+                                                         self.second_user)
+        other = await aget_or_create_conversation(self.second_user,
+                                                  self.first_user)
+        assert conversation == other
+
+        assert await aget_conversation_member_ids(conversation.id) == {
+            str(self.first_user.id), str(self.second_user.id)
+        }
+
+        for text in ("Hi", "There?"):
+            message = await acreate_message(conversation.id,
+                                            self.first_user.id, text)
+        assert message.seq == 2
+
+        assert await aupdate_read_state(conversation.id, self.second_user.id,
+                                        read_seq=5)
+        read_state = await ConversationReadState.objects.aget(
+            conversation=conversation, user=self.second_user
+        )
+        assert read_state.last_read_seq == 2
@@ -1,11 +1,14 @@
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from channels.routing import URLRouter
 from channels.testing import WebsocketCommunicator
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import path, reverse
 
 from app.consumers import ChatConsumer
 from app.models import Conversation
+from app.services.chat_services import conversation_group_name
 
 User = get_user_model()
 
@@ -162,3 +165,116 @@ class ChatConsumerTests(TestCase):
         assert response['message'] == "Hi Test 1"
 
         await communicator.disconnect()
+
+    @override_settings(CHAT_ASYNC_ORM=True)
+    async def test_send_message_with_async_orm(self):
+        """
+        Test User 1 sending message to User 2 through the async ORM path
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/"
+        )
+        communicator.scope['user'] = self.first_user
+        connected, _ = await communicator.connect()
+
+        assert connected
+
+        await communicator.send_json_to({
+            "message": "Hi Test 1",
+            "recipient_id": str(self.second_user.id)
+        })
+
+        response = await communicator.receive_json_from()
+
+        assert response['message'] == "Hi Test 1"
+        assert response['seq'] == 1
+
+        await communicator.disconnect()
+
+    async def test_send_message_to_non_member(self):
+        """
+        Test User 1 trying to message User 3 through his conversation
+        with User 2
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/"
+        )
+        communicator.scope['user'] = self.first_user
+        connected, _ = await communicator.connect()
+
+        assert connected
+
+        await communicator.send_json_to({
+            "message": "Hi Test 1",
+            "recipient_id": str(self.third_user.id)
+        })
+
+        response = await communicator.receive_from()
+        assert response.startswith("Error:")
+
+        await communicator.disconnect()
+
+    async def test_malformed_frames(self):
+        """
+        Test frames that can't be decoded get an error, the socket stays
+        open
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/"
+        )
+        communicator.scope['user'] = self.first_user
+        connected, _ = await communicator.connect()
+        assert connected
+
+        for frame in ({'text_data': "{not json"}, {'text_data': "[1, 2]"},
+                      {'bytes_data': b"\xc1"}):
+            await communicator.send_to(**frame)
+            assert await communicator.receive_from() == (
+                "Error: Invalid frame."
+            )
+
+        await communicator.send_json_to({"message": "Still here"})
+        response = await communicator.receive_json_from()
+        assert response['message'] == "Still here"
+
+        await communicator.disconnect()
+
+    async def test_membership_change_closes_removed_member(self):
+        """
+        Test User 1 socket is closed after being removed from the
+        conversation while connected
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/"
+        )
+        communicator.scope['user'] = self.first_user
+        connected, _ = await communicator.connect()
+
+        assert connected
+
+        await database_sync_to_async(self.conversation.members.remove)(
+            self.first_user
+        )
+        await get_channel_layer().group_send(
+            conversation_group_name(self.conversation.id),
+            {'type': 'conversation.invalidate'}
+        )
+
+        response = await communicator.receive_output()
+        assert response['type'] == 'websocket.close'
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.signals import request_finished
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from app.signals import configure_sqlite_connection
+from project.database import database_config, parse_database_url
+
+
+class DatabaseConfigTests(SimpleTestCase):
+    def test_parse_database_url(self):
+        """
+        Test SQLite and server database URLs become DATABASES entries
+        """
+        assert parse_database_url('sqlite:////srv/chat/db.sqlite3') == {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': '/srv/chat/db.sqlite3',
+            'OPTIONS': {},
+        }
+        assert parse_database_url(
+            'postgres://chat:p%40ss@db:5432/chat?sslmode=require'
+        ) == {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': 'chat',
+            'USER': 'chat',
+            'PASSWORD': 'p@ss',
+            'HOST': 'db',
+            'PORT': '5432',
+            'OPTIONS': {'sslmode': 'require'},
+        }
+
+        with self.assertRaises(ImproperlyConfigured):
+            parse_database_url('oracle://db/chat')
+
+    def test_database_config(self):
+        """
+        Test connection lifetime, health checks, server-side cursors and
+        the SQLite busy timeout come from the environment
+        """
+        config = database_config({
+            'DATABASE_CONN_MAX_AGE': '120',
+            'DATABASE_CONN_HEALTH_CHECKS': 'false',
+            'DATABASE_SQLITE_BUSY_TIMEOUT_MS': '2500',
+        }, 'sqlite:///db.sqlite3')
+
+        assert config['NAME'] == 'db.sqlite3'
+        assert config['CONN_MAX_AGE'] == 120
+        assert not config['CONN_HEALTH_CHECKS']
+        assert config['OPTIONS'] == {'timeout': 2.5}
+
+        config = database_config({
+            'DATABASE_URL': 'postgres://pgbouncer:6432/chat',
+            'DATABASE_DISABLE_SERVER_SIDE_CURSORS': 'true',
+        }, 'sqlite:///db.sqlite3')
+        assert config['CONN_MAX_AGE'] == 60
+        assert config['CONN_HEALTH_CHECKS']
+        assert config['DISABLE_SERVER_SIDE_CURSORS']
+        assert 'timeout' not in config['OPTIONS']
+
+
+class SQLitePragmaTests(TestCase):
+    def test_pragmas_on_connect(self):
+        """
+        Test new SQLite connections run CHAT_SQLITE_PRAGMAS
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            # 1 is NORMAL
+            assert cursor.fetchone()[0] == 1
+
+    def test_journal_mode_once(self):
+        """
+        Test the journal mode is set on the first connection to a
+        database only, the other PRAGMAs on every connection
+        """
+        def connect():
+            sqlite = mock.Mock()
+            configure_sqlite_connection(None, SimpleNamespace(
+                vendor='sqlite', settings_dict={'NAME': 'journal.sqlite3'},
+                connection=sqlite,
+            ))
+            return [call.args[0] for call in sqlite.execute.call_args_list]
+
+        with mock.patch('app.signals._journal_mode_set', set()):
+            assert connect() == [
+                'PRAGMA journal_mode = wal',
+                'PRAGMA synchronous = normal',
+                'PRAGMA mmap_size = 268435456',
+            ]
+            assert connect() == [
+                'PRAGMA synchronous = normal',
+                'PRAGMA mmap_size = 268435456',
+            ]
+
+
+class RequestConnectionTests(SimpleTestCase):
+    def test_close_after_asgi_request(self):
+        """
+        Test connections are closed after ASGI requests and kept after
+        WSGI ones
+        """
+        with mock.patch('app.signals.connections') as connections:
+            request_finished.send(sender=WSGIHandler)
+            request_finished.send(sender=None)
+            connections.close_all.assert_not_called()
+            request_finished.send(sender=ASGIHandler)
+            connections.close_all.assert_called_once_with()
@@ -0,0 +1,123 @@
+from io import StringIO
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from app.admission import connections
+from app.consumers import ChatConsumer
+from app.draining import DRAIN_CLOSE_CODE, DRAIN_SIGNAL, drainer
+from app.models import Conversation, ConversationMessage
+from app.presence import presence
+from app.services.message_writer import get_message_writer
+
+User = get_user_model()
+
+
+@override_settings(CHAT_DRAIN_CLOSE_RATE=1000,
+                   CHAT_DRAIN_RECONNECT_JITTER_MS=500)
+class DrainingTests(TestCase):
+    def setUp(self):
+        presence.clear()
+        connections.clear()
+        drainer.reset()
+
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        presence.clear()
+        connections.clear()
+        drainer.reset()
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            self.application, f"/ws/chat/{self.conversation.id}/"
+        )
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_drain(self):
+        """
+        Test open sockets are asked to reconnect then closed, and new
+        sockets are refused
+        """
+        sockets = []
+        for user in (self.first_user, self.second_user):
+            communicator, connected = await self.connect(user)
+            assert connected
+            sockets.append(communicator)
+
+        await drainer.drain()
+
+        for communicator in sockets:
+            frame = await communicator.receive_json_from()
+            assert frame['type'] == 'reconnect'
+            assert 0 <= frame['delay_ms'] <= 500
+            assert await communicator.receive_output() == {
+                'type': 'websocket.close', 'code': DRAIN_CLOSE_CODE,
+            }
+            await communicator.disconnect()
+        assert not drainer.consumers
+
+        communicator, connected = await self.connect(self.first_user)
+        assert not connected
+
+    @override_settings(CHAT_MESSAGE_PERSISTENCE='batched',
+                       CHAT_MESSAGE_BATCH_INTERVAL_MS=60000)
+    async def test_drain_saves_messages(self):
+        """
+        Test queued messages are saved before sockets are closed
+        """
+        communicator, _ = await self.connect(self.first_user)
+        await communicator.send_json_to({"message": "Last one"})
+        # Only sent once saved
+        assert await communicator.receive_nothing()
+
+        await drainer.drain()
+
+        # Sent to the members once saved by the drain
+        frame = await communicator.receive_json_from()
+        assert frame['type'] == 'reconnect'
+        frame = await communicator.receive_json_from()
+        assert (frame['message'], frame['seq']) == ("Last one", 1)
+
+        texts = await database_sync_to_async(list)(
+            ConversationMessage.objects.values_list('text', flat=True)
+        )
+        assert texts == ["Last one"]
+
+        await communicator.disconnect()
+        await get_message_writer().close()
+
+
+class DrainCommandTests(SimpleTestCase):
+    def test_signals_process(self):
+        """
+        Test the command sends the drain signal to the server process
+        """
+        out = StringIO()
+        with mock.patch('os.kill') as kill:
+            call_command('drain_connections', pid=1234, stdout=out)
+
+        kill.assert_called_once_with(1234, DRAIN_SIGNAL)
+        assert "Draining process 1234." in out.getvalue()
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from unittest import mock
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import path
+
+from app.consumers import ChatConsumer
+from app.fanout import GroupRegistry
+from app.models import Conversation
+
+User = get_user_model()
+
+
+class LocalFanoutTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+    async def connect_members(self):
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicators = []
+        for user in (self.first_user, self.second_user):
+            communicator = WebsocketCommunicator(
+                application, f"/ws/chat/{self.conversation.id}/"
+            )
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            assert connected
+            communicators.append(communicator)
+        return communicators
+
+    async def send_and_receive(self, communicators):
+        await communicators[0].send_json_to({
+            "message": "Hi Test 1",
+            "recipient_id": str(self.second_user.id)
+        })
+
+        for communicator in communicators:
+            response = await communicator.receive_json_from()
+            assert response['message'] == "Hi Test 1"
+
+        # Relayed copies of our own events are not delivered twice
+        for communicator in communicators:
+            assert await communicator.receive_nothing()
+
+        for communicator in communicators:
+            await communicator.disconnect()
+
+    @override_settings(CHAT_FANOUT_MODE='hybrid')
+    async def test_hybrid_single_layer_send(self):
+        """
+        Test same-process members are reached with a single relay to the
+        channel layer
+        """
+        layer = get_channel_layer()
+        with mock.patch.object(layer, 'group_send',
+                               wraps=layer.group_send) as group_send:
+            communicators = await self.connect_members()
+            await self.send_and_receive(communicators)
+
+        relays = [call.args[1] for call in group_send.await_args_list]
+        assert all(relay['type'] == 'fanout.relay' for relay in relays)
+        assert [relay['event']['type'] for relay in relays].count(
+            'chat_message'
+        ) == 1
+
+    @override_settings(CHAT_FANOUT_MODE='layer')
+    async def test_layer_mode(self):
+        """
+        Test members are reached through the channel layer group
+        """
+        communicators = await self.connect_members()
+        await self.send_and_receive(communicators)
+
+
+class LocalConsumer:
+    def __init__(self):
+        self.events = []
+
+    def deliver_local(self, event):
+        self.events.append(event)
+
+
+class RelayExpiryTests(TestCase):
+    async def send_after(self, layer, seconds):
+        """
+        Send an event to the group from outside the registry, `seconds`
+        after now, and return whether the relay got it.
+        """
+        now = time.time() + seconds
+        with mock.patch('channels.layers.time.time', return_value=now):
+            await layer.group_send('chat', {'type': 'chat_message'})
+        await asyncio.sleep(0.05)
+        return bool(self.consumer.events)
+
+    async def test_rejoin_renews_relay(self):
+        """
+        Test a local join re-adds the relay channel the layer expired
+        """
+        layer = InMemoryChannelLayer(group_expiry=60)
+        registry = GroupRegistry(layer, 'hybrid')
+        self.consumer = LocalConsumer()
+        await registry.group_add('chat', self.consumer)
+        assert not await self.send_after(layer, 61)
+
+        with mock.patch('channels.layers.time.time',
+                        return_value=time.time() + 61):
+            await registry.group_add('chat', LocalConsumer())
+        assert await self.send_after(layer, 62)
+
+        await registry.group_discard('chat', self.consumer)
+
+    async def test_refresh_renews_relay(self):
+        """
+        Test the relay channels are re-added every refresh interval
+        """
+        layer = InMemoryChannelLayer(group_expiry=60)
+        registry = GroupRegistry(layer, 'hybrid', refresh_interval=0.01)
+        self.consumer = LocalConsumer()
+        with mock.patch('channels.layers.time.time',
+                        return_value=time.time() - 61):
+            await registry.group_add('chat', self.consumer)
+        # Added 61 seconds ago, renewed by the refresh task since
+        await asyncio.sleep(0.05)
+        assert await self.send_after(layer, 0)
+
+        await registry.group_discard('chat', self.consumer)
+        await asyncio.sleep(0.05)
+        assert registry._refresh_task.done()
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from app.consumers import ChatConsumer
+from app.models import Conversation
+from app.protocol.framing import FrameCoalescer
+
+User = get_user_model()
+
+
+class FrameCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.frames = []
+
+    async def send(self, text):
+        self.frames.append(json.loads(text))
+
+    async def test_burst_is_coalesced(self):
+        """
+        Test the first frame goes out right away and the rest of the burst
+        is sent in order in one frame
+        """
+        coalescer = FrameCoalescer(self.send, window=0.01, max_messages=10)
+
+        for i in range(4):
+            await coalescer.push(json.dumps(i))
+        assert self.frames == [[0]]
+
+        await asyncio.sleep(0.05)
+        assert self.frames == [[0], [1, 2, 3]]
+
+        # Idle again, the next frame is not delayed
+        await asyncio.sleep(0.05)
+        await coalescer.push(json.dumps(4))
+        assert self.frames == [[0], [1, 2, 3], [4]]
+
+        coalescer.close()
+
+    async def test_max_messages_flushes(self):
+        """
+        Test a full buffer is flushed before the window ends
+        """
+        coalescer = FrameCoalescer(self.send, window=60, max_messages=2)
+
+        for i in range(3):
+            await coalescer.push(json.dumps(i))
+
+        assert self.frames == [[0], [1, 2]]
+        coalescer.close()
+
+
+class BatchedConsumerTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+    @override_settings(CHAT_BATCH_WINDOW_MS=200)
+    async def test_batch_subprotocol(self):
+        """
+        Test a client offering the batch subprotocol gets array frames
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/",
+            subprotocols=['chat.batch.v1']
+        )
+        communicator.scope['user'] = self.first_user
+        connected, subprotocol = await communicator.connect()
+
+        assert connected
+        assert subprotocol == 'chat.batch.v1'
+
+        for i in range(3):
+            await communicator.send_json_to({
+                "message": f"Hi {i}",
+                "recipient_id": str(self.second_user.id)
+            })
+
+        first = await communicator.receive_json_from()
+        second = await communicator.receive_json_from()
+
+        assert [event['message'] for event in first + second] == [
+            "Hi 0", "Hi 1", "Hi 2"
+        ]
+        assert len(second) == 2
+
+        await communicator.disconnect()
@@ -0,0 +1,331 @@
+import asyncio
+import uuid
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path, reverse
+from rest_framework.test import APIClient
+
+from app.consumers import ChatConsumer, get_conversation_ids_async
+from app.membership import (ConversationMembers, UserConversations,
+                            conversation_members, user_conversations)
+from app.models import Conversation, ConversationReadState
+from app.presence import presence
+from app.services.chat_services import (conversation_group_name,
+                                        create_message,
+                                        get_or_create_conversation)
+
+User = get_user_model()
+
+
+class ConversationMembersTests(SimpleTestCase):
+    async def test_shared_load(self):
+        """
+        Test concurrent sockets share one load, and each invalidation
+        version is handled once
+        """
+        members = ConversationMembers(ttl=60)
+        loads = []
+
+        async def load(conversation_id):
+            loads.append(conversation_id)
+            await asyncio.sleep(0)
+            return frozenset({'a', 'b'})
+
+        members.watch('c1')
+        results = await asyncio.gather(*[members.get('c1', load)
+                                         for _ in range(5)])
+        assert loads == ['c1']
+        assert all(result is results[0] for result in results)
+
+        assert members.invalidate('c1', 'v1')
+        assert not members.invalidate('c1', 'v1')
+        await members.get('c1', load)
+        assert len(loads) == 2
+
+        # Not kept once the last socket is gone
+        members.unwatch('c1')
+        await members.get('c1', load)
+        await members.get('c1', load)
+        assert len(loads) == 4
+
+
+class UserConversationsTests(SimpleTestCase):
+    async def test_refresh_missing(self):
+        """
+        Test a missing conversation is only looked up again after the
+        refresh interval
+        """
+        loads = []
+
+        async def load(user_id):
+            loads.append(user_id)
+            return frozenset({'c1'})
+
+        cache = UserConversations(maxsize=10, ttl=60, refresh_interval=60)
+        assert await cache.contains('u1', 'c1', load)
+        assert not await cache.contains('u1', 'c2', load)
+        assert loads == ['u1']
+
+        cache.invalidate('u1')
+        assert await cache.contains('u1', 'c1', load)
+        assert len(loads) == 2
+
+        cache = UserConversations(maxsize=10, ttl=60, refresh_interval=0)
+        assert not await cache.contains('u1', 'c2', load)
+        assert len(loads) == 4
+
+
+class GroupConversationAPITests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                first_name=f"user{i}", last_name="doe",
+                email=f"user{i}@gmail.com", password="password321"
+            )
+            for i in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def create_group(self, *members):
+        response = self.client.post(reverse('conversations'), {
+            'name': "Team",
+            'members': [str(user.id) for user in members],
+        }, format='json')
+        assert response.status_code == 201
+        return Conversation.objects.get(id=response.json()['data']['id'])
+
+    def test_create_group(self):
+        """
+        Test groups are created with their creator as a member
+        """
+        group = self.create_group(self.users[1], self.users[2])
+        assert group.is_group
+        assert group.created_by == self.users[0]
+        assert set(group.members.all()) == set(self.users[:3])
+
+        response = self.client.post(reverse('conversations'), {
+            'name': "Team",
+            'members': ["4f6b3ab0-5b0f-4b5e-9d3c-3f0e7a6c1d11"],
+        }, format='json')
+        assert response.status_code == 400
+
+        # The creator counts as a member
+        with override_settings(CHAT_GROUP_MAX_MEMBERS=2):
+            response = self.client.post(reverse('conversations'), {
+                'name': "Too many",
+                'members': [str(self.users[1].id), str(self.users[2].id)],
+            }, format='json')
+        assert response.status_code == 400
+        assert response.json()['msg'] == "Groups have at most 2 members."
+        assert not Conversation.objects.filter(name="Too many").exists()
+
+    def test_add_members(self):
+        """
+        Test added members skip the earlier messages in their unread count
+        """
+        group = self.create_group(self.users[1])
+        create_message(group.id, self.users[1].id, "Before you joined")
+
+        response = self.client.post(
+            reverse('conversation_members', args=[group.id]),
+            {'members': [str(self.users[1].id), str(self.users[3].id)]},
+            format='json'
+        )
+        assert response.status_code == 200
+        assert response.json()['data']['added'] == [str(self.users[3].id)]
+        assert ConversationReadState.objects.get(
+            conversation=group, user=self.users[3]
+        ).last_read_seq == 1
+
+        with override_settings(CHAT_GROUP_MAX_MEMBERS=3):
+            response = self.client.post(
+                reverse('conversation_members', args=[group.id]),
+                {'members': [str(self.users[2].id)]}, format='json'
+            )
+        assert response.status_code == 400
+
+        # Direct conversations keep their two members
+        direct = get_or_create_conversation(self.users[0], self.users[1])
+        response = self.client.post(
+            reverse('conversation_members', args=[direct.id]),
+            {'members': [str(self.users[2].id)]}, format='json'
+        )
+        assert response.status_code == 400
+
+    def test_remove_members(self):
+        """
+        Test members can leave and only the creator removes others
+        """
+        group = self.create_group(self.users[1], self.users[2])
+
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+        response = client.delete(reverse('conversation_member',
+                                         args=[group.id, self.users[2].id]))
+        assert response.status_code == 403
+
+        response = client.delete(reverse('conversation_member',
+                                         args=[group.id, self.users[1].id]))
+        assert response.status_code == 200
+
+        response = self.client.delete(reverse(
+            'conversation_member', args=[group.id, self.users[2].id]
+        ))
+        assert response.status_code == 200
+        assert list(group.members.all()) == [self.users[0]]
+
+        # Former members can't see the group any more
+        response = client.delete(reverse('conversation_member',
+                                         args=[group.id, self.users[1].id]))
+        assert response.status_code == 404
+
+
+class GroupConsumerTests(TestCase):
+    def setUp(self):
+        presence.clear()
+        conversation_members.clear()
+
+        self.users = [
+            User.objects.create_user(
+                first_name=f"user{i}", last_name="doe",
+                email=f"user{i}@gmail.com", password="password321"
+            )
+            for i in range(3)
+        ]
+        self.group = Conversation.objects.create(name="Team",
+                                                 created_by=self.users[0])
+        self.group.members.add(*self.users)
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        presence.clear()
+        conversation_members.clear()
+
+    async def connect_all(self):
+        sockets = []
+        for user in self.users:
+            communicator = WebsocketCommunicator(
+                self.application, f"/ws/chat/{self.group.id}/"
+            )
+            communicator.scope['user'] = user
+            assert (await communicator.connect())[0]
+            sockets.append(communicator)
+        return sockets
+
+    async def test_group_message(self):
+        """
+        Test a message without recipient reaches every member
+        """
+        sockets = await self.connect_all()
+
+        await sockets[0].send_json_to({"message": "Hi all"})
+        for communicator in sockets:
+            assert await communicator.receive_json_from() == {
+                "message": "Hi all",
+                "sender_id": str(self.users[0].id),
+                "recipient_id": None,
+                "seq": 1,
+            }
+
+        for communicator in sockets:
+            await communicator.disconnect()
+
+    async def test_removed_member_closed(self):
+        """
+        Test the removed member's socket is closed, the others stay
+        """
+        sockets = await self.connect_all()
+
+        await database_sync_to_async(self.group.members.remove)(
+            self.users[2]
+        )
+        await get_channel_layer().group_send(
+            conversation_group_name(self.group.id),
+            {'type': 'conversation.invalidate', 'version': 'v1'}
+        )
+
+        response = await sockets[2].receive_output()
+        assert response['type'] == 'websocket.close'
+
+        await sockets[0].send_json_to({"message": "Still here"})
+        assert (await sockets[1].receive_json_from())['seq'] == 1
+
+        for communicator in sockets[:2]:
+            await communicator.disconnect()
+
+
+class MembershipAuthorizationTests(TestCase):
+    def setUp(self):
+        user_conversations.clear()
+        conversation_members.clear()
+
+        self.users = [
+            User.objects.create_user(
+                first_name=f"user{i}", last_name="doe",
+                email=f"user{i}@gmail.com", password="password321"
+            )
+            for i in range(2)
+        ]
+        self.conversation = get_or_create_conversation(*self.users)
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        user_conversations.clear()
+        conversation_members.clear()
+
+    async def connect(self, conversation_id):
+        communicator = WebsocketCommunicator(
+            self.application, f"/ws/chat/{conversation_id}/"
+        )
+        communicator.scope['user'] = self.users[0]
+        connected, _ = await communicator.connect()
+        if connected:
+            await communicator.disconnect()
+        return connected
+
+    async def test_reconnect_without_query(self):
+        """
+        Test reconnects and unknown conversations are authorized from
+        the cached conversation ids
+        """
+        with mock.patch('app.consumers.get_conversation_ids_async',
+                        side_effect=get_conversation_ids_async) as load:
+            assert await self.connect(self.conversation.id)
+            assert await self.connect(self.conversation.id)
+            assert not await self.connect(uuid.uuid4())
+            assert not await self.connect('not-a-uuid')
+
+        assert load.call_count == 1
+
+    def test_invalidated_on_change(self):
+        """
+        Test membership changes drop the cached conversation ids
+        """
+        async def load(user_id):
+            return frozenset()
+
+        contains = async_to_sync(user_conversations.contains)
+        for user in self.users:
+            contains(user.id, 'c1', load)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation.members.remove(self.users[1])
+
+        cached = {user.id: user_conversations._cache.get(str(user.id))
+                  for user in self.users}
+        assert cached[self.users[0].id] is not None
+        assert cached[self.users[1].id] is None
@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.models import Conversation, ConversationMessage
+from app.pagination import encode_cursor
+
+User = get_user_model()
+
+
+class ConversationHistoryTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+        self.third_user = User.objects.create_user(
+            first_name="selena", last_name="doe",
+            email="selena@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+        # Messages 0 (oldest) to 4 (newest), sent by both users
+        self.now = timezone.now()
+        ConversationMessage.objects.bulk_create([
+            ConversationMessage(
+                conversation=self.conversation,
+                sender=[self.first_user, self.second_user][i % 2],
+                text=f"Message {i}",
+                created_at=self.now + timedelta(seconds=i)
+            )
+            for i in range(5)
+        ])
+
+        self.url = reverse('conversation_messages',
+                           args=[self.conversation.id])
+
+    def get_page(self, user, **params):
+        token = AccessToken.for_user(user)
+        return self.client.get(self.url, params,
+                               HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_scroll_back_through_history(self):
+        """
+        Test walking the history with the before cursor
+        """
+        texts = []
+        params = {'limit': 2}
+        while True:
+            response = self.get_page(self.first_user, **params)
+            assert response.status_code == 200
+
+            data = response.json()['data']
+            texts += [message['text'] for message in data['results']]
+            if not data['has_more']:
+                break
+            params['before'] = data['before']
+
+        assert texts == [f"Message {i}" for i in range(4, -1, -1)]
+
+    def test_load_newer_messages(self):
+        """
+        Test the after cursor only returns messages newer than it
+        """
+        response = self.get_page(self.first_user, limit=2)
+        after = response.json()['data']['after']
+
+        ConversationMessage.objects.create(conversation=self.conversation,
+                                           sender=self.second_user,
+                                           text="Message 5",
+                                           created_at=self.now + timedelta(
+                                               seconds=5
+                                           ))
+
+        response = self.get_page(self.first_user, after=after)
+        data = response.json()['data']
+        assert [message['text'] for message in data['results']] == [
+            "Message 5"
+        ]
+
+    def test_page_query_count_is_constant(self):
+        """
+        Test senders are loaded in the same query as the messages
+        """
+        token = AccessToken.for_user(self.first_user)
+
+        # Authentication, membership check and the page itself
+        with self.assertNumQueries(3):
+            self.client.get(self.url, {'limit': 5},
+                            HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_invalid_cursor(self):
+        """
+        Test a malformed cursor is rejected
+        """
+        response = self.get_page(self.first_user, before="not-a-cursor")
+        assert response.status_code == 400
+
+        # Well formed, with values that aren't a datetime and a UUID
+        for name in ('before', 'after'):
+            response = self.get_page(self.first_user, **{
+                name: encode_cursor(["garbage", "nope"])
+            })
+            assert response.status_code == 400
+
+    def test_access_to_other_users_conversation(self):
+        """
+        Test User 3 trying to read User 1 and User 2 history
+        """
+        response = self.get_page(self.third_user)
+        assert response.status_code == 404
@@ -0,0 +1,133 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from app.models import ConversationMessage, ConversationReadState
+from app.pagination import encode_cursor
+from app.services.chat_services import (create_group_conversation,
+                                        create_message, create_messages,
+                                        get_or_create_conversation)
+
+User = get_user_model()
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.contacts = [
+            User.objects.create_user(
+                first_name=f"user{i}", last_name="doe",
+                email=f"user{i}@gmail.com", password="password321"
+            )
+            for i in range(4)
+        ]
+        self.conversations = [
+            get_or_create_conversation(self.user, contact)
+            for contact in self.contacts
+        ]
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('conversations')
+
+    def test_sequence_and_read_state(self):
+        """
+        Test messages are numbered per conversation and senders have read
+        their own messages
+        """
+        conversation = self.conversations[0]
+        contact = self.contacts[0]
+
+        create_message(conversation.id, contact.id, "Hi")
+        create_messages([
+            ConversationMessage(conversation_id=conversation.id,
+                                sender_id=sender.id, text=text)
+            for sender, text in ((contact, "There?"), (self.user, "Yes"),
+                                 (contact, "Great"))
+        ])
+
+        conversation.refresh_from_db()
+        assert conversation.last_seq == 4
+        assert conversation.last_message.text == "Great"
+        assert list(conversation.messages.order_by('seq')
+                    .values_list('seq', flat=True)) == [1, 2, 3, 4]
+
+        read_seqs = dict(ConversationReadState.objects
+                         .filter(conversation=conversation)
+                         .values_list('user_id', 'last_read_seq'))
+        assert read_seqs == {contact.id: 4, self.user.id: 3}
+
+    def test_inbox(self):
+        """
+        Test the inbox lists conversations by activity with their latest
+        message and unread count
+        """
+        first, second = self.conversations[:2]
+        create_message(first.id, self.contacts[0].id, "Hi")
+        create_message(first.id, self.contacts[0].id, "Are you there?")
+        create_message(second.id, self.user.id, "Hello")
+
+        response = self.client.get(self.url, {'limit': 2})
+        assert response.status_code == 200
+
+        data = response.json()['data']
+        results = data['results']
+        assert [result['id'] for result in results] == [str(second.id),
+                                                        str(first.id)]
+        assert results[0]['unread_count'] == 0
+        assert results[0]['last_message']['text'] == "Hello"
+        assert results[1]['unread_count'] == 2
+        assert results[1]['last_message']['text'] == "Are you there?"
+        assert {member['id'] for member in results[1]['members']} == {
+            str(self.user.id), str(self.contacts[0].id)
+        }
+        assert data['has_more']
+
+        response = self.client.get(self.url, {'before': data['before']})
+        assert len(response.json()['data']['results']) == 2
+
+    def test_fixed_number_of_queries(self):
+        """
+        Test the inbox takes the same number of queries whatever the
+        number of conversations
+        """
+        for conversation, contact in zip(self.conversations, self.contacts):
+            create_message(conversation.id, contact.id, "Hi")
+        group = create_group_conversation(self.user, "Team",
+                                          [contact.id
+                                           for contact in self.contacts])
+
+        with mock.patch('app.services.chat_services.INBOX_MEMBERS_PREVIEW',
+                        3), self.assertNumQueries(2):
+            response = self.client.get(self.url)
+
+        results = {result['id']: result
+                   for result in response.json()['data']['results']}
+        assert len(results) == 5
+
+        # Groups list their first members by name
+        result = results[str(group.id)]
+        assert result['member_count'] == 5
+        assert [member['first_name'] for member in result['members']] == [
+            "john", "user0", "user1"
+        ]
+        result = results[str(self.conversations[0].id)]
+        assert result['member_count'] == 2
+        assert len(result['members']) == 2
+
+    def test_invalid_cursor(self):
+        """
+        Test cursors with values that aren't a datetime and a UUID are
+        rejected
+        """
+        for name in ('before', 'after'):
+            response = self.client.get(self.url, {
+                name: encode_cursor(["garbage", "nope"])
+            })
+            assert response.status_code == 400
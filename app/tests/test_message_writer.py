@@ -0,0 +1,212 @@
+import asyncio
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import path
+
+from app.consumers import ChatConsumer
+from app.models import Conversation, ConversationMessage
+from app.server import ChatServer
+from app.services.message_writer import MessageWriter, get_message_writer
+
+User = get_user_model()
+
+
+class FlakyMessageWriter(MessageWriter):
+    """
+    Message writer failing its first writes, and any write of a message
+    with the text "Bad".
+    """
+    def __init__(self, *args, failures, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = failures
+
+    async def write(self, batch):
+        if self.failures or any(m.text == "Bad" for m in batch):
+            self.failures = max(self.failures - 1, 0)
+            raise RuntimeError("Database unavailable")
+        await super().write(batch)
+
+
+class RecordingMessageWriter(MessageWriter):
+    """
+    Message writer that remembers the size of every written batch.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_sizes = []
+
+    async def write(self, batch):
+        self.batch_sizes.append(len(batch))
+        await super().write(batch)
+
+
+class MessageWriterTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+    def build_message(self, text):
+        return ConversationMessage(conversation_id=self.conversation.id,
+                                   sender_id=self.first_user.id,
+                                   text=text)
+
+    async def test_full_batch_is_written_at_once(self):
+        """
+        Test queued messages are saved with a single bulk insert
+        """
+        writer = RecordingMessageWriter(batch_size=3, interval=60,
+                                        max_size=10)
+
+        for i in range(3):
+            await writer.enqueue(self.build_message(f"Hi {i}"))
+        await writer.close()
+
+        assert writer.batch_sizes == [3]
+        count = await ConversationMessage.objects.acount()
+        assert count == 3
+
+    async def test_partial_batch_is_written_after_interval(self):
+        """
+        Test a batch smaller than batch_size is saved once the interval
+        passes and the conversation is bumped
+        """
+        modified_at = self.conversation.modified_at
+        writer = RecordingMessageWriter(batch_size=100, interval=0.01,
+                                        max_size=10)
+
+        await writer.enqueue(self.build_message("Hi"))
+        await writer.flush()
+        await writer.close()
+
+        assert writer.batch_sizes == [1]
+        conversation = await Conversation.objects.aget(
+            id=self.conversation.id
+        )
+        assert conversation.modified_at > modified_at
+
+    @override_settings(CHAT_MESSAGE_PERSISTENCE='batched')
+    async def test_consumer_batched_persistence(self):
+        """
+        Test messages sent over the socket are saved by the message writer
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/"
+        )
+        communicator.scope['user'] = self.first_user
+        connected, _ = await communicator.connect()
+
+        assert connected
+
+        for i in range(2):
+            await communicator.send_json_to({
+                "message": f"Hi {i}",
+                "recipient_id": str(self.second_user.id)
+            })
+            payload = await communicator.receive_json_from()
+            assert payload['seq'] == i + 1
+
+        await get_message_writer().close()
+
+        texts = await database_sync_to_async(list)(
+            ConversationMessage.objects
+            .order_by('created_at')
+            .values_list('text', flat=True)
+        )
+        assert texts == ["Hi 0", "Hi 1"]
+
+        await communicator.disconnect()
+
+    async def test_sequence_numbers(self):
+        """
+        Test messages are numbered when their batch is saved, without gaps
+        across the writers of several processes, and published after
+        """
+        await database_sync_to_async(Conversation.objects.filter(
+            id=self.conversation.id
+        ).update)(last_seq=5)
+        writers = [MessageWriter(batch_size=100, interval=0.01,
+                                 max_size=10) for _ in range(2)]
+        written = []
+
+        async def on_written(message, saved):
+            written.append((message.text, message.seq, saved))
+
+        for i in range(4):
+            await writers[i % 2].enqueue(self.build_message(f"Hi {i}"),
+                                         on_written)
+        for writer in writers:
+            await writer.close()
+
+        seqs = await database_sync_to_async(list)(
+            ConversationMessage.objects.order_by('seq')
+            .values_list('seq', flat=True)
+        )
+        assert seqs == [6, 7, 8, 9]
+        assert sorted(seq for _, seq, _ in written) == seqs
+        assert all(saved for _, _, saved in written)
+        conversation = await Conversation.objects.aget(
+            id=self.conversation.id
+        )
+        assert conversation.last_seq == 9
+
+    async def test_failed_batch_retried(self):
+        """
+        Test a failed batch is written again, and a message that can't be
+        saved doesn't lose the rest of its batch
+        """
+        writer = FlakyMessageWriter(batch_size=100, interval=0.01,
+                                    max_size=10, retries=2,
+                                    retry_delay=0, failures=2)
+        written = []
+
+        async def on_written(message, saved):
+            written.append((message.text, message.seq, saved))
+
+        await writer.enqueue(self.build_message("Hi"), on_written)
+        await writer.flush(immediate=True)
+
+        for text in ("Bad", "Still saved"):
+            await writer.enqueue(self.build_message(text), on_written)
+        await writer.close()
+
+        messages = await database_sync_to_async(list)(
+            ConversationMessage.objects.order_by('seq')
+            .values_list('text', 'seq')
+        )
+        assert messages == [("Hi", 1), ("Still saved", 2)]
+        assert written == [("Hi", 1, True), ("Bad", None, False),
+                           ("Still saved", 2, True)]
+
+    @override_settings(CHAT_MESSAGE_PERSISTENCE='batched',
+                       CHAT_MESSAGE_BATCH_INTERVAL_MS=60000)
+    async def test_saved_on_server_shutdown(self):
+        """
+        Test the server shutdown trigger saves queued messages
+        """
+        await get_message_writer().enqueue(self.build_message("Last"))
+
+        server = ChatServer(application=None,
+                            endpoints=['tcp:port=0'])
+        await server.save_queued_messages().asFuture(
+            asyncio.get_running_loop()
+        )
+
+        count = await ConversationMessage.objects.acount()
+        assert count == 1
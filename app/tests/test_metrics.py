@@ -0,0 +1,120 @@
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path, reverse
+
+from app.consumers import ChatConsumer
+from app.metrics import InMemoryMetrics, get_metrics
+from app.models import Conversation
+
+User = get_user_model()
+
+
+class InMemoryMetricsTests(SimpleTestCase):
+    def test_render_prometheus_text(self):
+        """
+        Test counters, gauges and histograms are rendered
+        """
+        metrics = InMemoryMetrics(buckets=(0.1, 1.0))
+        metrics.increment('chat_messages_in_total')
+        metrics.increment('chat_messages_in_total')
+        metrics.gauge_add('chat_active_connections', 1)
+        metrics.observe('chat_stage_seconds', 0.5, stage='save')
+
+        text = metrics.render()
+
+        assert "# TYPE chat_messages_in_total counter" in text
+        assert "chat_messages_in_total 2" in text
+        assert "chat_active_connections 1" in text
+        assert 'chat_stage_seconds_bucket{stage="save",le="0.1"} 0' in text
+        assert 'chat_stage_seconds_bucket{stage="save",le="1.0"} 1' in text
+        assert 'chat_stage_seconds_count{stage="save"} 1' in text
+
+    def test_endpoint_disabled(self):
+        """
+        Test the endpoint is not found while metrics are disabled
+        """
+        response = self.client.get(reverse('metrics'))
+        assert response.status_code == 404
+
+
+@override_settings(CHAT_METRICS_BACKEND='app.metrics.InMemoryMetrics')
+class ConsumerMetricsTests(TestCase):
+    def setUp(self):
+        get_metrics().reset()
+
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+    async def test_message_is_counted(self):
+        """
+        Test a message is counted and its stages are timed
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        communicator = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/"
+        )
+        communicator.scope['user'] = self.first_user
+        connected, _ = await communicator.connect()
+        assert connected
+
+        await communicator.send_json_to({
+            "message": "Hi Test 1",
+            "recipient_id": str(self.second_user.id)
+        })
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        metrics = get_metrics()
+        assert metrics.counters[('chat_messages_in_total', ())] == 1
+        assert metrics.counters[('chat_messages_out_total', ())] == 1
+        assert metrics.gauges[('chat_active_connections', ())] == 0
+        for stage in ('db_load', 'db_save', 'save', 'group_send', 'send'):
+            key = ('chat_stage_seconds', (('stage', stage), ))
+            assert metrics.histograms[key]['count'] == 1
+
+    def test_endpoint(self):
+        """
+        Test the endpoint serves the Prometheus text format
+        """
+        get_metrics().increment('chat_messages_in_total')
+
+        response = self.client.get(reverse('metrics'))
+
+        assert response.status_code == 200
+        assert b"chat_messages_in_total 1" in response.content
+
+    def test_endpoint_access(self):
+        """
+        Test only staff users and allowed addresses get the metrics
+        """
+        url = reverse('metrics')
+        assert self.client.get(
+            url, REMOTE_ADDR='203.0.113.7'
+        ).status_code == 403
+
+        with self.settings(CHAT_METRICS_ALLOWED_IPS=['203.0.113.0/24']):
+            assert self.client.get(
+                url, REMOTE_ADDR='203.0.113.7'
+            ).status_code == 200
+            assert self.client.get(url).status_code == 403
+
+        self.first_user.is_staff = True
+        self.first_user.save()
+        self.client.force_login(self.first_user)
+        assert self.client.get(
+            url, REMOTE_ADDR='203.0.113.7'
+        ).status_code == 200
@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+from unittest import mock
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import path, reverse
+from rest_framework.test import APIClient
+
+from app.consumers import ChatConsumer
+from app.models import Conversation
+from app.presence import PresenceTracker, _sweep, presence
+
+User = get_user_model()
+
+
+class PresenceTrackerTests(SimpleTestCase):
+    def test_sockets_per_group(self):
+        """
+        Test users are online in a group until their last socket leaves
+        """
+        tracker = PresenceTracker(ttl=60)
+
+        assert tracker.add('a', 1, 'chat_1')
+        assert not tracker.add('b', 1, 'chat_1')
+        assert tracker.add('c', 1, 'chat_2')
+        assert tracker.online_in('chat_1') == {'1'}
+
+        assert not tracker.remove('a')
+        assert tracker.remove('b')
+        assert tracker.online_in('chat_1') == set()
+        assert tracker.is_online(1)
+
+        assert tracker.remove('c')
+        assert not tracker.remove('c')
+        assert not tracker.is_online(1)
+
+    def test_expire(self):
+        """
+        Test silent sockets expire and come back on their next frame
+        """
+        tracker = PresenceTracker(ttl=0)
+        tracker.add('a', 1, 'chat_1')
+
+        assert tracker.expire() == [('1', 'chat_1')]
+        assert not tracker.is_online(1)
+        assert tracker.touch('a', 1, 'chat_1')
+
+
+class PresenceSweepTests(SimpleTestCase):
+    async def test_sweeper_survives_errors(self):
+        """
+        Test the sweeper logs failed iterations and sends, and keeps
+        running
+        """
+        tracker = mock.Mock(ttl=0.02)
+        tracker.expire.side_effect = itertools.chain(
+            [RuntimeError, [(1, 'chat_a'), (2, 'chat_b')]],
+            itertools.repeat([]),
+        )
+        send = mock.AsyncMock(side_effect=[RuntimeError, None])
+
+        with mock.patch('app.presence.presence', tracker), \
+                mock.patch('app.presence.send_presence', send), \
+                self.assertLogs('app.presence', 'ERROR') as logs:
+            task = asyncio.ensure_future(_sweep())
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        assert len(logs.records) == 2
+        send.assert_awaited_with('chat_b', 2, 'offline')
+
+
+class PresenceConsumerTests(TestCase):
+    def setUp(self):
+        presence.clear()
+
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        presence.clear()
+
+    def connect(self, user, query_string=''):
+        communicator = WebsocketCommunicator(
+            self.application,
+            f"/ws/chat/{self.conversation.id}/{query_string}"
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_presence_and_typing(self):
+        """
+        Test presence changes and rate limited typing indicators reach
+        clients asking for them
+        """
+        watcher = self.connect(self.first_user, '?presence=1')
+        assert (await watcher.connect())[0]
+
+        other = self.connect(self.second_user)
+        assert (await other.connect())[0]
+
+        second_id = str(self.second_user.id)
+        assert await watcher.receive_json_from() == {
+            'type': 'presence', 'user_id': second_id, 'status': 'online',
+        }
+
+        # The second indicator is inside the rate limit window
+        await other.send_json_to({'type': 'typing'})
+        await other.send_json_to({'type': 'typing'})
+        await other.send_json_to({'type': 'heartbeat'})
+        await other.send_json_to({
+            'message': 'Hi', 'recipient_id': str(self.first_user.id),
+        })
+
+        assert await watcher.receive_json_from() == {
+            'type': 'typing', 'user_id': second_id, 'typing': True,
+        }
+        assert (await watcher.receive_json_from())['message'] == 'Hi'
+
+        # Clients without ?presence=1 only get messages
+        assert (await other.receive_json_from())['message'] == 'Hi'
+        assert await other.receive_nothing()
+
+        await other.disconnect()
+        assert await watcher.receive_json_from() == {
+            'type': 'presence', 'user_id': second_id, 'status': 'offline',
+        }
+
+        await watcher.disconnect()
+
+    def test_user_list_is_online(self):
+        """
+        Test the user list shows who is online without extra queries
+        """
+        presence.add('socket', self.second_user.id, 'chat_1')
+        cache.clear()
+
+        client = APIClient()
+        client.force_authenticate(self.first_user)
+
+        with self.assertNumQueries(1):
+            response = client.get(reverse('users_list'))
+
+        assert response.status_code == 200
+        assert response.json()['data']['results'] == [{
+            'id': str(self.second_user.id),
+            'first_name': 'ray',
+            'last_name': 'doe',
+            'is_online': True,
+        }]
@@ -0,0 +1,137 @@
+import asyncio
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from app.consumers import ChatConsumer
+from app.models import ConversationReadState
+from app.receipts import ReceiptCoalescer
+from app.services.chat_services import (create_message,
+                                        get_or_create_conversation,
+                                        update_read_state)
+
+User = get_user_model()
+
+
+class ReceiptCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.flushes = []
+
+    async def flush(self, read_seq, delivered_seq):
+        self.flushes.append((read_seq, delivered_seq))
+
+    async def test_acks_are_collapsed(self):
+        """
+        Test acks within an interval are saved once, moving forward only
+        """
+        receipts = ReceiptCoalescer(self.flush, interval=0.01)
+
+        receipts.ack(delivered_seq=3)
+        receipts.ack(read_seq=2)
+        receipts.ack(read_seq=1, delivered_seq=1)
+        await asyncio.sleep(0.05)
+        assert self.flushes == [(2, 3)]
+
+        # Nothing moved, nothing to save
+        receipts.ack(read_seq=2)
+        await receipts.close()
+        assert self.flushes == [(2, 3)]
+
+        receipts.ack(read_seq=5)
+        await receipts.close()
+        assert self.flushes == [(2, 3), (5, 5)]
+
+
+class ReadStateTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+        self.conversation = get_or_create_conversation(self.first_user,
+                                                       self.second_user)
+        for text in ("Hi", "There?", "Hello"):
+            create_message(self.conversation.id, self.first_user.id, text)
+
+    def read_state(self):
+        return ConversationReadState.objects.get(
+            conversation=self.conversation, user=self.second_user
+        )
+
+    def test_update_read_state(self):
+        """
+        Test cursors move forward only and stop at the latest message
+        """
+        assert update_read_state(self.conversation.id, self.second_user.id,
+                                 delivered_seq=2)
+        state = self.read_state()
+        assert (state.last_read_seq, state.last_delivered_seq) == (0, 2)
+
+        with self.assertNumQueries(2):
+            update_read_state(self.conversation.id, self.second_user.id,
+                              read_seq=1, delivered_seq=1)
+        state = self.read_state()
+        assert (state.last_read_seq, state.last_delivered_seq) == (1, 2)
+
+        assert update_read_state(self.conversation.id, self.second_user.id,
+                                 read_seq=10) == (3, 3)
+        state = self.read_state()
+        assert (state.last_read_seq, state.last_delivered_seq) == (3, 3)
+
+    @override_settings(CHAT_ACK_FLUSH_INTERVAL_MS=20)
+    async def test_ack_frames(self):
+        """
+        Test acks sent over the socket are saved and broadcast once
+        """
+        application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+        sender = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/?receipts=1"
+        )
+        sender.scope['user'] = self.first_user
+        reader = WebsocketCommunicator(
+            application, f"/ws/chat/{self.conversation.id}/"
+        )
+        reader.scope['user'] = self.second_user
+        assert (await sender.connect())[0]
+        assert (await reader.connect())[0]
+
+        await reader.send_json_to({'type': 'ack', 'delivered_seq': 3})
+        await reader.send_json_to({'type': 'ack', 'read_seq': 2})
+
+        assert await sender.receive_json_from() == {
+            'type': 'receipt',
+            'user_id': str(self.second_user.id),
+            'read_seq': 2,
+            'delivered_seq': 3,
+        }
+        assert await sender.receive_nothing()
+
+        # The saved cursors are sent, not the acked ones
+        await reader.send_json_to({'type': 'ack', 'read_seq': 10})
+        assert await sender.receive_json_from() == {
+            'type': 'receipt',
+            'user_id': str(self.second_user.id),
+            'read_seq': 3,
+            'delivered_seq': 3,
+        }
+
+        for read_seq in ('all', 2 ** 64):
+            await reader.send_json_to({'type': 'ack', 'read_seq': read_seq})
+            assert await reader.receive_from() == "Error: Invalid ack."
+
+        await reader.disconnect()
+        await sender.disconnect()
+
+        state = await database_sync_to_async(self.read_state)()
+        assert (state.last_read_seq, state.last_delivered_seq) == (3, 3)
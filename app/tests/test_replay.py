@@ -0,0 +1,141 @@
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import path
+
+from app.consumers import ChatConsumer
+from app.models import Conversation
+from app.presence import presence
+from app.replay import ReplayBuffer, replay_buffers
+from app.services.chat_services import create_message
+
+User = get_user_model()
+
+
+class ReplayBufferTests(SimpleTestCase):
+    def test_since(self):
+        """
+        Test the buffer only answers for gaps it fully holds
+        """
+        buffer = ReplayBuffer(size=3)
+        for seq in (2, 1, 3, 3, 4):
+            buffer.record(seq, {'seq': seq})
+
+        assert buffer.seqs == [2, 3, 4]
+        assert buffer.since(2) == [{'seq': 3}, {'seq': 4}]
+        assert buffer.since(4) == []
+        assert buffer.since(0) is None
+
+        # Message 6 arrived before 5
+        buffer.record(6, {'seq': 6})
+        assert buffer.since(3) is None
+
+
+class ReplayConsumerTests(TestCase):
+    def setUp(self):
+        presence.clear()
+        replay_buffers.clear()
+
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def tearDown(self):
+        presence.clear()
+        replay_buffers.clear()
+
+    def connect(self, user, query_string=''):
+        communicator = WebsocketCommunicator(
+            self.application,
+            f"/ws/chat/{self.conversation.id}/{query_string}"
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    async def send_messages(self, communicator, count):
+        for i in range(count):
+            await communicator.send_json_to({
+                'message': f"Hi {i}",
+                'recipient_id': str(self.second_user.id),
+            })
+            await communicator.receive_json_from()
+
+    async def test_replay_from_memory(self):
+        """
+        Test a reconnecting client gets only the messages it missed, from
+        the buffer of the group
+        """
+        sender = self.connect(self.first_user)
+        assert (await sender.connect())[0]
+        await self.send_messages(sender, 3)
+
+        receiver = self.connect(self.second_user, '?last_seq=1')
+        assert (await receiver.connect())[0]
+
+        assert [
+            (await receiver.receive_json_from())['seq'] for _ in range(2)
+        ] == [2, 3]
+        assert await receiver.receive_json_from() == {
+            'type': 'replayed', 'last_seq': 3, 'complete': True,
+        }
+
+        # Live messages follow the replay
+        await self.send_messages(sender, 1)
+        assert (await receiver.receive_json_from())['seq'] == 4
+        assert await receiver.receive_nothing()
+
+        await receiver.disconnect()
+        await sender.disconnect()
+
+    async def test_replay_from_database(self):
+        """
+        Test the gap is read from the database once the buffer is gone,
+        up to CHAT_REPLAY_MAX_MESSAGES
+        """
+        for i in range(3):
+            await database_sync_to_async(create_message)(
+                self.conversation.id, self.first_user.id, f"Hi {i}"
+            )
+
+        with self.settings(CHAT_REPLAY_MAX_MESSAGES=1):
+            receiver = self.connect(self.second_user, '?last_seq=1')
+            assert (await receiver.connect())[0]
+
+            assert await receiver.receive_json_from() == {
+                'message': "Hi 1",
+                'sender_id': str(self.first_user.id),
+                'recipient_id': str(self.second_user.id),
+                'seq': 2,
+            }
+            assert await receiver.receive_json_from() == {
+                'type': 'replayed', 'last_seq': 2, 'complete': False,
+            }
+
+        await receiver.disconnect()
+
+
+    async def test_invalid_last_seq(self):
+        """
+        Test a last_seq that isn't an ASCII number within the sequence
+        range connects without a replay
+        """
+        for last_seq in ('%C2%B2', str(2 ** 64)):
+            receiver = self.connect(self.second_user,
+                                    f'?last_seq={last_seq}')
+            assert (await receiver.connect())[0]
+            assert await receiver.receive_nothing()
+            await receiver.disconnect()
@@ -0,0 +1,159 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.models import Conversation, ConversationMessage, MessageSearchTerm
+from app.services.chat_services import create_messages
+from app.services.search_services import make_snippet, search_messages
+
+User = get_user_model()
+
+
+class SearchTestMixin:
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+        self.third_user = User.objects.create_user(
+            first_name="sam", last_name="doe",
+            email="sam@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+        self.other_conversation = Conversation.objects.create()
+        self.other_conversation.members.add(self.second_user,
+                                            self.third_user)
+
+        create_messages([
+            ConversationMessage(conversation=self.conversation,
+                                sender=self.first_user, text=text)
+            for text in ["Lunch at the café?",
+                         "Lunch lunch LUNCH, I'm starving",
+                         "Dinner is later"]
+        ] + [
+            ConversationMessage(conversation=self.other_conversation,
+                                sender=self.third_user,
+                                text="Lunch tomorrow?"),
+        ])
+
+    def search(self, user, search, **kwargs):
+        page = search_messages(user, search, **kwargs)
+        return [message.text for message in page['results']]
+
+    def test_search_ranked(self):
+        """
+        Test matches are ranked by how often the terms occur, within the
+        conversations of the user
+        """
+        assert self.search(self.first_user, "lunch") == [
+            "Lunch lunch LUNCH, I'm starving", "Lunch at the café?",
+        ]
+        assert len(self.search(self.second_user, "lunch")) == 3
+        assert self.search(self.second_user, "lunch",
+                           conversation=self.other_conversation.id) == [
+            "Lunch tomorrow?",
+        ]
+        assert self.search(self.third_user, "starving") == []
+
+    def test_search_terms(self):
+        """
+        Test every term must match, accents are ignored and the last term
+        is a prefix
+        """
+        assert self.search(self.first_user, "lunch cafe") == [
+            "Lunch at the café?",
+        ]
+        assert self.search(self.first_user, "din") == ["Dinner is later"]
+        assert self.search(self.first_user, "lunch dinner") == []
+        assert self.search(self.first_user, "?!") == []
+
+    def test_search_pages(self):
+        """
+        Test results are paged with the `after` cursor
+        """
+        page = search_messages(self.second_user, "lunch", limit=2)
+        assert len(page['results']) == 2
+        assert page['has_more']
+
+        last = search_messages(self.second_user, "lunch", limit=2,
+                               after=page['after'])
+        assert len(last['results']) == 1
+        assert not last['has_more']
+        assert last['after'] is None
+
+    def test_deleted_messages(self):
+        """
+        Test deleted messages drop out of the index
+        """
+        ConversationMessage.objects.filter(text__startswith="Dinner").delete()
+        assert self.search(self.first_user, "dinner") == []
+
+    def test_rebuild(self):
+        """
+        Test the rebuild command indexes every message again
+        """
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        assert "Indexed 4 messages" in out.getvalue()
+        assert len(self.search(self.second_user, "lunch")) == 3
+
+
+class FTS5SearchTests(SearchTestMixin, TestCase):
+    def test_search_api(self):
+        """
+        Test the search endpoint returns highlighted snippets
+        """
+        token = AccessToken.for_user(self.first_user)
+        response = self.client.get(reverse('message_search'),
+                                   {'search': "starv"},
+                                   HTTP_AUTHORIZATION=f"Bearer {token}")
+        assert response.status_code == 200
+
+        result, = response.json()['data']['results']
+        assert result['conversation'] == str(self.conversation.id)
+        assert result['snippet'] == (
+            "Lunch lunch LUNCH, I&#x27;m <mark>starving</mark>"
+        )
+        assert result['sender']['id'] == str(self.first_user.id)
+
+        response = self.client.get(reverse('message_search'),
+                                   {'search': "lunch", 'after': "nope"},
+                                   HTTP_AUTHORIZATION=f"Bearer {token}")
+        assert response.status_code == 400
+
+
+@override_settings(CHAT_SEARCH_BACKEND='table')
+class TableSearchTests(SearchTestMixin, TestCase):
+    def test_terms_written(self):
+        """
+        Test saved messages are split into counted terms
+        """
+        terms = dict(MessageSearchTerm.objects
+                     .filter(message__text__startswith="Lunch lunch")
+                     .values_list('term', 'frequency'))
+        assert terms == {'lunch': 3, 'i': 1, 'm': 1, 'starving': 1}
+
+
+class SnippetTests(SimpleTestCase):
+    @override_settings(CHAT_SEARCH_SNIPPET_TOKENS=4)
+    def test_make_snippet(self):
+        """
+        Test snippets are cut around the first match and escaped
+        """
+        text = "one two three four <five> six seven eight"
+        assert make_snippet(text, ["fiv"]) == (
+            "…four &lt;<mark>five</mark>&gt; six seven…"
+        )
+        assert make_snippet("Just <this>", ["just"]) == (
+            "<mark>Just</mark> &lt;this&gt;"
+        )
@@ -0,0 +1,126 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from app.pagination import encode_cursor
+from app.services.user_services import get_user_directory
+
+User = get_user_model()
+
+
+class UserDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        names = [("Ray", "Doe"), ("selena", "gomez"), ("adam", "Smith"),
+                 ("Rachel", "green"), ("bob", "Rayner")]
+        for first_name, last_name in names:
+            User.objects.create_user(
+                first_name=first_name, last_name=last_name,
+                email=f"{first_name.lower()}@example.com",
+                password="password321"
+            )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('users_list')
+
+    def names(self, response):
+        return [user['first_name']
+                for user in response.json()['data']['results']]
+
+    def test_pages(self):
+        """
+        Test users are listed by name, page after page, without the
+        authenticated user
+        """
+        response = self.client.get(self.url, {'limit': 2})
+        data = response.json()['data']
+
+        assert self.names(response) == ["adam", "bob"]
+        assert data['has_more']
+
+        response = self.client.get(self.url, {'limit': 2,
+                                              'after': data['after']})
+        assert self.names(response) == ["Rachel", "Ray"]
+
+        response = self.client.get(
+            self.url, {'limit': 2, 'after': response.json()['data']['after']}
+        )
+        assert self.names(response) == ["selena"]
+        assert not response.json()['data']['has_more']
+        assert response.json()['data']['after'] is None
+
+    def test_search(self):
+        """
+        Test search matches name and email prefixes, ignoring case
+        """
+        response = self.client.get(self.url, {'search': 'RA'})
+        assert self.names(response) == ["bob", "Rachel", "Ray"]
+
+        response = self.client.get(self.url, {'search': 'selena@ex'})
+        assert self.names(response) == ["selena"]
+
+        response = self.client.get(self.url, {'search': 'jo'})
+        assert self.names(response) == []
+
+        response = self.client.get(self.url, {'after': 'bad'})
+        assert response.status_code == 400
+
+        # Well-formed cursor with an id that isn't a UUID
+        response = self.client.get(self.url, {'after': encode_cursor(
+            ['ray', 'doe', 'not-a-uuid']
+        )})
+        assert response.status_code == 400
+
+    def test_first_page_cache(self):
+        """
+        Test the first page is served from the cache until a user
+        registers
+        """
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        assert len(self.names(response)) == 5
+
+        # Another user gets the same entry, without themselves
+        other = User.objects.get(email="ray@example.com")
+        with self.assertNumQueries(0):
+            page = get_user_directory(other)
+        assert [user['first_name'] for user in page['results']] == [
+            "adam", "bob", "john", "Rachel", "selena"
+        ]
+
+        self.client.post(reverse('register'), data={
+            "first_name": "zoe", "last_name": "doe",
+            "email": "zoe@gmail.com", "password": "password321",
+            "confirm_password": "password321",
+        })
+        response = self.client.get(self.url)
+        assert self.names(response)[-1] == "zoe"
+
+    def test_indexed_queries(self):
+        """
+        Test the directory and prefix search read the name indexes
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest("Query plans are checked on SQLite only.")
+
+        with self.assertNumQueries(1) as context:
+            get_user_directory(self.user, search='ra')
+        sql = context.captured_queries[0]['sql']
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+
+        assert 'app_user_name_idx' in plan
+        assert 'app_user_last_name_idx' in plan
@@ -0,0 +1,165 @@
+from autobahn.websocket.compress import (PerMessageDeflateOffer,
+                                         PerMessageDeflateOfferAccept)
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from app.consumers import ChatConsumer
+from app.models import Conversation, ConversationMessage
+from app.protocol import msgpack
+from app.protocol.compression import accept_permessage_deflate
+from app.protocol.negotiation import negotiate
+
+User = get_user_model()
+
+
+class MessagePackTests(SimpleTestCase):
+    def test_round_trip(self):
+        """
+        Test values survive encoding and decoding
+        """
+        values = [
+            None, True, False, 0, 127, 128, 65536, 2 ** 40, -1, -33,
+            -2 ** 40, 1.5, "", "héllo", "x" * 40, "y" * 70000, b"\x00\xff",
+            [], [1, [2, 3]], list(range(20)),
+            {"message": "Hi", "recipient_id": "abc", "n": {"a": [None]}},
+            {str(i): i for i in range(20)},
+        ]
+        for value in values:
+            assert msgpack.unpackb(msgpack.packb(value)) == value
+
+    def test_compact_encoding(self):
+        """
+        Test small values use their single byte forms
+        """
+        assert msgpack.packb(5) == b'\x05'
+        assert msgpack.packb(-3) == b'\xfd'
+        assert msgpack.packb("a") == b'\xa1a'
+        assert msgpack.packb([]) == b'\x90'
+
+    def test_invalid_data(self):
+        """
+        Test truncated, trailing and unknown data is refused
+        """
+        for data in (b'', b'\xa5ab', b'\x01\x02', b'\xc1'):
+            with self.assertRaises(msgpack.PackError):
+                msgpack.unpackb(data)
+
+        with self.assertRaises(TypeError):
+            msgpack.packb(object())
+
+
+class NegotiationTests(SimpleTestCase):
+    def test_negotiate(self):
+        """
+        Test subprotocols win over query parameters, and last_seq is
+        only taken as an ASCII number in the sequence range
+        """
+        assert negotiate({'query_string': b'format=msgpack'}) == {
+            'batch': False, 'format': 'msgpack', 'presence': False,
+            'receipts': False, 'last_seq': None, 'subprotocol': None,
+        }
+        assert negotiate({'query_string': b'format=xml'})['format'] == 'json'
+
+        assert negotiate({'query_string': b'last_seq=12'})['last_seq'] == 12
+        for last_seq in (b'%C2%B2', str(2 ** 64).encode(), b'-1'):
+            assert negotiate({
+                'query_string': b'last_seq=' + last_seq
+            })['last_seq'] is None
+        assert negotiate({
+            'query_string': b'format=json',
+            'subprotocols': ['other', 'chat.msgpack.batch.v1',
+                             'chat.batch.v1'],
+        }) == {
+            'batch': True, 'format': 'msgpack', 'presence': False,
+            'receipts': False, 'last_seq': None,
+            'subprotocol': 'chat.msgpack.batch.v1',
+        }
+
+    def test_permessage_deflate(self):
+        """
+        Test deflate offers are accepted unless compression is disabled
+        """
+        offer = PerMessageDeflateOffer()
+
+        with override_settings(CHAT_WS_COMPRESSION_NO_CONTEXT_TAKEOVER=True):
+            accept = accept_permessage_deflate([offer])
+        assert isinstance(accept, PerMessageDeflateOfferAccept)
+        assert accept.no_context_takeover
+
+        with override_settings(CHAT_WS_COMPRESSION=False):
+            assert accept_permessage_deflate([offer]) is None
+
+
+class MessagePackConsumerTests(TestCase):
+    def setUp(self):
+        self.first_user = User.objects.create_user(
+            first_name="john", last_name="doe",
+            email="john@gmail.com", password="password321"
+        )
+        self.second_user = User.objects.create_user(
+            first_name="ray", last_name="doe",
+            email="ray@gmail.com", password="password321"
+        )
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.members.add(self.first_user, self.second_user)
+
+        self.application = URLRouter([
+            path('ws/chat/<str:conversation_id>/', ChatConsumer.as_asgi()),
+        ])
+
+    def connect(self, user, query_string=''):
+        communicator = WebsocketCommunicator(
+            self.application,
+            f"/ws/chat/{self.conversation.id}/{query_string}"
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_formats_per_connection(self):
+        """
+        Test a MessagePack client and a JSON client share a conversation
+        """
+        binary = self.connect(self.first_user, '?format=msgpack')
+        text = self.connect(self.second_user)
+        assert (await binary.connect())[0]
+        assert (await text.connect())[0]
+
+        await binary.send_to(bytes_data=msgpack.packb({
+            "message": "Hello",
+            "recipient_id": str(self.second_user.id),
+        }))
+
+        expected = {
+            "message": "Hello",
+            "sender_id": str(self.first_user.id),
+            "recipient_id": str(self.second_user.id),
+            "seq": 1,
+        }
+        assert msgpack.unpackb(await binary.receive_from()) == expected
+        assert await text.receive_json_from() == expected
+
+        await binary.disconnect()
+        await text.disconnect()
+
+    async def test_invalid_field_types(self):
+        """
+        Test MessagePack messages with bytes or numbers instead of text
+        are refused before they are saved
+        """
+        binary = self.connect(self.first_user, '?format=msgpack')
+        assert (await binary.connect())[0]
+
+        for frame in ({"message": b"Hello"},
+                      {"message": "Hello", "recipient_id": 1},
+                      {"message": "Hello", "attachment": b"\x00"}):
+            await binary.send_to(bytes_data=msgpack.packb(frame))
+            assert await binary.receive_from() == "Error: Invalid message."
+
+        count = await ConversationMessage.objects.acount()
+        assert count == 0
+
+        await binary.disconnect()
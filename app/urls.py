@@ -12,4 +12,25 @@ urlpatterns = [
     path('users/<uuid:pk>/chat/',
          views.UserChatView.as_view(),
          name='user_chat'),
+    path('conversations/',
+         views.ConversationListView.as_view(),
+         name='conversations'),
+    path('conversations/<uuid:pk>/messages/',
+         views.ConversationMessageListView.as_view(),
+         name='conversation_messages'),
+    path('conversations/<uuid:pk>/members/',
+         views.ConversationMemberListView.as_view(),
+         name='conversation_members'),
+    path('conversations/<uuid:pk>/members/<uuid:user_id>/',
+         views.ConversationMemberView.as_view(),
+         name='conversation_member'),
+    path('messages/search/',
+         views.MessageSearchView.as_view(),
+         name='message_search'),
+    path('attachments/',
+         views.AttachmentListView.as_view(),
+         name='attachments'),
+    path('attachments/<str:sha256>/',
+         views.AttachmentView.as_view(),
+         name='attachment'),
 ]
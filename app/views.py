@@ -1,15 +1,54 @@
+import ipaddress
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
+from django.conf import settings
+from django.views import View
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.views import APIView
-from rest_framework import serializers, status, permissions, generics
+from rest_framework import serializers, status, permissions
 from rest_framework.response import Response
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema
 from django.contrib.auth.password_validation import validate_password
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.contrib.auth import get_user_model
-from app.models import Conversation, ConversationMessage
-from app.services.user_services import create_user_account, get_user
-from app.services.chat_services import get_or_create_conversation
+from django.utils.text import Truncator
+from app.metrics import get_metrics
+from app.models import Attachment, Conversation, ConversationMessage
+from app.pagination import decode_cursor
+from app.presence import presence
+from app.services.user_services import (USER_DIRECTORY_CURSOR_PARSERS,
+                                        USER_DIRECTORY_MAX_LIMIT,
+                                        USER_DIRECTORY_ORDERING,
+                                        create_user_account,
+                                        get_user, get_user_directory)
+from app.services.chat_services import (INBOX_CURSOR_PARSERS,
+                                        INBOX_ORDERING,
+                                        MESSAGE_HISTORY_CURSOR_PARSERS,
+                                        MESSAGE_HISTORY_ORDERING,
+                                        add_conversation_members,
+                                        create_group_conversation,
+                                        get_conversation_messages,
+                                        get_or_create_conversation,
+                                        get_user_conversation,
+                                        get_user_inbox,
+                                        remove_conversation_member)
+from app.services.search_services import (decode_search_cursor,
+                                          search_messages)
+from app.services.attachment_services import (DIGITS_RE,
+                                              INLINE_CONTENT_TYPES,
+                                              AttachmentTooLarge,
+                                              EmptyAttachment, FileRange,
+                                              RangeNotSatisfiable,
+                                              attachment_path,
+                                              get_user_attachment,
+                                              normalize_content_type,
+                                              parse_range, store_attachment)
 User = get_user_model()
 
+# Characters of the latest message shown in the inbox
+INBOX_PREVIEW_LENGTH = 100
+
 
 class RegisterView(APIView):
     """
@@ -70,30 +109,112 @@ class RegisterView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class UserListView(generics.ListAPIView):
+class UserListView(APIView):
     """
-    Displays list of users, excluding the authenticated user.
+    Displays one page of users by name, excluding the authenticated user.
+    - `is_online` comes from the in-memory presence store.
     """
-    class UserOutputSerializer(serializers.ModelSerializer):
-        class Meta:
-            model = User
-            fields = ['id', 'first_name', 'last_name']
+    class FilterSerializer(serializers.Serializer):
+        """
+        Serializer for the user directory query parameters.
+        """
+        search = serializers.CharField(required=False, allow_blank=True,
+                                       max_length=100)
+        after = serializers.CharField(required=False)
+        limit = serializers.IntegerField(
+            required=False, default=50,
+            min_value=1, max_value=USER_DIRECTORY_MAX_LIMIT
+        )
+
+        def validate_after(self, value):
+            try:
+                decode_cursor(value, len(USER_DIRECTORY_ORDERING),
+                              USER_DIRECTORY_CURSOR_PARSERS)
+            except ValueError:
+                raise serializers.ValidationError("Invalid cursor.")
+            return value
+
+    class UsersOutputSerializer(serializers.Serializer):
+        """
+        Serializer for representing a page of users with its cursor.
+        """
+        class UserSerializer(serializers.Serializer):
+            """
+            Nested Serializer for representing user
+            """
+            id = serializers.UUIDField()
+            first_name = serializers.CharField()
+            last_name = serializers.CharField()
+            is_online = serializers.SerializerMethodField()
+
+            def get_is_online(self, obj) -> bool:
+                return presence.is_online(obj['id'])
+
+        results = UserSerializer(many=True)
+        has_more = serializers.BooleanField()
+        after = serializers.CharField(allow_null=True)
 
-    serializer_class = UserOutputSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        return User.objects.exclude(id=self.request.user.id)
+    @extend_schema(
+        parameters=[FilterSerializer],
+        responses={200: UsersOutputSerializer},
+    )
+    def get(self, request):
+        """
+        Displays users by name.
+        - `search`: prefix of the first name, last name or email.
+        - `after`: cursor to load the next page.
+        """
+        filters = self.FilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
 
+        page = get_user_directory(request.user, **filters.validated_data)
 
-class UserChatView(APIView):
+        response = self.UsersOutputSerializer(page)
+        return Response({
+            'success': True,
+            'msg': 'Users retrieved successfully.',
+            'data': response.data,
+            'status': status.HTTP_200_OK,
+        }, status=status.HTTP_200_OK)
+
+
+class ConversationMessageListView(APIView):
     """
-    API view to display conversation (chat) between users
+    API view to display one page of a conversation's message history
     """
-    class ChatOutputSerializer(serializers.ModelSerializer):
+    class FilterSerializer(serializers.Serializer):
         """
-        Serializer for representing a conversation -
-        with its messages and sender.
+        Serializer for the history query parameters.
+        """
+        before = serializers.CharField(required=False)
+        after = serializers.CharField(required=False)
+        limit = serializers.IntegerField(required=False, default=50,
+                                         min_value=1, max_value=100)
+
+        def validate(self, attrs):
+            if 'before' in attrs and 'after' in attrs:
+                raise serializers.ValidationError(
+                    "Use either before or after, not both."
+                )
+
+            for name in ('before', 'after'):
+                if name in attrs:
+                    try:
+                        decode_cursor(attrs[name],
+                                      len(MESSAGE_HISTORY_ORDERING),
+                                      MESSAGE_HISTORY_CURSOR_PARSERS)
+                    except ValueError:
+                        raise serializers.ValidationError({
+                            name: "Invalid cursor."
+                        })
+
+            return attrs
+
+    class MessagesOutputSerializer(serializers.Serializer):
+        """
+        Serializer for representing a page of messages with its cursors.
         """
         class MessageSerializer(serializers.ModelSerializer):
             """
@@ -107,17 +228,586 @@ class UserChatView(APIView):
                     model = User
                     fields = ['id', 'first_name', 'last_name']
 
+            class AttachmentSerializer(serializers.ModelSerializer):
+                """
+                Nested Serializer for representing an attached file
+                """
+                class Meta:
+                    model = Attachment
+                    fields = ['sha256', 'size', 'content_type']
+
             sender = UserSerializer()
+            attachment = AttachmentSerializer(allow_null=True)
 
             class Meta:
                 model = ConversationMessage
-                fields = ['text', 'sender', 'created_at']
+                fields = ['id', 'seq', 'text', 'sender', 'attachment',
+                          'created_at']
+
+        results = MessageSerializer(many=True)
+        has_more = serializers.BooleanField()
+        before = serializers.CharField(allow_null=True)
+        after = serializers.CharField(allow_null=True)
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        parameters=[FilterSerializer],
+        responses={200: MessagesOutputSerializer},
+    )
+    def get(self, request, pk):
+        """
+        Displays messages of a conversation, newest first.
+        - `before`: cursor to load older messages.
+        - `after`: cursor to load newer messages.
+        """
+        filters = self.FilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        conversation = get_user_conversation(request.user, pk)
+
+        page = get_conversation_messages(
+            conversation.id, archive_seq=conversation.archive_seq,
+            **filters.validated_data
+        )
+
+        response = self.MessagesOutputSerializer(page)
+        return Response({
+            'success': True,
+            'msg': 'Conversation messages retrieved successfully.',
+            'data': response.data,
+            'status': status.HTTP_200_OK,
+        }, status=status.HTTP_200_OK)
+
+
+class MessageSearchView(APIView):
+    """
+    API view to search the messages of the authenticated user's
+    conversations.
+    """
+    class FilterSerializer(serializers.Serializer):
+        """
+        Serializer for the search query parameters.
+        """
+        search = serializers.CharField(max_length=200)
+        conversation = serializers.UUIDField(required=False)
+        after = serializers.CharField(required=False)
+        limit = serializers.IntegerField(required=False, default=20,
+                                         min_value=1, max_value=50)
+
+        def validate_after(self, value):
+            try:
+                decode_search_cursor(value)
+            except ValueError:
+                raise serializers.ValidationError("Invalid cursor.")
+            return value
+
+    class SearchOutputSerializer(serializers.Serializer):
+        """
+        Serializer for representing a page of search results.
+        """
+        class ResultSerializer(serializers.ModelSerializer):
+            """
+            Nested Serializer for representing a matching message.
+            """
+            class UserSerializer(serializers.ModelSerializer):
+                """
+                Nested Serializer for representing user
+                """
+                class Meta:
+                    model = User
+                    fields = ['id', 'first_name', 'last_name']
+
+            sender = UserSerializer()
+            snippet = serializers.CharField()
+
+            class Meta:
+                model = ConversationMessage
+                fields = ['id', 'conversation', 'seq', 'text', 'snippet',
+                          'sender', 'created_at']
+
+        results = ResultSerializer(many=True)
+        has_more = serializers.BooleanField()
+        after = serializers.CharField(allow_null=True)
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        parameters=[FilterSerializer],
+        responses={200: SearchOutputSerializer},
+    )
+    def get(self, request):
+        """
+        Displays messages matching a search, best match first.
+        - `search`: words to find, the last one may be incomplete.
+        - `conversation`: only search this conversation.
+        - `after`: cursor to load the next page.
+        - `snippet` is HTML, with the matching words in <mark> tags.
+        """
+        filters = self.FilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        page = search_messages(request.user, **filters.validated_data)
+
+        response = self.SearchOutputSerializer(page)
+        return Response({
+            'success': True,
+            'msg': 'Messages retrieved successfully.',
+            'data': response.data,
+            'status': status.HTTP_200_OK,
+        }, status=status.HTTP_200_OK)
+
+
+class AttachmentListView(APIView):
+    """
+    API view to upload a file to attach to messages.
+    """
+    AttachmentOutputSerializer = ConversationMessageListView\
+        .MessagesOutputSerializer.MessageSerializer.AttachmentSerializer
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        request={'*/*': OpenApiTypes.BINARY},
+        responses={201: AttachmentOutputSerializer},
+    )
+    def post(self, request):
+        """
+        Uploads a file, sent as the raw request body with its own
+        Content-Type. Send it in a message with its `sha256`.
+        - The body is read in chunks, never parsed as a form. Chunked
+          uploads without a Content-Length are accepted.
+        - Uploading a file already stored returns the stored one.
+        """
+        content_type = normalize_content_type(
+            request.content_type or 'application/octet-stream'
+        )
+        # Missing for chunked uploads
+        content_length = request.META.get('CONTENT_LENGTH')
+
+        if content_type is None or len(content_type) > 100 or (
+                content_length and not DIGITS_RE.fullmatch(content_length)):
+            return Response({
+                'success': False,
+                'msg': 'Invalid upload headers.',
+                'status': status.HTTP_400_BAD_REQUEST,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if (content_length
+                and int(content_length) > settings.CHAT_ATTACHMENT_MAX_SIZE):
+            return Response({
+                'success': False,
+                'msg': 'Attachment too large.',
+                'status': status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # DRF only gives a stream for bodies with a Content-Length, chunked
+        # bodies are read from the Django request. The size limit is
+        # enforced while reading.
+        stream = request.stream
+        if stream is None:
+            stream = request._request
+
+        try:
+            attachment, _ = store_attachment(stream, request.user,
+                                             content_type)
+        except AttachmentTooLarge:
+            return Response({
+                'success': False,
+                'msg': 'Attachment too large.',
+                'status': status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except EmptyAttachment:
+            return Response({
+                'success': False,
+                'msg': 'Empty upload.',
+                'status': status.HTTP_400_BAD_REQUEST,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        response = self.AttachmentOutputSerializer(attachment)
+        return Response({
+            'success': True,
+            'msg': 'Attachment uploaded successfully.',
+            'data': response.data,
+            'status': status.HTTP_201_CREATED,
+        }, status=status.HTTP_201_CREATED)
+
+
+class FileContentNegotiation(BaseContentNegotiation):
+    """
+    Content negotiation of views answering with files.
+    - Accept headers like `image/*` don't match a renderer, errors are
+      rendered with the first one instead of failing with 406.
+    """
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class AttachmentView(APIView):
+    """
+    API view to download an attachment the authenticated user uploaded or
+    received in one of their conversations.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    content_negotiation_class = FileContentNegotiation
+
+    @extend_schema(
+        responses={(200, '*/*'): OpenApiTypes.BINARY,
+                   (206, '*/*'): OpenApiTypes.BINARY},
+    )
+    def get(self, request, sha256):
+        """
+        Downloads an attachment.
+        - Supports single byte ranges, e.g. `Range: bytes=0-1023`.
+        - Files never change, the ETag is their hash.
+        """
+        attachment = get_user_attachment(request.user, sha256)
+
+        etag = f'"{attachment.sha256}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponseNotModified(headers={'ETag': etag})
+
+        inline = attachment.content_type in INLINE_CONTENT_TYPES
+        path = attachment_path(attachment.sha256)
+
+        accel_redirect = settings.CHAT_ATTACHMENT_ACCEL_REDIRECT
+        if accel_redirect:
+            # The web server sends the file and answers Range requests
+            response = HttpResponse(content_type=attachment.content_type)
+            response['X-Accel-Redirect'] = (
+                accel_redirect.rstrip('/') + '/' + path.relative_to(
+                    settings.CHAT_ATTACHMENT_DIR
+                ).as_posix()
+            )
+        else:
+            try:
+                byte_range = parse_range(request.headers.get('Range'),
+                                         attachment.size)
+            except RangeNotSatisfiable:
+                return HttpResponse(
+                    status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                    headers={'Content-Range':
+                             f"bytes */{attachment.size}"}
+                )
+
+            if byte_range is None:
+                response = FileResponse(open(path, 'rb'),
+                                        content_type=attachment.content_type)
+            else:
+                start, end = byte_range
+                response = FileResponse(
+                    FileRange(open(path, 'rb'), start, end - start + 1),
+                    status=status.HTTP_206_PARTIAL_CONTENT,
+                    content_type=attachment.content_type,
+                )
+                response['Content-Length'] = end - start + 1
+                response['Content-Range'] = (
+                    f"bytes {start}-{end}/{attachment.size}"
+                )
 
-        messages = MessageSerializer(many=True)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        response['X-Content-Type-Options'] = 'nosniff'
+        response['Content-Disposition'] = (
+            f"{'inline' if inline else 'attachment'}; "
+            f'filename="{attachment.sha256}"'
+        )
+        return response
+
+
+class ConversationMemberListView(APIView):
+    """
+    API view to add members to a group conversation.
+    """
+    class MembersInputSerializer(serializers.Serializer):
+        """
+        Serializer for a list of users to add to a group.
+        """
+        members = serializers.ListField(
+            child=serializers.UUIDField(),
+            max_length=settings.CHAT_GROUP_MAX_MEMBERS,
+        )
+
+        def validate_members(self, value):
+            value = list(dict.fromkeys(value))
+            found = set(User.objects.filter(id__in=value)
+                        .values_list('id', flat=True))
+            missing = [str(user_id) for user_id in value
+                       if user_id not in found]
+            if missing:
+                raise serializers.ValidationError(
+                    f"Unknown users: {', '.join(missing)}."
+                )
+            return value
+
+    class MembersOutputSerializer(serializers.Serializer):
+        """
+        Serializer for representing the users added to a group.
+        """
+        added = serializers.ListField(child=serializers.UUIDField())
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        request=MembersInputSerializer,
+        responses={200: MembersOutputSerializer},
+    )
+    def post(self, request, pk):
+        """
+        Adds users to a group conversation of the authenticated user.
+        - Users who are already members are skipped.
+        """
+        conversation = get_user_conversation(request.user, pk)
+        if not conversation.is_group:
+            return Response({
+                'success': False,
+                'msg': 'Members of a direct conversation can\'t change.',
+                'status': status.HTTP_400_BAD_REQUEST,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.MembersInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            added = add_conversation_members(
+                conversation, serializer.validated_data['members']
+            )
+        except ValidationError as e:
+            return Response({
+                'success': False,
+                'msg': e.messages[0],
+                'status': status.HTTP_400_BAD_REQUEST,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        response = self.MembersOutputSerializer({'added': added})
+        return Response({
+            'success': True,
+            'msg': 'Members added successfully.',
+            'data': response.data,
+            'status': status.HTTP_200_OK,
+        }, status=status.HTTP_200_OK)
+
+
+class ConversationMemberView(APIView):
+    """
+    API view to remove a member from a group conversation.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(responses={200: None})
+    def delete(self, request, pk, user_id):
+        """
+        Removes a member from a group conversation.
+        - Members can leave, the creator of the group can remove anyone.
+        """
+        conversation = get_user_conversation(request.user, pk)
+        if not conversation.is_group:
+            return Response({
+                'success': False,
+                'msg': 'Members of a direct conversation can\'t change.',
+                'status': status.HTTP_400_BAD_REQUEST,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if (user_id != request.user.id
+                and conversation.created_by_id != request.user.id):
+            return Response({
+                'success': False,
+                'msg': 'Only the creator of the group can remove members.',
+                'status': status.HTTP_403_FORBIDDEN,
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        remove_conversation_member(conversation, user_id)
+        return Response({
+            'success': True,
+            'msg': 'Member removed successfully.',
+            'status': status.HTTP_200_OK,
+        }, status=status.HTTP_200_OK)
+
+
+class ConversationListView(APIView):
+    """
+    API view to display the inbox: the conversations of the authenticated
+    user, most recently active first, and to create group conversations.
+    """
+    class FilterSerializer(serializers.Serializer):
+        """
+        Serializer for the inbox query parameters.
+        """
+        before = serializers.CharField(required=False)
+        after = serializers.CharField(required=False)
+        limit = serializers.IntegerField(required=False, default=50,
+                                         min_value=1, max_value=100)
+
+        def validate(self, attrs):
+            if 'before' in attrs and 'after' in attrs:
+                raise serializers.ValidationError(
+                    "Use either before or after, not both."
+                )
+
+            for name in ('before', 'after'):
+                if name in attrs:
+                    try:
+                        decode_cursor(attrs[name], len(INBOX_ORDERING),
+                                      INBOX_CURSOR_PARSERS)
+                    except ValueError:
+                        raise serializers.ValidationError({
+                            name: "Invalid cursor."
+                        })
+
+            return attrs
+
+    class InboxOutputSerializer(serializers.Serializer):
+        """
+        Serializer for representing a page of conversations with its
+        cursors.
+        """
+        class ConversationSerializer(serializers.ModelSerializer):
+            """
+            Nested Serializer for representing a conversation with its
+            latest message.
+            """
+            class UserSerializer(serializers.ModelSerializer):
+                """
+                Nested Serializer for representing user
+                """
+                class Meta:
+                    model = User
+                    fields = ['id', 'first_name', 'last_name']
+
+            class LastMessageSerializer(serializers.ModelSerializer):
+                """
+                Nested Serializer for representing a message preview.
+                """
+                text = serializers.SerializerMethodField()
+
+                class Meta:
+                    model = ConversationMessage
+                    fields = ['id', 'text', 'sender', 'created_at']
+
+                def get_text(self, obj) -> str:
+                    return Truncator(obj.text).chars(INBOX_PREVIEW_LENGTH)
+
+            members = UserSerializer(many=True, source='member_preview')
+            member_count = serializers.IntegerField()
+            last_message = LastMessageSerializer(allow_null=True)
+            unread_count = serializers.IntegerField()
+            is_group = serializers.BooleanField()
+
+            class Meta:
+                model = Conversation
+                fields = ['id', 'name', 'is_group', 'members',
+                          'member_count', 'last_message', 'unread_count',
+                          'modified_at']
+
+        results = ConversationSerializer(many=True)
+        has_more = serializers.BooleanField()
+        before = serializers.CharField(allow_null=True)
+        after = serializers.CharField(allow_null=True)
+
+    class GroupInputSerializer(ConversationMemberListView
+                               .MembersInputSerializer):
+        """
+        Serializer for creating a group conversation.
+        """
+        name = serializers.CharField(max_length=100, allow_blank=True)
+
+    class GroupOutputSerializer(serializers.ModelSerializer):
+        """
+        Serializer for representing a created group conversation.
+        """
+        member_count = serializers.SerializerMethodField()
 
         class Meta:
             model = Conversation
-            fields = ['id', 'messages']
+            fields = ['id', 'name', 'created_by', 'member_count',
+                      'created_at']
+
+        def get_member_count(self, obj) -> int:
+            return obj.members.count()
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        parameters=[FilterSerializer],
+        responses={200: InboxOutputSerializer},
+    )
+    def get(self, request):
+        """
+        Displays conversations with their latest message and unread count.
+        - `before`: cursor to load less recently active conversations.
+        - `after`: cursor to load more recently active conversations.
+        """
+        filters = self.FilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+
+        page = get_user_inbox(request.user, **filters.validated_data)
+
+        response = self.InboxOutputSerializer(page)
+        return Response({
+            'success': True,
+            'msg': 'Conversations retrieved successfully.',
+            'data': response.data,
+            'status': status.HTTP_200_OK,
+        }, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        request=GroupInputSerializer,
+        responses={201: GroupOutputSerializer},
+    )
+    def post(self, request):
+        """
+        Creates a group conversation of the authenticated user and the
+        given members.
+        """
+        serializer = self.GroupInputSerializer(
+            data=request.data, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        # The members are checked against CHAT_GROUP_MAX_MEMBERS with the
+        # creator counted
+        try:
+            conversation = create_group_conversation(
+                request.user, serializer.validated_data['name'],
+                serializer.validated_data['members']
+            )
+        except ValidationError as e:
+            return Response({
+                'success': False,
+                'msg': e.messages[0],
+                'status': status.HTTP_400_BAD_REQUEST,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        response = self.GroupOutputSerializer(conversation)
+        return Response({
+            'success': True,
+            'msg': 'Group conversation created successfully.',
+            'data': response.data,
+            'status': status.HTTP_201_CREATED,
+        }, status=status.HTTP_201_CREATED)
+
+
+class UserChatView(APIView):
+    """
+    API view to display conversation (chat) between users
+    """
+    class ChatOutputSerializer(serializers.Serializer):
+        """
+        Serializer for representing a conversation -
+        with the latest page of its messages.
+        - Older messages are loaded from ConversationMessageListView
+          with the `before` cursor.
+        """
+        id = serializers.UUIDField()
+        messages = ConversationMessageListView.MessagesOutputSerializer\
+            .MessageSerializer(many=True)
+        has_more = serializers.BooleanField()
+        before = serializers.CharField(allow_null=True)
+        after = serializers.CharField(allow_null=True)
 
     permission_classes = [permissions.IsAuthenticated]
 
@@ -143,10 +833,53 @@ class UserChatView(APIView):
         # Create conversation if it doesn't exist
         conversation = get_or_create_conversation(request.user, recipient_user)
 
-        response = self.ChatOutputSerializer(conversation)
+        page = get_conversation_messages(
+            conversation.id, archive_seq=conversation.archive_seq
+        )
+
+        response = self.ChatOutputSerializer({
+            'id': conversation.id,
+            'messages': page['results'],
+            'has_more': page['has_more'],
+            'before': page['before'],
+            'after': page['after'],
+        })
         return Response({
             'success': True,
             'msg': 'User conversation with messages retrieved successfully.',
             'data': response.data,
             'status': status.HTTP_200_OK,
         }, status=status.HTTP_200_OK)
+
+
+class MetricsView(View):
+    """
+    Exposes the metrics of this process in the Prometheus text format.
+    - Only available with a backend that can render them, e.g.
+      app.metrics.InMemoryMetrics.
+    - Only answers staff users and CHAT_METRICS_ALLOWED_IPS.
+    """
+    def has_permission(self, request):
+        if request.user.is_staff:
+            return True
+
+        try:
+            address = ipaddress.ip_address(request.META.get('REMOTE_ADDR'))
+        except ValueError:
+            return False
+        return any(
+            address in ipaddress.ip_network(network)
+            for network in settings.CHAT_METRICS_ALLOWED_IPS
+        )
+
+    def get(self, request):
+        if not self.has_permission(request):
+            raise PermissionDenied
+
+        metrics = get_metrics()
+        if not hasattr(metrics, 'render'):
+            raise Http404
+
+        return HttpResponse(metrics.render(),
+                            content_type='text/plain; version=0.0.4; '
+                                         'charset=utf-8')
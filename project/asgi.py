@@ -4,16 +4,21 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
-from app.channel_auth_middleware import JWTAuthMiddlewareStack
-from app.routing import websocket_urlpatterns
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
+# Set Django up before importing code that uses models
+django_asgi_app = get_asgi_application()
+
+from app.channel_auth_middleware import JWTAuthMiddlewareStack  # noqa: E402
+from app.lifespan import LifespanApp  # noqa: E402
+from app.routing import websocket_urlpatterns  # noqa: E402
+
 application = ProtocolTypeRouter(
     {
-        "http": get_asgi_application(),
+        "http": django_asgi_app,
         "websocket": AllowedHostsOriginValidator(
             JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
         ),
+        "lifespan": LifespanApp(),
     }
 )
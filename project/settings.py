@@ -1,5 +1,7 @@
+import os
 from pathlib import Path
 from datetime import timedelta
+from project.database import database_config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -68,12 +70,30 @@ ASGI_APPLICATION = 'project.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
-
+# - DATABASE_URL picks the database, e.g.
+#   "postgres://chat:secret@db:5432/chat" (needs a PostgreSQL driver),
+#   defaults to the SQLite file db.sqlite3.
+# - Connections are kept for DATABASE_CONN_MAX_AGE seconds (default 60)
+#   and checked before reuse, broken ones are replaced. WebSocket
+#   consumers and the workers make their database calls in one shared
+#   thread and reuse its connection. HTTP views under ASGI run each
+#   request in a new thread, their connections are closed when the
+#   request finishes. Django 4.2 has no connection pool, put pgBouncer in
+#   transaction mode in front of server databases to make those connects
+#   cheap, with DATABASE_DISABLE_SERVER_SIDE_CURSORS set.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(os.environ,
+                               f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
+}
+
+# Journal mode set on the first SQLite connection of a process, it is
+# stored in the database file. WAL lets readers run during a write.
+CHAT_SQLITE_JOURNAL_MODE = 'wal'
+# PRAGMAs run on every new SQLite connection, they only last for the
+# connection. NORMAL sync is safe with WAL and skips an fsync per commit.
+CHAT_SQLITE_PRAGMAS = {
+    'synchronous': 'normal',
+    'mmap_size': 268435456,
 }
 
 
@@ -134,13 +154,229 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
 }
 
+# WebSocket JWT authentication (app.channel_auth_middleware)
+# - Verified tokens are cached for CHAT_JWT_CACHE_TTL seconds (never past
+#   their expiry) and users for CHAT_JWT_USER_CACHE_TTL seconds.
+# - CHAT_JWT_STATELESS_USER builds the user from the token claims without
+#   any database query.
+CHAT_JWT_CACHE_SIZE = 10000
+CHAT_JWT_CACHE_TTL = 300
+CHAT_JWT_USER_CACHE_TTL = 60
+CHAT_JWT_STATELESS_USER = False
+
 # Django Channels
-# - Using InMemoryChannelLayer
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+# - Using InMemoryChannelLayer by default, which only reaches sockets of
+#   the same process.
+# - Set CHAT_CHANNEL_LAYER_HOSTS to a comma separated list of Redis protocol
+#   servers (e.g. "redis://10.0.0.1:6379,redis://10.0.0.2:6379") to shard
+#   groups across them and run several workers.
+CHAT_CHANNEL_LAYER_HOSTS = [
+    host.strip()
+    for host in os.environ.get('CHAT_CHANNEL_LAYER_HOSTS', '').split(',')
+    if host.strip()
+]
+
+if CHAT_CHANNEL_LAYER_HOSTS:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'app.channel_layers.ShardedChannelLayer',
+            'CONFIG': {
+                'hosts': CHAT_CHANNEL_LAYER_HOSTS,
+                # Seconds a message waits in a channel before it's dropped
+                'expiry': 60,
+                # Seconds a channel stays in a group without being re-added
+                'group_expiry': 86400,
+                # Messages a channel holds before sends to it are refused
+                'capacity': 100,
+            },
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        }
+    }
+
+# Metrics
+# - None disables instrumentation, every hook is then a no-op.
+# - 'app.metrics.InMemoryMetrics' keeps counters, gauges and timings in
+#   process memory and serves them at /metrics/ in the Prometheus text
+#   format.
+# - /metrics/ answers staff users and clients whose address is in
+#   CHAT_METRICS_ALLOWED_IPS (addresses or networks, e.g. "10.0.0.0/8").
+#   Behind a proxy that is the proxy address, block the path there.
+CHAT_METRICS_BACKEND = None
+CHAT_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Group fan-out
+# - 'hybrid': sockets of the same process get group events straight from
+#   the sender, the channel layer only carries them to other processes.
+# - 'layer': every socket joins the channel layer group.
+CHAT_FANOUT_MODE = 'hybrid'
+# Seconds between re-adds of the hybrid relay channels to their channel
+# layer groups, keep it below the layer's group_expiry.
+CHAT_FANOUT_REFRESH_INTERVAL = 3600
+
+# Batched delivery frames
+# - Clients connecting with `?batch=1` or the `chat.batch.v1` subprotocol
+#   get their events as JSON arrays. The first event after an idle period
+#   is sent right away, later ones are coalesced for CHAT_BATCH_WINDOW_MS
+#   or until CHAT_BATCH_MAX_MESSAGES are waiting.
+CHAT_BATCH_WINDOW_MS = 15
+CHAT_BATCH_MAX_MESSAGES = 50
+
+# Wire formats and compression
+# - Clients pick JSON text frames (default) or MessagePack binary frames
+#   with `?format=msgpack` or the `chat.msgpack.v1` subprotocol
+#   (`chat.msgpack.batch.v1` for batched MessagePack frames).
+# - permessage-deflate is negotiated by app.server.ChatServer, run it with
+#   `python -m app.server project.asgi:application`.
+# - Without context takeover each message is compressed on its own, which
+#   compresses less. Fewer window bits shrink the zlib buffers of every
+#   connection, also at the cost of ratio.
+CHAT_WS_COMPRESSION = True
+CHAT_WS_COMPRESSION_NO_CONTEXT_TAKEOVER = False
+CHAT_WS_COMPRESSION_WINDOW_BITS = None
+
+# Presence and typing indicators
+# - Kept in the memory of each process, never in the database. A socket
+#   is offline CHAT_PRESENCE_TTL seconds after its last frame or heartbeat.
+# - Typing indicators are sent at most once per CHAT_TYPING_INTERVAL_MS
+#   per socket, extra ones are dropped.
+CHAT_PRESENCE_TTL = 60
+CHAT_TYPING_INTERVAL_MS = 1000
+
+# Read receipts
+# - Read and delivered acks of a socket are collapsed and saved at most
+#   once per CHAT_ACK_FLUSH_INTERVAL_MS, then sent to the other members.
+CHAT_ACK_FLUSH_INTERVAL_MS = 1000
+
+# Missed message replay
+# - Each group keeps its latest CHAT_REPLAY_BUFFER_SIZE messages in memory
+#   while it has sockets in the process. Clients reconnecting with
+#   `?last_seq=` get the messages they missed from it, or from the
+#   database when it doesn't cover the gap.
+# - At most CHAT_REPLAY_MAX_MESSAGES are replayed, clients missing more
+#   fetch the rest from the history API.
+CHAT_REPLAY_BUFFER_SIZE = 256
+CHAT_REPLAY_MAX_MESSAGES = 500
+
+# Admission control and rate limiting, counted per process
+# - Messages are limited with token buckets per user and per conversation,
+#   the *_RATE per second on average with bursts of up to *_BURST. Extra
+#   messages are refused before they reach the database.
+# - Sockets beyond CHAT_MAX_CONNECTIONS_PER_USER for one user or
+#   CHAT_MAX_CONNECTIONS_PER_WORKER in total are refused.
+# - A socket with CHAT_SLOW_CONSUMER_QUEUE_SIZE events waiting to be sent
+#   is a slow consumer: with CHAT_SLOW_CONSUMER_POLICY 'drop' further
+#   events are dropped, with 'close' the socket is closed. Events from
+#   the channel layer are counted too, in both CHAT_FANOUT_MODEs.
+# - None disables a limit.
+CHAT_USER_MESSAGE_RATE = 10
+CHAT_USER_MESSAGE_BURST = 20
+CHAT_CONVERSATION_MESSAGE_RATE = 30
+CHAT_CONVERSATION_MESSAGE_BURST = 60
+CHAT_MAX_CONNECTIONS_PER_USER = 20
+CHAT_MAX_CONNECTIONS_PER_WORKER = 10000
+CHAT_SLOW_CONSUMER_QUEUE_SIZE = 1000
+CHAT_SLOW_CONSUMER_POLICY = 'close'
+
+# Group conversations
+# - At most CHAT_GROUP_MAX_MEMBERS members per group, creator included.
+# - The member ids of a conversation are loaded once per process and
+#   shared by its sockets while it has any. They are reloaded when
+#   members change, and at the latest after CHAT_MEMBERSHIP_TTL seconds.
+# - Sockets are authorized against the conversation ids of their user,
+#   cached for CHAT_USER_CONVERSATIONS_TTL seconds (for at most
+#   CHAT_USER_CONVERSATIONS_CACHE_SIZE users) and dropped when the user's
+#   memberships change in this process. A conversation missing from them
+#   is looked up again at most once per
+#   CHAT_USER_CONVERSATIONS_REFRESH_INTERVAL seconds per user, so members
+#   added through another process can connect.
+CHAT_GROUP_MAX_MEMBERS = 5000
+CHAT_MEMBERSHIP_TTL = 300
+CHAT_USER_CONVERSATIONS_CACHE_SIZE = 10000
+CHAT_USER_CONVERSATIONS_TTL = 300
+CHAT_USER_CONVERSATIONS_REFRESH_INTERVAL = 5
+
+# User directory (UserListView)
+# - The first page without search is kept in the default cache for
+#   CHAT_USER_DIRECTORY_CACHE_TTL seconds, and dropped when a user
+#   registers or changes. With the default per-process memory cache,
+#   other processes may serve it until it expires.
+CHAT_USER_DIRECTORY_CACHE_TTL = 30
+
+# Message archive
+# - `python manage.py archive_messages` moves messages older than
+#   CHAT_ARCHIVE_AFTER_DAYS into gzip'd JSON lines segments of up to
+#   CHAT_ARCHIVE_SEGMENT_SIZE messages under CHAT_ARCHIVE_DIR. The history
+#   API keeps reading them when clients scroll back that far.
+# - The CHAT_ARCHIVE_CACHE_SIZE most recently read segments are kept
+#   decoded in memory.
+CHAT_ARCHIVE_DIR = os.environ.get('CHAT_ARCHIVE_DIR', BASE_DIR / 'archive')
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_SEGMENT_SIZE = 1000
+CHAT_ARCHIVE_CACHE_SIZE = 64
+
+# Message search
+# - 'fts5': SQLite FTS5 table, kept up to date by triggers.
+# - 'table': MessageSearchTerm rows, written with each batch of messages.
+# - 'auto': 'fts5' on SQLite, 'table' on other databases.
+# Archived messages are removed from the index with their rows.
+CHAT_SEARCH_BACKEND = os.environ.get('CHAT_SEARCH_BACKEND', 'auto')
+CHAT_SEARCH_SNIPPET_TOKENS = 12
+
+# Message attachments
+# - Uploads are streamed to CHAT_ATTACHMENT_DIR in
+#   CHAT_ATTACHMENT_CHUNK_SIZE byte chunks, hashed on the way, and stored
+#   once per content under their SHA-256.
+# - Uploads over CHAT_ATTACHMENT_MAX_SIZE bytes are refused.
+# - With CHAT_ATTACHMENT_ACCEL_REDIRECT set, e.g. '/protected/attachments/'
+#   mapped to CHAT_ATTACHMENT_DIR by an nginx `internal` location,
+#   downloads are handed to nginx with X-Accel-Redirect. Otherwise they
+#   are served with FileResponse.
+CHAT_ATTACHMENT_DIR = os.environ.get('CHAT_ATTACHMENT_DIR',
+                                     BASE_DIR / 'attachments')
+CHAT_ATTACHMENT_MAX_SIZE = 25 * 1024 * 1024
+CHAT_ATTACHMENT_CHUNK_SIZE = 64 * 1024
+CHAT_ATTACHMENT_ACCEL_REDIRECT = os.environ.get(
+    'CHAT_ATTACHMENT_ACCEL_REDIRECT'
+)
+
+# Database access from the event loop
+# - False: every database call of the consumer and the WebSocket auth
+#   middleware is one database_sync_to_async call on the thread pool.
+# - True: reads and receipt updates use the async ORM (aget, aupdate,
+#   async iteration). Django 4.2 still runs each query through
+#   sync_to_async, and message writes need a transaction, so they stay
+#   one sync call. Compare both with `chatbench --orm`.
+CHAT_ASYNC_ORM = False
+
+# Chat message persistence
+# - 'sync': every message is saved in its own transaction.
+# - 'batched': messages are queued and saved with bulk_create once
+#   CHAT_MESSAGE_BATCH_SIZE messages are queued or
+#   CHAT_MESSAGE_BATCH_INTERVAL_MS passed, whichever comes first.
+#   Messages are numbered in the batch transaction and sent to the
+#   members once saved, up to CHAT_MESSAGE_BATCH_INTERVAL_MS later.
+CHAT_MESSAGE_PERSISTENCE = 'sync'
+CHAT_MESSAGE_BATCH_SIZE = 100
+CHAT_MESSAGE_BATCH_INTERVAL_MS = 50
+# Consumers wait for room once this many messages are queued
+CHAT_MESSAGE_QUEUE_SIZE = 10000
+# Failed batches are retried this many times, then saved message by
+# message
+CHAT_MESSAGE_WRITE_RETRIES = 3
+
+# Connection draining, started with SIGUSR1 or `drain_connections`
+# - New sockets are refused, open ones get a `reconnect` frame asking the
+#   client to come back after a random delay of up to
+#   CHAT_DRAIN_RECONNECT_JITTER_MS, then queued messages are saved.
+# - Sockets still open are closed with code 1012 at
+#   CHAT_DRAIN_CLOSE_RATE per second.
+CHAT_DRAIN_CLOSE_RATE = 100
+CHAT_DRAIN_RECONNECT_JITTER_MS = 10000
 
 # DRF-SPECTACULAR
 SPECTACULAR_SETTINGS = {
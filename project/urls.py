@@ -1,11 +1,15 @@
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from django.contrib import admin
 from django.urls import path, include
+from app.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('app.urls')),
 
+    # Prometheus metrics of this process
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+
     # Swagger Docs
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),